@@ -21,19 +21,41 @@ import os
 import sys
 import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from io import BytesIO
 from datetime import datetime
 
+# Shared pipeline package lives next to the vertex-test scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "vertex-test"))
+
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality
-    from PIL import Image, ImageEnhance, ImageFilter
+    from PIL import Image
 except ImportError as e:
     print("Missing required packages. Install them with:")
     print("  pip install google-genai Pillow")
     sys.exit(1)
 
+from pipeline import enhanced_upscale
+from pipeline.backend import add_backend_argument, make_client
+from pipeline.errors import classify
+from pipeline.fanout import MATCH_CONCURRENCY, fan_out
+from pipeline.postpool import PostProcessPool
+from pipeline.postprocess import format_timings, upscale
+from pipeline.ratelimit import RateLimiter
+from pipeline.retry import RetryBudget, RetryPolicy
+from pipeline.breaker import CircuitBreaker
+from pipeline.cache import ResponseCache
+from pipeline.client import last_call
+from pipeline.hedge import Hedged, MAX_HEDGES
+from pipeline.memory import MB, MemoryBudget, add_memory_argument
+from pipeline.metrics import METRICS, add_metrics_argument, enable_metrics
+from pipeline.payload import PAYLOADS, decode_image, load_image, save_image
+from pipeline.routing import ModelRouter
+from pipeline.session import build_client
+from pipeline.trace import add_trace_argument, enable_tracing, save_trace, set_trace_attributes
+from pipeline.upscale import fit_target_size
+
 
 # ============================================================================
 # CONFIGURATION
@@ -42,19 +64,43 @@ except ImportError as e:
 # Gemini 3 Pro Image model (supports image generation, up to 4096px)
 MODEL_NAME = "gemini-3-pro-image-preview"
 
-# Alternative model: Gemini 2.5 Flash Image (faster/cheaper, up to 1024px)
+# Fallback chain when the model is saturated, unavailable or over the
+# latency SLO: Gemini 2.5 Flash Image (faster/cheaper, up to 1024px)
 FALLBACK_MODELS = [
     "gemini-2.5-flash-image",
 ]
 
-# Rate limiting settings
-MAX_RETRIES = 3
-RETRY_DELAY = 30  # seconds
-BETWEEN_PHOTO_DELAY = 5  # seconds
+# Retry settings: attempts per request (backoff 1s, 2s, 4s... with jitter,
+# or the server's retry hint) and retries allowed for the whole run
+MAX_ATTEMPTS = 4
+SESSION_RETRY_BUDGET = 20
+
+# Requests per minute per model; the limiter learns lower rates from 429s
+MODEL_RPM = {
+    "gemini-3-pro-image-preview": 10,
+    "gemini-2.5-flash-image": 30,
+}
+
+# Circuit breaker per model and location: open once this share of the last
+# BREAKER_WINDOW calls failed (UNAVAILABLE, 5xx, timeouts), fail fast or fall
+# back while open, then probe with a single request after BREAKER_OPEN_SECONDS
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_WINDOW = 10
+BREAKER_OPEN_SECONDS = 30
+
+# Requests in flight at once across all styles
+REQUEST_BUDGET = 4
 
 # Output settings
 TARGET_WIDTH = 2400
 
+# Per-photo upscale memory ceiling; 4096px model outputs stream in bands above it
+UPSCALE_MEMORY_LIMIT = 128 * 1024 * 1024  # bytes
+
+# Post-processing when photos are finished on worker processes (--post-workers);
+# the same as the inline enhanced_upscale call
+POST_PROCESS = [upscale(color=1.0)]
+
 
 # ============================================================================
 # STYLE CONFIGURATIONS
@@ -153,25 +199,6 @@ CRITICAL RULES:
 # IMAGE PROCESSING
 # ============================================================================
 
-def enhanced_upscale(img: Image.Image, target_size: tuple = None, scale: float = 2.0) -> Image.Image:
-    """Multi-pass enhanced upscaling."""
-    if target_size:
-        new_width, new_height = target_size
-    else:
-        new_width = int(img.width * scale)
-        new_height = int(img.height * scale)
-
-    upscaled = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    smoothed = upscaled.filter(ImageFilter.GaussianBlur(radius=0.3))
-    sharpened = smoothed.filter(ImageFilter.UnsharpMask(radius=1.5, percent=80, threshold=2))
-    result = Image.blend(upscaled, sharpened, alpha=0.7)
-
-    enhancer = ImageEnhance.Contrast(result)
-    result = enhancer.enhance(1.02)
-
-    return result
-
-
 def process_style(
     style_key: str,
     style_config: dict,
@@ -179,9 +206,21 @@ def process_style(
     output_dir: Path,
     client,
     timestamp: str,
-    model_name: str
+    model_name: str,
+    pool: PostProcessPool = None,
+    match_concurrency: int = MATCH_CONCURRENCY,
+    memory: MemoryBudget = None
 ) -> list:
-    """Process all images with a specific style."""
+    """
+    Process all images with a specific style.
+
+    Once the master is done, the match calls run concurrently (up to
+    match_concurrency; 1 runs them one at a time). With a pool, photos
+    after the master are upscaled and saved on worker processes. Under
+    memory pressure the master reference is downscaled and upscales stream
+    (see pipeline.memory).
+    """
+    memory = memory or MemoryBudget()
 
     print(f"\n{'='*70}")
     print(f"STYLE: {style_config['name']}")
@@ -189,7 +228,8 @@ def process_style(
     print(f"Model: {model_name}")
     print("=" * 70)
 
-    pil_inputs = [Image.open(p) for p in input_images]
+    set_trace_attributes(style=style_key, model=model_name)
+    pil_inputs = [load_image(p) for p in input_images]
 
     target_height = int(TARGET_WIDTH * pil_inputs[0].height / pil_inputs[0].width)
     print(f"Target output: {TARGET_WIDTH}x{target_height}")
@@ -199,17 +239,19 @@ def process_style(
         response_modalities=[Modality.TEXT, Modality.IMAGE],
     )
 
-    master_output = None
-    output_paths = []
+    pending = []
 
-    for i in range(len(input_images)):
+    def process_photo(i: int, master_output: Image.Image = None):
+        """Generate and upscale one photo. Returns (saved path, Gemini output)."""
         photo_num = i + 1
+        tag = f"    [{style_key} {photo_num}/{len(input_images)}]"
+        set_trace_attributes(photo=photo_num)
         print(f"\n  Photo {photo_num}/{len(input_images)}: {input_images[i].name}")
 
         if i == 0:
             prompt = style_config["prompt_master"]
             contents = [pil_inputs[0], prompt]
-            print("    Creating MASTER style...")
+            print(f"{tag} Creating MASTER style...")
         else:
             prompt = f"""Match the style from the REFERENCE image to the TARGET photo.
 
@@ -225,57 +267,64 @@ PRESERVE FROM TARGET:
 Images: [REFERENCE master, TARGET input]
 OUTPUT: High-resolution image matching reference style."""
             contents = [master_output, pil_inputs[i], prompt]
-            print("    Matching to MASTER...")
+            print(f"{tag} Matching to MASTER...")
 
+        # Retries (classified, with backoff) happen inside the client stack
         output_image = None
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=contents,
-                    config=config,
-                )
-
-                for part in response.candidates[0].content.parts:
-                    if part.inline_data:
-                        output_image = Image.open(BytesIO(part.inline_data.data))
-                        break
-
-                if output_image:
-                    break
-
-            except Exception as e:
-                error_str = str(e)
-                if "429" in error_str or "503" in error_str or "RESOURCE_EXHAUSTED" in error_str or "UNAVAILABLE" in error_str:
-                    if attempt < MAX_RETRIES - 1:
-                        print(f"    Rate limited, waiting {RETRY_DELAY}s... (attempt {attempt + 1}/{MAX_RETRIES})")
-                        time.sleep(RETRY_DELAY)
-                        continue
-                print(f"    ERROR: {e}")
-                break
+        try:
+            response = client.models.generate_content(
+                model=model_name,
+                contents=contents,
+                config=config,
+            )
 
-        if not output_image:
-            print("    FAILED: No image returned")
-            continue
+            output_image = decode_image(response)
 
-        print(f"    Gemini output: {output_image.width}x{output_image.height}")
+        except Exception as e:
+            print(f"{tag} ERROR ({classify(e)}): {e}")
 
-        if i == 0:
-            master_output = output_image
+        if not output_image:
+            print(f"{tag} FAILED: No image returned")
+            return None, None
 
-        print(f"    Upscaling to {TARGET_WIDTH}x{target_height}...")
-        upscaled = enhanced_upscale(output_image, target_size=(TARGET_WIDTH, target_height))
+        print(f"{tag} Gemini output: {output_image.width}x{output_image.height} from {last_call().model_served}")
+        # Fallback models answer smaller and possibly in another shape
+        size = fit_target_size(output_image, (TARGET_WIDTH, target_height))
 
         output_path = output_dir / f"{style_key}_{timestamp}_{photo_num}.png"
-        upscaled.save(output_path, "PNG")
-        print(f"    SAVED: {output_path.name} ({upscaled.width}x{upscaled.height})")
-        output_paths.append(output_path)
 
-        if i < len(input_images) - 1:
-            print(f"    Waiting {BETWEEN_PHOTO_DELAY}s before next photo...")
-            time.sleep(BETWEEN_PHOTO_DELAY)
+        max_memory = memory.upscale_memory(output_image, size, UPSCALE_MEMORY_LIMIT)
+        if pool and i > 0:
+            pending.append(pool.submit(POST_PROCESS, output_image, size, output_path, max_memory))
+            print(f"{tag} Queued for upscaling: {output_path.name}")
+            return None, output_image
+
+        print(f"{tag} Upscaling to {size[0]}x{size[1]}...")
+        upscaled = enhanced_upscale(output_image, target_size=size, color=1.0, max_memory=max_memory)
+        save_image(upscaled, output_path, "PNG")
+        print(f"{tag} SAVED: {output_path.name} ({upscaled.width}x{upscaled.height})")
+        return output_path, output_image
+
+    # Master first; the matches only depend on it, so they go out together
+    master_path, master_output = process_photo(0)
+    if master_output is None:
+        print("    No MASTER output, skipping the remaining photos")
+        return []
+
+    reference = memory.reference(master_output)
+    matches = fan_out(lambda i: process_photo(i, reference)[0],
+                      range(1, len(input_images)), match_concurrency)
+    output_paths = [p for p in [master_path] + matches if p]
+
+    for future in pending:
+        try:
+            saved = future.result()
+            print(f"    SAVED: {saved.path.name} ({saved.size[0]}x{saved.size[1]}) {format_timings(saved.timings)}")
+            output_paths.append(saved.path)
+        except Exception as e:
+            print(f"    ERROR: upscaling failed: {e}")
 
-    return output_paths
+    return sorted(output_paths)
 
 
 # ============================================================================
@@ -303,15 +352,57 @@ def main():
         default=4,
         help="Number of photos to process (default: 4)"
     )
+    parser.add_argument(
+        "--post-workers",
+        type=int,
+        default=0,
+        help="Upscale and save on this many worker processes (default: 0, inline)"
+    )
+    parser.add_argument(
+        "--match-concurrency",
+        type=int,
+        default=MATCH_CONCURRENCY,
+        help=f"Match-to-master requests in flight at once (default: {MATCH_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--request-budget",
+        type=int,
+        default=REQUEST_BUDGET,
+        help=f"Requests in flight at once across all styles (default: {REQUEST_BUDGET})"
+    )
+    parser.add_argument(
+        "--hedge",
+        type=float,
+        metavar="PERCENTILE",
+        help="Send a duplicate request once a call is slower than this percentile "
+             f"of observed latency, e.g. 90 (at most {MAX_HEDGES} per run; default: off)"
+    )
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Run styles one after another instead of concurrently"
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse on-disk responses for identical requests (default: GEMINI_CACHE, off)"
+    )
+    add_backend_argument(parser)
+    add_trace_argument(parser)
+    add_metrics_argument(parser)
+    add_memory_argument(parser)
     args = parser.parse_args()
+    if args.hedge is not None and not 0 < args.hedge <= 100:
+        parser.error(f"--hedge is a percentile in (0, 100], e.g. 90 for p90; got {args.hedge:g}")
 
     print("=" * 70)
     print("GEMINI FLASH PHOTO BOOTH STYLE TEST")
     print("=" * 70)
 
     # Environment setup
+    backend = args.backend
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         print("Run: source .env")
         print("  or: export GOOGLE_CLOUD_PROJECT=your-project-id")
@@ -354,39 +445,86 @@ def main():
     print(f"\nStyles to test: {', '.join(styles_to_run)}")
 
     # Process
-    client = genai.Client()
+    limiter = RateLimiter(MODEL_RPM)
+    retry_budget = RetryBudget(SESSION_RETRY_BUDGET)
+    client = build_client(make_client(backend), limiter, request_budget=args.request_budget,
+                          retry_policy=RetryPolicy(MAX_ATTEMPTS), retry_budget=retry_budget,
+                          chains={args.model: FALLBACK_MODELS},
+                          breaker=dict(failure_rate=BREAKER_FAILURE_RATE, window=BREAKER_WINDOW,
+                                       open_seconds=BREAKER_OPEN_SECONDS),
+                          cache=True if args.cache else None,
+                          hedge_percentile=args.hedge / 100 if args.hedge else None)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    enable_metrics()
+    memory = MemoryBudget(args.memory_limit * MB).start()
+    if args.trace:
+        enable_tracing(session=timestamp, script="test_gemini_flash")
 
-    results = {}
-    for style_key in styles_to_run:
-        style_config = styles[style_key]
+    pool = None
+    if args.post_workers > 0:
+        pool = PostProcessPool(args.post_workers, max_memory=UPSCALE_MEMORY_LIMIT)
+
+    def run_style(style_key: str):
+        start = time.perf_counter()
         outputs = process_style(
             style_key,
-            style_config,
+            styles[style_key],
             input_images,
             output_dir,
             client,
             timestamp,
-            args.model
+            args.model,
+            pool,
+            args.match_concurrency,
+            memory
         )
-        results[style_key] = outputs
+        return outputs, time.perf_counter() - start
+
+    run_start = time.perf_counter()
+    results = {}
+    if args.sequential:
+        for style_key in styles_to_run:
+            results[style_key] = run_style(style_key)
+    else:
+        # Styles are independent; each keeps its own master -> matches order
+        with ThreadPoolExecutor(max_workers=len(styles_to_run)) as executor:
+            futures = {key: executor.submit(run_style, key) for key in styles_to_run}
+            for style_key, future in futures.items():
+                results[style_key] = future.result()
+    total_time = time.perf_counter() - run_start
 
-        # Delay between styles
-        if style_key != styles_to_run[-1]:
-            print(f"\nWaiting 10s before next style...")
-            time.sleep(10)
+    if pool:
+        pool.close()
+    memory.close()
 
     # Summary
     print(f"\n{'='*70}")
     print("SUMMARY")
     print("=" * 70)
 
-    for style_key, outputs in results.items():
+    for style_key, (outputs, wall_time) in results.items():
         style_name = styles[style_key]["name"]
-        print(f"\n{style_name}: {len(outputs)}/{args.photos} photos processed")
+        print(f"\n{style_name}: {len(outputs)}/{args.photos} photos processed in {wall_time:.1f}s")
         for p in outputs:
             print(f"  {p.name}")
 
+    mode = "sequential" if args.sequential else f"concurrent, {args.request_budget} requests in flight"
+    print(f"\nTotal wall time: {total_time:.1f}s ({mode})")
+    print("Rate limits:\n  " + limiter.describe().replace("\n", "\n  "))
+    print(f"Retries: {retry_budget.describe()}")
+    print(f"Models: {client.layer(ModelRouter).describe()}")
+    if client.layer(ResponseCache):
+        print(f"Response cache: {client.layer(ResponseCache).describe()}")
+    print("Circuit breakers:\n  " + client.layer(CircuitBreaker).describe().replace("\n", "\n  "))
+    if args.hedge:
+        print(f"Hedging: {client.layer(Hedged).describe()}")
+    print(f"Payloads: {PAYLOADS.describe()}")
+    print("Memory:\n  " + memory.describe().replace("\n", "\n  "))
+    print("Metrics:\n  " + METRICS.summary().replace("\n", "\n  "))
+    if args.trace:
+        save_trace(args.trace)
+    if args.metrics:
+        METRICS.write(args.metrics)
     print(f"\nOutput directory: {output_dir}")
     return 0
 
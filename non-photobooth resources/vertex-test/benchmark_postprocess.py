@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Post-processing benchmarks.
+
+Times every pipeline kernel and each style's full post-processing chain at
+several model-output resolutions, on the photos in input/ and the sample
+outputs in output/. Reports median and p95 time, peak memory (resident
+set growth while the case runs) and throughput in megapixels per second,
+and writes the results as JSON so runs can be compared.
+
+Each case runs in a fresh process so memory freed by earlier cases (and
+kept by the allocator) does not hide its peak.
+
+No model calls are made, so no project or credentials are needed.
+
+Usage:
+    python benchmark_postprocess.py
+    python benchmark_postprocess.py --sizes 1024 2400 --repeat 3
+    python benchmark_postprocess.py --only upscale newyork
+    python benchmark_postprocess.py --compare benchmarks/postprocess_20260101_120000.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+
+try:
+    import PIL
+    from PIL import Image
+except ImportError as e:
+    print("Missing required packages. Install them with:")
+    print("  pip install Pillow")
+    raise e
+
+from pipeline import (
+    add_film_grain,
+    convert_to_faded_bw,
+    enhance_purikura_effects,
+    enhanced_upscale,
+    ensure_background_color,
+    ensure_white_background,
+    purikura_enhance,
+    run_post_process,
+    upscale_image,
+)
+from pipeline.memory import rss_bytes
+from pipeline.postprocess import faded_bw, film_grain, upscale
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Long edge of the model output each case starts from (1K, the 2400px
+# target, 4K)
+SIZES = [1024, 2400, 4096]
+
+# Timed runs per case, after one warm-up run
+REPEAT = 5
+
+# Output width the scripts upscale to
+TARGET_WIDTH = 2400
+
+# Same seed as test_all_styles_v4.py
+NEWYORK_GRAIN_SEED = 1977
+
+# How often the memory sampler reads the resident set size (seconds)
+MEMORY_SAMPLE_INTERVAL = 0.005
+
+SCRIPT_DIR = Path(__file__).parent
+RESULTS_DIR = SCRIPT_DIR / "benchmarks"
+
+
+def target_size(img: Image.Image) -> tuple:
+    return (TARGET_WIDTH, round(TARGET_WIDTH * img.height / img.width))
+
+
+def improved_upscale(img: Image.Image) -> Image.Image:
+    """upscale_image scaled to 1500px wide, as test_purikura_improved calls it."""
+    return upscale_image(img, max(1.0, 1500 / img.width))
+
+
+def png_save(img: Image.Image) -> Image.Image:
+    """PNG encode as the scripts save their outputs (into memory)."""
+    img.save(BytesIO(), "PNG", quality=100)
+    return img
+
+
+# Single kernels: name -> fn(img)
+KERNELS = {
+    "ensure_background_color": lambda img: ensure_background_color(img, (168, 168, 168), edge_aware=True),
+    "ensure_white_background": lambda img: ensure_white_background(img, threshold=235),
+    "convert_to_faded_bw": convert_to_faded_bw,
+    "add_film_grain": lambda img: add_film_grain(img, 0.015, seed=NEWYORK_GRAIN_SEED),
+    "enhanced_upscale": lambda img: enhanced_upscale(img, target_size=target_size(img)),
+    "purikura_enhance": purikura_enhance,
+    "enhance_purikura_effects": enhance_purikura_effects,
+    "upscale_image": improved_upscale,
+    "png_save": png_save,
+}
+
+
+def _purikura_v4(img):
+    img = ensure_white_background(img, threshold=235)
+    img = enhanced_upscale(img, target_size=target_size(img))
+    return ensure_white_background(purikura_enhance(img), threshold=235)
+
+
+def _purikura_improved(img):
+    return enhance_purikura_effects(improved_upscale(img) if img.width < 1500 else img)
+
+
+# Full per-style chains as the scripts run them: name -> fn(img)
+CHAINS = {
+    "japanese_v4": lambda img: run_post_process([upscale()], img, target_size(img)),
+    "korean_v4": lambda img: run_post_process([upscale()], img, target_size(img)),
+    "newyork_v4": lambda img: run_post_process(
+        [faded_bw(), film_grain(0.015, seed=NEWYORK_GRAIN_SEED), upscale()], img, target_size(img)),
+    "gemini_flash": lambda img: enhanced_upscale(img, target_size=target_size(img), color=1.0),
+    "purikura_v3": lambda img: purikura_enhance(enhanced_upscale(img, target_size=target_size(img))),
+    "purikura_v4": _purikura_v4,
+    "purikura_improved": _purikura_improved,
+}
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+class PeakMemory:
+    """Context manager sampling RSS on a thread; .peak is the growth in bytes."""
+
+    def __enter__(self):
+        self.baseline = rss_bytes()
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes() - self.baseline)
+            self._stop.wait(MEMORY_SAMPLE_INTERVAL)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes() - self.baseline)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def load_source(path: Path, long_edge: int) -> Image.Image:
+    """An image resized so its long edge is long_edge, as a model output would be."""
+    img = Image.open(path).convert("RGB")
+    scale = long_edge / max(img.size)
+    size = (round(img.width * scale), round(img.height * scale))
+    return img.resize(size, Image.Resampling.LANCZOS) if size != img.size else img
+
+
+def _measure(name: str, mode: str, size: tuple, data: bytes, repeat: int) -> dict:
+    """Child process: time case `name` `repeat` times after a warm-up run."""
+    fn = KERNELS.get(name) or CHAINS[name]
+    img = Image.frombytes(mode, size, data)
+    del data
+    times = []
+    # The warm-up run is inside the memory window: it is the one that allocates
+    with PeakMemory() as memory:
+        fn(img)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(img)
+            times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    megapixels = img.width * img.height / 1e6
+    return {
+        "median": median,
+        "p95": percentile(times, 0.95),
+        "peak_mb": memory.peak / (1024 * 1024),
+        "mpix_per_s": megapixels / median if median else None,
+        "times": times,
+    }
+
+
+def run_case(name: str, img: Image.Image, repeat: int) -> dict:
+    """Measure one case on img in a fresh process."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(_measure, (name, img.mode, img.size, img.tobytes(), repeat))
+
+
+# ============================================================================
+# REPORTING
+# ============================================================================
+
+def _case_key(result: dict) -> tuple:
+    return (result["case"], result["image"], result["long_edge"])
+
+
+def print_result(result: dict, previous: dict = None):
+    line = (f"  {result['case']:<26} {result['long_edge']:>5}px  "
+            f"median {result['median'] * 1000:8.1f}ms  p95 {result['p95'] * 1000:8.1f}ms  "
+            f"peak {result['peak_mb']:7.1f}MB  {result['mpix_per_s']:6.1f} MP/s")
+    if previous:
+        line += f"  ({result['median'] / previous['median']:.2f}x previous)"
+    print(line)
+
+
+def load_previous(path: Path) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    return {_case_key(r): r for r in data["results"]}
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def default_images() -> list:
+    inputs = sorted((SCRIPT_DIR / "input").glob("*.jpg")) + sorted((SCRIPT_DIR / "input").glob("*.JPG"))
+    outputs = sorted((SCRIPT_DIR / "output").glob("*.png"))
+    return inputs[:1] + outputs[:1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark post-processing kernels and style chains")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="Long edges of the source images (default: 1024 2400 4096)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Timed runs per case")
+    parser.add_argument("--images", type=Path, nargs="+", default=None,
+                        help="Source images (default: first of input/ and of output/)")
+    parser.add_argument("--only", nargs="+", default=None,
+                        help="Run only cases whose name contains one of these")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Results JSON (default: benchmarks/postprocess_<timestamp>.json)")
+    parser.add_argument("--compare", type=Path, default=None, help="Earlier results JSON to compare with")
+    args = parser.parse_args()
+
+    images = args.images or default_images()
+    if not images:
+        print("Error: no images found in input/ or output/")
+        return 1
+
+    cases = [("kernel", name) for name in KERNELS] + [("chain", name) for name in CHAINS]
+    if args.only:
+        cases = [c for c in cases if any(pattern in c[1] for pattern in args.only)]
+
+    previous = load_previous(args.compare) if args.compare else {}
+
+    print("=" * 70)
+    print("POST-PROCESSING BENCHMARK")
+    print(f"Python {platform.python_version()}, Pillow {PIL.__version__}, {os.cpu_count()} CPUs")
+    print(f"{len(cases)} cases x {len(args.sizes)} sizes x {len(images)} images, {args.repeat} runs each")
+    print("=" * 70)
+
+    results = []
+    for path in images:
+        for long_edge in args.sizes:
+            img = load_source(path, long_edge)
+            print(f"\n{path.name} at {img.width}x{img.height}:")
+            for kind, name in cases:
+                result = {"case": name, "kind": kind, "image": path.name,
+                          "long_edge": long_edge, "size": list(img.size)}
+                result.update(run_case(name, img, args.repeat))
+                results.append(result)
+                print_result(result, previous.get(_case_key(result)))
+
+    output = args.output or RESULTS_DIR / f"postprocess_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
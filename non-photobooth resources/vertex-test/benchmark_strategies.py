@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Session strategy benchmarks.
+
+Runs every session strategy (pipeline.strategies: master, chained, batch,
+individual) on the same input photos and styles, and reports per strategy:
+wall time, model calls, request and response bytes, retries and peak
+memory. Chained sessions upload 1+2+3 extra references, so their payload
+grows quadratically with session size; this puts numbers on it.
+
+Each run happens in a fresh process (so peak memory is the strategy's own)
+with a fresh client stack and the response cache off. Use the live model,
+or the replay backend, which synthesizes an answer for every request:
+
+    python benchmark_strategies.py --backend replay:latency=2
+    python benchmark_strategies.py --strategy master chained --photos 6 --repeat 3
+    python benchmark_strategies.py --compare benchmarks/strategies_20260101_120000.json
+
+Replay answers every request with one synthetic image, so batch finishes
+one photo per session there; its request size is still the real one.
+
+Live runs call the model (photos x styles x strategies x repeats requests,
+plus retries) and need GOOGLE_CLOUD_PROJECT.
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+def _installed(module: str) -> bool:
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:  # parent package missing
+        return False
+
+
+if not all(_installed(m) for m in ("google.genai", "PIL")):
+    print("Missing required packages. Install them with:")
+    print("  pip install google-genai Pillow")
+    sys.exit(1)
+
+from pipeline.backend import add_backend_argument, make_client
+from pipeline.memory import MB, MemoryBudget
+from pipeline.metrics import METRICS, enable_metrics
+from pipeline.payload import load_image
+from pipeline.ratelimit import RateLimiter
+from pipeline.references import ReferenceCompaction, add_references_argument
+from pipeline.session import build_client
+from pipeline.strategies import MODEL_NAME, STRATEGIES, PhotoSession
+from pipeline.trace import set_trace_attributes
+from test_all_styles_v4 import STYLES
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Runs per strategy; the report shows the median
+REPEAT = 1
+
+PHOTOS = 4
+
+SCRIPT_DIR = Path(__file__).parent
+RESULTS_DIR = SCRIPT_DIR / "benchmarks"
+
+# Reported per strategy: result key -> (column title, format)
+COLUMNS = {
+    "wall_s": ("wall", "{:7.1f}s"),
+    "calls": ("calls", "{:5.0f}"),
+    "request_mb": ("up", "{:7.1f}MB"),
+    "response_mb": ("down", "{:7.1f}MB"),
+    "retries": ("retries", "{:4.0f}"),
+    "peak_mb": ("peak", "{:6.0f}MB"),
+}
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+def _measure(strategy_name: str, styles: list, input_paths: list, backend, model: str, rpm: float,
+             plugins: list, compaction: ReferenceCompaction) -> dict:
+    """Child process: run one strategy over every style, return its numbers."""
+    for module in plugins:
+        importlib.import_module(module)
+    enable_metrics()
+    memory = MemoryBudget().start()
+    inputs = [load_image(p) for p in input_paths]
+    limiter = RateLimiter({model: rpm}) if rpm else None
+    client = build_client(make_client(backend), limiter, cache=False)
+    strategy = STRATEGIES[strategy_name]()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    photos = 0
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as output_dir:
+        for style_key in styles:
+            set_trace_attributes(style=style_key, model=model, strategy=strategy_name)
+            session = PhotoSession(client, style_key, STYLES[style_key], inputs, output_dir, timestamp,
+                                   model=model, memory=memory, prefix=f"{style_key}_{strategy_name}",
+                                   compaction=compaction)
+            photos += len(strategy.run(session))
+    wall = time.perf_counter() - start
+    memory.close()
+
+    return {
+        "wall_s": wall,
+        "photos": photos,
+        "calls": METRICS.total("call_latency_seconds"),
+        "request_mb": METRICS.total("request_bytes_total") / MB,
+        "response_mb": METRICS.total("response_bytes_total") / MB,
+        "retries": METRICS.total("retries_total"),
+        "fallbacks": METRICS.total("fallbacks_total"),
+        "failures": METRICS.total("failures_total"),
+        "peak_mb": memory.peak / MB,
+        "growth_mb": (memory.peak - memory.baseline) / MB,
+    }
+
+
+def run_strategy(strategy_name: str, *args) -> dict:
+    """Measure one strategy in a fresh process."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(_measure, (strategy_name,) + args)
+
+
+def median_result(runs: list) -> dict:
+    """Median of every numeric field over repeated runs."""
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+# ============================================================================
+# REPORTING
+# ============================================================================
+
+def print_result(name: str, result: dict, total_photos: int, previous: dict = None):
+    cells = [f"{title} " + fmt.format(result[key]) for key, (title, fmt) in COLUMNS.items()]
+    line = f"  {name:<12} {result['photos']:.0f}/{total_photos} photos  " + "  ".join(cells)
+    if previous:
+        line += f"  ({result['wall_s'] / previous['wall_s']:.2f}x previous wall)"
+    print(line)
+
+
+def load_previous(path: Path) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    return {r["strategy"]: r for r in data["results"]}
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session strategies on the same inputs")
+    parser.add_argument("--strategy", nargs="+", default=None,
+                        help="Strategies to compare (default: all registered)")
+    parser.add_argument("--plugin", nargs="+", default=[], metavar="MODULE",
+                        help="Import these modules first (they register more strategies)")
+    parser.add_argument("--style", nargs="+", choices=list(STYLES), default=["japanese"],
+                        help="Styles each strategy runs (default: japanese)")
+    parser.add_argument("--photos", "-p", type=int, default=PHOTOS, help=f"Photos per session (default: {PHOTOS})")
+    parser.add_argument("--model", "-m", default=MODEL_NAME, help=f"Gemini model (default: {MODEL_NAME})")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Runs per strategy (median reported)")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="Requests per minute for the model (default: the pipeline's MODEL_RPM)")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Results JSON (default: benchmarks/strategies_<timestamp>.json)")
+    parser.add_argument("--compare", type=Path, default=None, help="Earlier results JSON to compare with")
+    add_backend_argument(parser)
+    add_references_argument(parser)
+    args = parser.parse_args()
+
+    for module in args.plugin:
+        importlib.import_module(module)
+    strategies = args.strategy or list(STRATEGIES)
+    unknown = [s for s in strategies if s not in STRATEGIES]
+    if unknown:
+        print(f"Error: unknown strategy {', '.join(unknown)} (have: {', '.join(STRATEGIES)})")
+        return 1
+
+    backend = args.backend
+    if not os.environ.get("GOOGLE_CLOUD_PROJECT") and backend.needs_project:
+        print("Error: GOOGLE_CLOUD_PROJECT not set (or use --backend replay)")
+        return 1
+    os.environ.setdefault("GOOGLE_GENAI_USE_VERTEXAI", "True")
+
+    input_dir = SCRIPT_DIR / "input"
+    input_paths = (sorted(input_dir.glob("*.jpg")) + sorted(input_dir.glob("*.JPG")))[:args.photos]
+    if len(input_paths) < args.photos:
+        print(f"Error: Need {args.photos} images, found {len(input_paths)}")
+        return 1
+
+    previous = load_previous(args.compare) if args.compare else {}
+    total_photos = args.photos * len(args.style)
+
+    print("=" * 70)
+    print("STRATEGY BENCHMARK")
+    print(f"{len(strategies)} strategies x {len(args.style)} styles x {args.photos} photos, "
+          f"{args.repeat} runs each, backend {backend.mode}")
+    print("=" * 70)
+
+    results = []
+    for name in strategies:
+        runs = [run_strategy(name, args.style, input_paths, backend, args.model, args.rpm, args.plugin,
+                             args.references)
+                for _ in range(args.repeat)]
+        result = {"strategy": name, **median_result(runs), "runs": runs}
+        results.append(result)
+        print_result(name, result, total_photos, previous.get(name))
+
+    output = args.output or RESULTS_DIR / f"strategies_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": backend.mode,
+            "model": args.model,
+            "styles": args.style,
+            "photos": args.photos,
+            "repeat": args.repeat,
+            "references": args.references.describe(),
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""
+Shared photo booth pipeline used by the vertex-test and testing scripts.
+
+The test scripts keep their prompts and orchestration; the image kernels
+that used to be copy-pasted between them live here so that every speed
+fix lands once.
+"""
+
+from pipeline.background import ensure_background_color, ensure_white_background
+from pipeline.enhance import enhance_purikura_effects, purikura_enhance
+from pipeline.grain import GrainBank, add_film_grain, grain_texture
+from pipeline.postpool import PostProcessPool, SavedPhoto
+from pipeline.postprocess import compile_plan, run_post_process
+from pipeline.tone import convert_to_faded_bw, faded_bw_lut, gamma_curve
+from pipeline.upscale import enhanced_upscale, upscale_image
+
+__all__ = [
+    "ensure_background_color",
+    "ensure_white_background",
+    "convert_to_faded_bw",
+    "faded_bw_lut",
+    "gamma_curve",
+    "GrainBank",
+    "add_film_grain",
+    "grain_texture",
+    "enhanced_upscale",
+    "upscale_image",
+    "purikura_enhance",
+    "enhance_purikura_effects",
+    "compile_plan",
+    "run_post_process",
+    "PostProcessPool",
+    "SavedPhoto",
+]
@@ -0,0 +1,342 @@
+"""
+Client backends: live, record and replay.
+
+Every script used to need a live Vertex project. The backend option selects
+what sits under the middleware stack instead:
+
+    --backend live      genai.Client() (default)
+    --backend record    genai.Client(), with every call's response or error
+                        and its latency written to RECORDINGS_DIR
+    --backend replay    no network: recorded outcomes are served back
+
+Recordings are keyed like the response cache (pipeline.cache.request_key),
+so a replayed session gets back exactly what its recorded run got, retries
+and errors included, in the order they happened. A request with no
+recording gets a synthetic image (the last input image, resized) so
+orchestration and post-processing still run end to end.
+
+Replay takes a latency and error-injection profile after a colon:
+
+    --backend replay:scale=0.1,error_rate=0.2,errors=503+429,seed=7
+
+    scale       multiply recorded latencies (default 1)
+    latency     fixed seconds per call instead of the recorded ones
+    error_rate  chance of an injected API error before each call
+    errors      HTTP codes to inject, '+'-separated (default 503)
+    seed        seed for the injection, for repeatable runs
+    missing     'synthesize' (default) or 'error' for unrecorded requests
+
+GEMINI_BACKEND sets the default for scripts run without the option.
+Leave the response cache off (the default) when recording or replaying,
+since a cache hit would skip the backend.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from pipeline.cache import request_key
+from pipeline.client import ModelsMiddleware, WrappedClient
+from pipeline.errors import classify, CONNECTION, status_code, TIMEOUT
+from pipeline.responses import response_from_dict, response_to_dict
+
+
+MODES = ("live", "record", "replay")
+
+RECORDINGS_DIR = Path(os.environ.get("GEMINI_RECORDINGS", Path(__file__).resolve().parent.parent / "recordings"))
+
+# Long edge of synthetic images for unrecorded requests (a 1K model output)
+SYNTHETIC_LONG_EDGE = 1024
+
+# RPC status names for injected errors
+ERROR_STATUS = {
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    502: "UNAVAILABLE",
+    503: "UNAVAILABLE",
+    504: "DEADLINE_EXCEEDED",
+}
+
+
+class Backend(namedtuple("Backend", ["mode", "profile"])):
+    """A backend mode and, for replay, its ReplayProfile."""
+
+    @property
+    def needs_project(self) -> bool:
+        return self.mode != "replay"
+
+
+# ============================================================================
+# SELECTING A BACKEND
+# ============================================================================
+
+def parse_backend(value: str) -> Backend:
+    """'live', 'record' or 'replay[:key=value,...]'."""
+    mode, _, options = value.partition(":")
+    if mode not in MODES:
+        raise argparse.ArgumentTypeError(f"backend must be one of {', '.join(MODES)}, got {mode!r}")
+    if options and mode != "replay":
+        raise argparse.ArgumentTypeError("only the replay backend takes a profile")
+    return Backend(mode, ReplayProfile.parse(options) if mode == "replay" else None)
+
+
+def add_backend_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--backend",
+        type=parse_backend,
+        default=parse_backend(os.environ.get("GEMINI_BACKEND", "live")),
+        help="live, record or replay[:scale=..,error_rate=..,errors=..,seed=..] (see pipeline/backend.py)"
+    )
+
+
+def backend_option(argv: list = None) -> Backend:
+    """The --backend option of a script that takes no other arguments."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_backend_argument(parser)
+    args, _ = parser.parse_known_args(argv)
+    return args.backend
+
+
+def make_client(backend: Backend = None):
+    """The client for a backend, ready for build_client()."""
+    backend = backend or backend_option()
+    if backend.mode != "live":
+        print(f"Backend: {backend.mode} ({RECORDINGS_DIR})")
+    if backend.mode == "replay":
+        return ReplayClient(RECORDINGS_DIR, backend.profile)
+
+    from google import genai
+    client = genai.Client()
+    if backend.mode == "record":
+        return WrappedClient(client, Recorder(client.models, RECORDINGS_DIR))
+    return client
+
+
+# ============================================================================
+# RECORDING
+# ============================================================================
+
+def _recording_path(directory: Path, key: str) -> Path:
+    return directory / f"{key}.json"
+
+
+def _error_to_dict(exc: BaseException) -> dict:
+    details = getattr(exc, "details", None)
+    try:
+        json.dumps(details)
+    except (TypeError, ValueError):
+        details = None
+    return {
+        "type": type(exc).__name__,
+        "category": classify(exc),
+        "code": status_code(exc),
+        "status": getattr(exc, "status", None),
+        "message": str(exc),
+        "details": details,
+    }
+
+
+class Recorder(ModelsMiddleware):
+    """
+    Write the outcome of every generate_content call to disk.
+
+    Args:
+        directory: Where recordings are stored
+    """
+
+    def __init__(self, inner, directory: Path = RECORDINGS_DIR):
+        super().__init__(inner)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _append(self, key: str, model: str, outcome: dict):
+        path = _recording_path(self.directory, key)
+        with self._lock:
+            try:
+                with open(path) as f:
+                    recording = json.load(f)
+            except (OSError, ValueError):
+                recording = {"model": model, "outcomes": []}
+            recording["outcomes"].append(outcome)
+            with open(path, "w") as f:
+                json.dump(recording, f)
+
+    def generate_content(self, model, contents, config=None):
+        key = request_key(model, contents, config)
+        start = time.monotonic()
+        try:
+            response = self.inner.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            self._append(key, model, {"latency": time.monotonic() - start, "error": _error_to_dict(e)})
+            raise
+        self._append(key, model, {"latency": time.monotonic() - start,
+                                  "response": response_to_dict(response)})
+        return response
+
+
+# ============================================================================
+# REPLAY
+# ============================================================================
+
+class ReplayError(Exception):
+    """A recorded or injected API error, classified like the real one."""
+
+    def __init__(self, code: int, status: str, message: str = "", details=None):
+        self.code = code
+        self.status = status
+        self.details = details
+        super().__init__(message or f"{code} {status}")
+
+
+def _replay_error(recorded: dict) -> Exception:
+    """The exception to raise for a recorded error."""
+    if recorded["code"] is None and recorded.get("category") == TIMEOUT:
+        return TimeoutError(recorded["message"])
+    if recorded["code"] is None and recorded.get("category") == CONNECTION:
+        return ConnectionError(recorded["message"])
+    return ReplayError(recorded["code"], recorded["status"], recorded["message"], recorded["details"])
+
+
+class ReplayMissError(LookupError):
+    """No recording for a request and the profile says missing=error."""
+
+
+class ReplayProfile:
+    """
+    Latency and error injection for replayed calls.
+
+    Args:
+        scale: Multiplier on recorded latencies
+        latency: Fixed seconds per call (None = recorded latency)
+        error_rate: Chance of an injected error before each call
+        errors: HTTP codes to pick injected errors from
+        seed: Random seed for the injection
+        missing: 'synthesize' or 'error' for requests without a recording
+    """
+
+    def __init__(self, scale: float = 1.0, latency: float = None, error_rate: float = 0.0,
+                 errors: tuple = (503,), seed: int = None, missing: str = "synthesize"):
+        if missing not in ("synthesize", "error"):
+            raise ValueError(f"missing must be 'synthesize' or 'error', got {missing!r}")
+        self.scale = scale
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = tuple(errors)
+        self.missing = missing
+        self.random = random.Random(seed)
+
+    @classmethod
+    def parse(cls, options: str) -> "ReplayProfile":
+        """'scale=0.1,error_rate=0.2,errors=503+429,seed=7' -> ReplayProfile."""
+        kwargs = {}
+        for option in filter(None, options.split(",")):
+            name, _, value = option.partition("=")
+            if name in ("scale", "latency", "error_rate"):
+                kwargs[name] = float(value)
+            elif name == "errors":
+                kwargs[name] = tuple(int(code) for code in value.split("+"))
+            elif name == "seed":
+                kwargs[name] = int(value)
+            elif name == "missing":
+                kwargs[name] = value
+            else:
+                raise argparse.ArgumentTypeError(f"unknown replay option {name!r}")
+        return cls(**kwargs)
+
+    def delay(self, recorded: float) -> float:
+        return self.latency if self.latency is not None else recorded * self.scale
+
+    def injected_error(self):
+        """A ReplayError to raise for this call, or None."""
+        if self.error_rate <= 0 or self.random.random() >= self.error_rate:
+            return None
+        code = self.random.choice(self.errors)
+        return ReplayError(code, ERROR_STATUS.get(code, "UNKNOWN"), f"{code} injected by replay profile")
+
+
+def synthesize_response(contents):
+    """A stand-in image response: the last input image at SYNTHETIC_LONG_EDGE."""
+    images = [item if isinstance(item, Image.Image) else Image.open(BytesIO(item.inline_data.data))
+              for item in contents
+              if isinstance(item, Image.Image) or getattr(item, "inline_data", None) is not None]
+    if images:
+        img = images[-1].convert("RGB")
+        scale = SYNTHETIC_LONG_EDGE / max(img.size)
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))))
+    else:
+        img = Image.new("RGB", (SYNTHETIC_LONG_EDGE, SYNTHETIC_LONG_EDGE), (128, 128, 128))
+    buffer = BytesIO()
+    img.save(buffer, "PNG")
+    data = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return response_from_dict({"parts": [{"mime_type": "image/png", "data": data}]})
+
+
+class ReplayModels:
+    """Serves recorded outcomes in place of client.models."""
+
+    def __init__(self, directory: Path, profile: ReplayProfile = None):
+        self.directory = Path(directory)
+        self.profile = profile or ReplayProfile()
+        self.served = 0
+        self.synthesized = 0
+        self.injected = 0
+        self._cursors = {}  # key -> outcomes served so far
+        self._lock = threading.Lock()
+
+    def _next_outcome(self, key: str):
+        try:
+            with open(_recording_path(self.directory, key)) as f:
+                outcomes = json.load(f)["outcomes"]
+        except (OSError, ValueError, KeyError):
+            return None
+        with self._lock:
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+        # Past the end, keep answering with the last outcome
+        return outcomes[min(index, len(outcomes) - 1)] if outcomes else None
+
+    def generate_content(self, model, contents, config=None):
+        contents = contents if isinstance(contents, (list, tuple)) else [contents]
+        error = self.profile.injected_error()
+        if error is not None:
+            with self._lock:
+                self.injected += 1
+            time.sleep(self.profile.delay(0.0))
+            raise error
+
+        outcome = self._next_outcome(request_key(model, contents, config))
+        if outcome is None:
+            if self.profile.missing == "error":
+                raise ReplayMissError(f"no recording for this {model} request in {self.directory}")
+            with self._lock:
+                self.synthesized += 1
+            time.sleep(self.profile.delay(0.0))
+            return synthesize_response(contents)
+
+        time.sleep(self.profile.delay(outcome["latency"]))
+        if "error" in outcome:
+            raise _replay_error(outcome["error"])
+        with self._lock:
+            self.served += 1
+        return response_from_dict(outcome["response"])
+
+    def describe(self) -> str:
+        return (f"{self.served} recorded, {self.synthesized} synthesized, "
+                f"{self.injected} injected errors")
+
+
+class ReplayClient:
+    """Offline stand-in for genai.Client()."""
+
+    def __init__(self, directory: Path = RECORDINGS_DIR, profile: ReplayProfile = None):
+        self.models = ReplayModels(directory, profile)
@@ -0,0 +1,78 @@
+"""
+Background enforcement.
+
+Replaces near-target pixels with a solid background color. The threshold
+mask is built with Pillow band operations (one 768-entry LUT pass plus two
+band minimums) and the fill is a single masked paste, so no pixel is ever
+touched from Python.
+"""
+
+from PIL import Image, ImageChops
+
+
+# Fraction of the frame treated as "edge" when edge_aware is enabled
+EDGE_FRACTION = 0.15
+
+
+def _threshold_mask(img: Image.Image, threshold: int) -> Image.Image:
+    """Return an L mask that is 255 where r, g and b are all > threshold."""
+    # One LUT pass over all three bands, then AND the bands via min()
+    lut = [255 if v > threshold else 0 for v in range(256)] * 3
+    r, g, b = img.point(lut).split()
+    return ImageChops.darker(ImageChops.darker(r, g), b)
+
+
+def _edge_boxes(width: int, height: int) -> list:
+    """
+    Boxes covering the edge band, matching the per-pixel rule
+    y < em or y > h - em or x < sm or x > w - sm.
+    """
+    edge_margin = int(height * EDGE_FRACTION)
+    side_margin = int(width * EDGE_FRACTION)
+
+    # First row/column past the inner rectangle (the rule uses strict >)
+    bottom_start = max(height - edge_margin + 1, edge_margin)
+    right_start = max(width - side_margin + 1, side_margin)
+
+    boxes = [
+        (0, 0, width, edge_margin),                          # top
+        (0, bottom_start, width, height),                    # bottom
+        (0, edge_margin, side_margin, bottom_start),         # left
+        (right_start, edge_margin, width, bottom_start),     # right
+    ]
+    return [b for b in boxes if b[2] > b[0] and b[3] > b[1]]
+
+
+def ensure_background_color(img: Image.Image, target_color: tuple, threshold: int = 235, edge_aware: bool = False) -> Image.Image:
+    """
+    Ensure background matches target color.
+    Pixels whose r, g and b are all above threshold become target_color.
+
+    RGB inputs are modified in place (like the old pixel-access version);
+    other modes are converted to RGB first.
+
+    Args:
+        edge_aware: If True, only replace edge pixels (safer for preserving clothing/text)
+    """
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    width, height = img.size
+
+    if edge_aware:
+        # Only the 15% border ROI is thresholded; the interior is never read
+        for box in _edge_boxes(width, height):
+            region = img.crop(box)
+            img.paste(target_color, box, _threshold_mask(region, threshold))
+    else:
+        img.paste(target_color, (0, 0, width, height), _threshold_mask(img, threshold))
+
+    return img
+
+
+def ensure_white_background(img: Image.Image, threshold: int = 240) -> Image.Image:
+    """
+    Ensure background is pure white.
+    Brightens near-white pixels to #FFFFFF.
+    """
+    return ensure_background_color(img, (255, 255, 255), threshold=threshold)
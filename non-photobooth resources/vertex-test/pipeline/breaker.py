@@ -0,0 +1,200 @@
+"""
+Circuit breakers per (model, location).
+
+During an UNAVAILABLE burst every photo used to spend its full retry
+schedule against a region that was down. A breaker watches the outcome of
+recent calls for each model and location: once the failure rate over the
+window passes FAILURE_RATE it opens, and calls fail fast with
+CircuitOpenError (which ModelRouter treats as a reason to fall back) instead
+of waiting on the network. After OPEN_SECONDS the breaker goes half-open and
+lets a single probe request through; a success closes it, a failure opens it
+again. A probe that fails for a reason that says nothing about the service
+(quota, a bad request) neither closes nor reopens it: the breaker stays
+half-open and the next call probes instead. Every state change is kept for
+the run summary.
+"""
+
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+from pipeline.client import ModelsMiddleware
+from pipeline.errors import classify, CircuitOpenError, CONNECTION, SERVER, TIMEOUT, UNAVAILABLE
+
+
+# States
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# Error categories that count against a model's health. Quota errors are the
+# rate limiter's business and client errors say nothing about the service.
+FAILURE_CATEGORIES = (UNAVAILABLE, SERVER, TIMEOUT, CONNECTION)
+
+# Open once this share of the last WINDOW calls failed (with MIN_CALLS seen)
+FAILURE_RATE = 0.5
+WINDOW = 10
+MIN_CALLS = 4
+
+# How long an open breaker fails fast before probing (seconds)
+OPEN_SECONDS = 30.0
+
+DEFAULT_LOCATION = "global"
+
+
+Transition = namedtuple("Transition", ["at", "model", "location", "old", "new", "reason"])
+
+
+def client_location(client) -> str:
+    """Vertex location a genai client talks to (GOOGLE_CLOUD_LOCATION, else global)."""
+    api_client = getattr(client, "_api_client", None)
+    location = getattr(api_client, "location", None)
+    return location or os.environ.get("GOOGLE_CLOUD_LOCATION") or DEFAULT_LOCATION
+
+
+class Breaker:
+    """
+    Closed/open/half-open state for one (model, location).
+
+    Args:
+        failure_rate: Share of failed calls in the window that opens the breaker
+        window: Recent calls considered
+        min_calls: Calls needed in the window before the rate counts
+        open_seconds: Seconds to fail fast before a half-open probe
+    """
+
+    def __init__(self, failure_rate: float = FAILURE_RATE, window: int = WINDOW,
+                 min_calls: int = MIN_CALLS, open_seconds: float = OPEN_SECONDS):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=window)  # True = failure
+        self.opened_at = 0.0
+        self.probing = False
+
+    def rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def retry_in(self, now: float) -> float:
+        return max(0.0, self.opened_at + self.open_seconds - now)
+
+
+class CircuitBreaker(ModelsMiddleware):
+    """
+    Fail fast for models whose recent calls mostly failed.
+
+    Args:
+        location: Location the wrapped client calls (see client_location)
+        failure_rate, window, min_calls, open_seconds: See Breaker
+    """
+
+    def __init__(self, inner, location: str = DEFAULT_LOCATION, failure_rate: float = FAILURE_RATE,
+                 window: int = WINDOW, min_calls: int = MIN_CALLS, open_seconds: float = OPEN_SECONDS):
+        super().__init__(inner)
+        self.location = location
+        self._settings = dict(failure_rate=failure_rate, window=window,
+                              min_calls=min_calls, open_seconds=open_seconds)
+        self._breakers = {}
+        self.transitions = []
+        self.rejected = 0
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> Breaker:
+        key = (model, self.location)
+        if key not in self._breakers:
+            self._breakers[key] = Breaker(**self._settings)
+        return self._breakers[key]
+
+    def _move(self, model: str, breaker: Breaker, state: str, reason: str):
+        """Change state (caller holds the lock) and log it."""
+        if breaker.state == state:
+            return
+        now = time.monotonic()
+        self.transitions.append(Transition(now - self._start, model, self.location,
+                                           breaker.state, state, reason))
+        print(f"    Breaker: {model} @ {self.location} {breaker.state} -> {state} ({reason})")
+        breaker.state = state
+        if state == OPEN:
+            breaker.opened_at = now
+        if state == CLOSED:
+            breaker.outcomes.clear()
+
+    def _admit(self, model: str) -> bool:
+        """Let a call through, or raise CircuitOpenError. True if it is the half-open probe."""
+        with self._lock:
+            breaker = self.breaker(model)
+            now = time.monotonic()
+            if breaker.state == OPEN and breaker.retry_in(now) == 0:
+                self._move(model, breaker, HALF_OPEN, f"probing after {breaker.open_seconds:.0f}s")
+            if breaker.state == CLOSED:
+                return False
+            if breaker.state == HALF_OPEN and not breaker.probing:
+                breaker.probing = True
+                return True
+            self.rejected += 1
+            raise CircuitOpenError(model, self.location, breaker.retry_in(now))
+
+    def _record(self, model: str, failed: bool, probe: bool, reason: str = ""):
+        with self._lock:
+            breaker = self.breaker(model)
+            if probe:
+                breaker.probing = False
+                if failed:
+                    self._move(model, breaker, OPEN, f"probe failed: {reason}")
+                else:
+                    self._move(model, breaker, CLOSED, "probe succeeded")
+                return
+            breaker.outcomes.append(failed)
+            if (breaker.state == CLOSED and len(breaker.outcomes) >= breaker.min_calls
+                    and breaker.rate() >= breaker.failure_rate):
+                self._move(model, breaker, OPEN, f"{breaker.rate():.0%} of last "
+                                                 f"{len(breaker.outcomes)} calls failed")
+
+    def _release(self, model: str, probe: bool):
+        """
+        An error that says nothing about the service: it counts as a healthy
+        call in the window, but a probe proves nothing, so the breaker stays
+        half-open and the next call probes.
+        """
+        with self._lock:
+            breaker = self.breaker(model)
+            if probe:
+                breaker.probing = False
+            else:
+                breaker.outcomes.append(False)
+
+    def generate_content(self, model, contents, config=None):
+        probe = self._admit(model)
+        settled = False
+        try:
+            try:
+                response = self.inner.generate_content(model=model, contents=contents, config=config)
+            except Exception as e:
+                settled = True
+                category = classify(e)
+                if category in FAILURE_CATEGORIES:
+                    self._record(model, True, probe, category)
+                else:
+                    self._release(model, probe)
+                raise
+            settled = True
+            self._record(model, False, probe)
+            return response
+        finally:
+            # Interrupted (KeyboardInterrupt, SystemExit): free the probe so the next call probes
+            if probe and not settled:
+                self._release(model, probe)
+
+    def describe(self) -> str:
+        """State changes with their time into the run, then current states."""
+        with self._lock:
+            if not self.transitions:
+                return "all closed"
+            lines = [f"{t.at:6.1f}s  {t.model} @ {t.location}: {t.old} -> {t.new} ({t.reason})"
+                     for t in self.transitions]
+            states = ", ".join(f"{model} {b.state}" for (model, _), b in self._breakers.items())
+            lines.append(f"now: {states}; {self.rejected} calls failed fast")
+            return "\n".join(lines)
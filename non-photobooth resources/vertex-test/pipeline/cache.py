@@ -0,0 +1,220 @@
+"""
+On-disk response cache.
+
+Tuning post-processing means rerunning the same sessions over and over, and
+every rerun used to pay full model latency and cost for identical inputs.
+ResponseCache sits in front of the whole middleware stack and keys each call
+by a hash of everything that shapes the answer: the model, the full config
+(system instruction, seed, image config, modalities) and every content item
+(prompt text, input and reference image pixels). A rerun of an unchanged
+session is served from disk in milliseconds.
+
+Without a seed the model is not deterministic, so a hit returns the image
+from the first run rather than a new sample; sessions that use
+get_session_seed (test_purikura_improved) were reproducible anyway. That
+is why the cache is opt-in: set GEMINI_CACHE=on (or pass cache=True to
+build_client, --cache in run_strategy). Every answer served from it is
+announced on the console.
+
+Only responses that carry an image are stored. Entries older than
+MAX_CACHE_AGE are dropped, then the oldest until the cache fits in
+MAX_CACHE_BYTES. Identical calls made while the first one is still in
+flight wait for it instead of sending their own request.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+from PIL import Image
+
+from pipeline.client import ModelsMiddleware, last_call
+from pipeline.responses import has_image, response_from_dict, response_to_dict
+from pipeline.trace import span
+
+
+CACHE_DIR = Path(os.environ.get("GEMINI_CACHE_DIR", Path(__file__).resolve().parent.parent / ".response_cache"))
+
+# Eviction limits
+MAX_CACHE_BYTES = 2 * 1024 ** 3        # 2 GB
+MAX_CACHE_AGE = 7 * 24 * 60 * 60       # seconds
+
+# Bump when the key or entry format changes
+CACHE_VERSION = 1
+
+
+def cache_enabled() -> bool:
+    """True when GEMINI_CACHE is set to on/1/true/yes."""
+    return os.environ.get("GEMINI_CACHE", "off").lower() in ("on", "1", "true", "yes")
+
+
+def _plain(value):
+    """JSON-safe form of a config or SDK object."""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return value
+
+
+def _feed(digest, tag: str, payload: bytes):
+    digest.update(f"{tag}:{len(payload)}:".encode())
+    digest.update(payload)
+
+
+def request_key(model: str, contents, config=None) -> str:
+    """Hex digest identifying a generate_content request."""
+    digest = hashlib.sha256()
+    _feed(digest, "version", str(CACHE_VERSION).encode())
+    _feed(digest, "model", model.encode())
+    _feed(digest, "config", json.dumps(_plain(config), sort_keys=True, default=str).encode())
+    for item in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(item, Image.Image):
+            _feed(digest, "image", f"{item.mode}:{item.size}".encode())
+            _feed(digest, "pixels", item.tobytes())
+        elif isinstance(item, str):
+            _feed(digest, "text", item.encode())
+        elif isinstance(item, bytes):
+            _feed(digest, "bytes", item)
+        elif getattr(item, "inline_data", None) is not None:
+            # Encoded image part (pipeline.payload): hash the bytes, not their base64
+            _feed(digest, "blob", (item.inline_data.mime_type or "").encode())
+            _feed(digest, "data", item.inline_data.data)
+        else:
+            _feed(digest, "part", json.dumps(_plain(item), sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class ResponseCache(ModelsMiddleware):
+    """
+    Serve repeated generate_content calls from disk.
+
+    Args:
+        directory: Where entries are stored (default CACHE_DIR)
+        max_bytes: Total size kept after eviction
+        max_age: Seconds an entry stays valid
+    """
+
+    def __init__(self, inner, directory: Path = None, max_bytes: int = MAX_CACHE_BYTES,
+                 max_age: float = MAX_CACHE_AGE):
+        super().__init__(inner)
+        self.directory = Path(directory or CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._in_flight = {}  # key -> Future of the response
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.evict()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _load(self, key: str):
+        """Cached entry for key, or None if missing, expired or unreadable."""
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key: str, model: str, response):
+        info = last_call()
+        entry = {
+            "model": model,
+            "model_served": info.model_served if info and info.model_served else model,
+            "created": time.time(),
+            "response": response_to_dict(response),
+        }
+        path = self._path(key)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"    Cache: could not store response ({e})")
+            return
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the oldest until under max_bytes."""
+        now = time.time()
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def generate_content(self, model, contents, config=None):
+        key = request_key(model, contents, config)
+        with span("cache_lookup") as attributes:
+            entry = self._load(key)
+            attributes["hit"] = entry is not None
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            print(f"    Cache: reusing the {entry['model_served']} answer from "
+                  f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created']))}")
+            info = last_call()
+            if info:
+                info.cached = True
+                info.model_served = entry["model_served"]
+            return response_from_dict(entry["response"])
+
+        with self._lock:
+            leader = key not in self._in_flight
+            if leader:
+                self._in_flight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+            future = self._in_flight[key]
+
+        if not leader:
+            print("    Cache: waiting for an identical request already in flight")
+            response, served = future.result()
+            info = last_call()
+            if info:
+                info.model_served = served
+            return response
+
+        try:
+            response = self.inner.generate_content(model=model, contents=contents, config=config)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            info = last_call()
+            future.set_result((response, info.model_served if info and info.model_served else model))
+            if has_image(response):
+                self._store(key, model, response)
+            return response
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def describe(self) -> str:
+        files = list(self.directory.glob("*.json"))
+        size = sum(p.stat().st_size for p in files if p.exists()) / (1024 * 1024)
+        return (f"{self.hits} hits, {self.misses} misses, {self.coalesced} coalesced; "
+                f"{len(files)} entries ({size:.0f} MB) in {self.directory}")
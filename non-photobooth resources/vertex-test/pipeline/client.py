@@ -0,0 +1,235 @@
+"""
+genai client middleware.
+
+The scripts only ever call client.models.generate_content(model=...,
+contents=..., config=...). Middleware layers wrap that one method and are
+stacked around a real client with with_middleware(); everything else on the
+client passes straight through, so a wrapped client drops into any script.
+
+    client = with_middleware(genai.Client(), partial(RequestBudget, max_in_flight=4))
+
+Each call made through a wrapped client gets a CallInfo record that the
+layers fill in (model served, retries, ...); the caller reads it back with
+last_call() on the same thread right after generate_content returns.
+
+The innermost layer, RequestTiming, stamps each request the client actually
+sends on the CallInfo. Time spent queued for a rate-limit token or a request
+slot, or sleeping between retries, is not in-flight time, so layers that
+judge model latency (hedging, the router's SLO) read it from there.
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+
+from pipeline.errors import CallAbandoned
+from pipeline.responses import has_image, wants_image
+
+
+class ModelsMiddleware:
+    """Base layer around client.models; subclasses override generate_content."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def generate_content(self, model, contents, config=None):
+        return self.inner.generate_content(model=model, contents=contents, config=config)
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+class WrappedClient:
+    """A client whose .models is a middleware stack."""
+
+    def __init__(self, client, models):
+        self._client = client
+        self.models = models
+
+    def layer(self, kind: type):
+        """The first middleware layer of type `kind` in the stack, or None."""
+        models = self.models
+        while isinstance(models, ModelsMiddleware):
+            if isinstance(models, kind):
+                return models
+            models = models.inner
+        return None
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+# ============================================================================
+# PER-CALL RECORD
+# ============================================================================
+
+class CallInfo:
+    """What happened during one generate_content call."""
+
+    def __init__(self, model: str):
+        self.model_requested = model
+        self.model_served = None
+        self.retries = 0
+        self.retry_categories = []  # error category of each retried attempt
+        self.fallbacks = []         # reason for each move down the fallback chain
+        self.hedged = False
+        self.cached = False  # served from the response cache
+        self.latency = None  # seconds, whole call including retries
+        self.requests = 0    # requests that took a rate-limit token
+        self.race = None     # HedgeRace of a hedged leg
+        self.sent_at = None          # perf_counter() the request in flight was sent, else None
+        self.request_seconds = None  # in-flight time of the last request that returned
+        self.changed = threading.Condition()  # notified when a request is sent or returns
+
+    def request_sent(self):
+        with self.changed:
+            self.sent_at = time.perf_counter()
+            self.changed.notify_all()
+
+    def request_returned(self):
+        with self.changed:
+            self.request_seconds = time.perf_counter() - self.sent_at
+            self.sent_at = None
+            self.changed.notify_all()
+
+    @property
+    def abandoned(self) -> bool:
+        """A hedged leg whose twin already answered."""
+        return self.race is not None and self.race.settled.is_set() and self.race.winner is not self
+
+    def absorb(self, leg: "CallInfo"):
+        """Take over what happened in the hedged leg that won (pipeline.hedge)."""
+        self.model_served = leg.model_served
+        self.retries += leg.retries
+        self.retry_categories += leg.retry_categories
+        self.fallbacks += leg.fallbacks
+        self.requests += leg.requests
+        self.request_seconds = leg.request_seconds
+
+    def __repr__(self):
+        return (f"CallInfo({self.model_requested!r} -> {self.model_served!r}, "
+                f"retries={self.retries}, cached={self.cached}, latency={self.latency})")
+
+
+class HedgeRace:
+    """
+    The legs of one hedged call (pipeline.hedge). The first leg to get a
+    usable answer settles the race; from then on the other legs are
+    abandoned.
+    """
+
+    def __init__(self):
+        self.winner = None
+        self.settled = threading.Event()
+        self._lock = threading.Lock()
+
+    def settle(self, leg: CallInfo) -> bool:
+        """Claim the win for leg; True if it won."""
+        with self._lock:
+            if self.winner is None:
+                self.winner = leg
+                self.settled.set()
+            return self.winner is leg
+
+
+_current_call = ContextVar("current_call", default=None)
+
+
+def last_call() -> CallInfo:
+    """The CallInfo of the current (or most recent) call on this thread/context."""
+    return _current_call.get()
+
+
+def track_call(info: CallInfo):
+    """Make info the CallInfo the layers below fill in, in this thread/context."""
+    _current_call.set(info)
+
+
+def check_abandoned():
+    """Raise CallAbandoned if the current call is a hedged leg that already lost."""
+    info = _current_call.get()
+    if info and info.abandoned:
+        raise CallAbandoned()
+
+
+def settle_call(response, config):
+    """
+    A response came back: if the current call is a hedged leg and the
+    response is usable (an image, when one was asked for), it wins the race.
+    """
+    info = _current_call.get()
+    if info and info.race and (has_image(response) or not wants_image(config)):
+        info.race.settle(info)
+
+
+class CallTracking(ModelsMiddleware):
+    """Outermost layer: opens a CallInfo for every call."""
+
+    def generate_content(self, model, contents, config=None):
+        info = CallInfo(model)
+        track_call(info)
+        start = time.perf_counter()
+        try:
+            response = self.inner.generate_content(model=model, contents=contents, config=config)
+        finally:
+            info.latency = time.perf_counter() - start
+        if info.model_served is None:
+            info.model_served = model
+        return response
+
+
+class RequestTiming(ModelsMiddleware):
+    """Innermost layer: times each request while it is in flight."""
+
+    def generate_content(self, model, contents, config=None):
+        info = _current_call.get()
+        if info is None:
+            return self.inner.generate_content(model=model, contents=contents, config=config)
+        info.request_sent()
+        try:
+            return self.inner.generate_content(model=model, contents=contents, config=config)
+        finally:
+            info.request_returned()
+
+
+def with_middleware(client, *layers) -> WrappedClient:
+    """
+    Wrap client.models in layers, innermost first, with RequestTiming
+    innermost and CallTracking outermost.
+
+    Args:
+        layers: Callables taking the inner models object and returning a
+            ModelsMiddleware (classes, or functools.partial of them)
+    """
+    models = RequestTiming(client.models)
+    for layer in layers:
+        models = layer(models)
+    return WrappedClient(client, CallTracking(models))
+
+
+# ============================================================================
+# REQUEST BUDGET
+# ============================================================================
+
+class RequestBudget(ModelsMiddleware):
+    """
+    Cap generate_content calls in flight across everything sharing the client
+    (e.g. several styles running at once).
+
+    Args:
+        max_in_flight: Concurrent requests allowed
+    """
+
+    def __init__(self, inner, max_in_flight: int = 4):
+        super().__init__(inner)
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    def generate_content(self, model, contents, config=None):
+        with self._slots:
+            check_abandoned()
+            response = self.inner.generate_content(model=model, contents=contents, config=config)
+            # Settle a hedge race before the slot goes back, so a losing leg
+            # waiting for it is abandoned instead of sent
+            settle_call(response, config)
+            return response
@@ -0,0 +1,148 @@
+"""
+Classification of model-call errors.
+
+google-genai raises errors.APIError subclasses carrying the HTTP status in
+`.code` and the RPC status name (e.g. "RESOURCE_EXHAUSTED") in `.status`;
+network failures surface as httpx transport errors. These helpers classify
+by those types and attributes instead of matching on str(e), and stay
+duck-typed for API errors so fakes and recorded errors classify the same way.
+"""
+
+import re
+
+try:
+    import httpx
+    TIMEOUT_ERRORS = (httpx.TimeoutException, TimeoutError)
+    CONNECTION_ERRORS = (httpx.TransportError, ConnectionError)
+except ImportError:
+    TIMEOUT_ERRORS = (TimeoutError,)
+    CONNECTION_ERRORS = (ConnectionError,)
+
+
+# Categories
+QUOTA = "quota"               # 429 / RESOURCE_EXHAUSTED
+UNAVAILABLE = "unavailable"   # 503 / UNAVAILABLE, 502
+SERVER = "server"             # other 5xx
+TIMEOUT = "timeout"           # 504 / DEADLINE_EXCEEDED, client-side timeouts
+CONNECTION = "connection"     # resets, DNS, TLS
+CLIENT = "client"             # other 4xx: bad request, auth, safety
+NO_IMAGE = "no_image"         # answered, but with text only or nothing
+REFUSED = "refused"           # no image because of a safety / prohibited-content block
+CIRCUIT_OPEN = "circuit_open" # refused locally by a circuit breaker
+OTHER = "other"
+
+RETRYABLE = (QUOTA, UNAVAILABLE, SERVER, TIMEOUT, CONNECTION, NO_IMAGE)
+
+_STATUS_CATEGORIES = {
+    "RESOURCE_EXHAUSTED": QUOTA,
+    "UNAVAILABLE": UNAVAILABLE,
+    "DEADLINE_EXCEEDED": TIMEOUT,
+    "INTERNAL": SERVER,
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose circuit breaker is open."""
+
+    def __init__(self, model: str, location: str, retry_in: float):
+        self.model = model
+        self.location = location
+        self.retry_in = retry_in
+        super().__init__(f"circuit open for {model} @ {location} (next probe in {retry_in:.0f}s)")
+
+
+class NoImageError(Exception):
+    """An image was requested but the response carries none (kept in .response)."""
+
+    def __init__(self, model: str, response, refused: bool = False):
+        self.model = model
+        self.response = response
+        self.refused = refused
+        super().__init__(f"{model} refused to return an image" if refused else f"{model} returned no image")
+
+
+class CallAbandoned(Exception):
+    """Raised instead of sending a hedged duplicate whose twin already won."""
+
+    def __init__(self):
+        super().__init__("hedged call abandoned, the other request won")
+
+
+def status_code(exc: BaseException):
+    """HTTP status of an API error, or None."""
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def classify(exc: BaseException) -> str:
+    """Error category (one of the constants above)."""
+    if isinstance(exc, CircuitOpenError):
+        return CIRCUIT_OPEN
+    if isinstance(exc, NoImageError):
+        return REFUSED if exc.refused else NO_IMAGE
+    status = getattr(exc, "status", None)
+    if status in _STATUS_CATEGORIES:
+        return _STATUS_CATEGORIES[status]
+
+    code = status_code(exc)
+    if code is not None:
+        if code == 429:
+            return QUOTA
+        if code in (502, 503):
+            return UNAVAILABLE
+        if code == 504:
+            return TIMEOUT
+        if code >= 500:
+            return SERVER
+        if code >= 400:
+            return CLIENT
+
+    if isinstance(exc, TIMEOUT_ERRORS):
+        return TIMEOUT
+    if isinstance(exc, CONNECTION_ERRORS):
+        return CONNECTION
+    return OTHER
+
+
+def is_retryable(exc: BaseException) -> bool:
+    return classify(exc) in RETRYABLE
+
+
+def is_quota_error(exc: BaseException) -> bool:
+    """429 / RESOURCE_EXHAUSTED."""
+    return classify(exc) == QUOTA
+
+
+def _parse_duration(value) -> float:
+    """'12s', '1.5s' or a number of seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*s?\s*", str(value))
+    return float(match.group(1)) if match else None
+
+
+def retry_after(exc: BaseException):
+    """
+    Server-suggested delay in seconds, or None.
+
+    Looks at a google.rpc.RetryInfo entry in the error details, then at a
+    Retry-After header on the HTTP response.
+    """
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        error = details.get("error", details)
+        for detail in error.get("details", []) if isinstance(error, dict) else []:
+            if isinstance(detail, dict) and detail.get("@type", "").endswith("google.rpc.RetryInfo"):
+                delay = _parse_duration(detail.get("retryDelay", ""))
+                if delay is not None:
+                    return delay
+
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is not None:
+        try:
+            value = headers.get("retry-after")
+        except Exception:
+            value = None
+        if value:
+            return _parse_duration(value)
+    return None
@@ -0,0 +1,103 @@
+"""
+Film grain.
+
+Grain is generated in bulk from a seeded RNG as one byte per pixel and
+mapped through a LUT to a signed offset (stored around 128), then added to
+the single-channel image with ImageChops.add. Textures are cached per
+(size, intensity, seed) in a GrainBank so repeated frames at print
+resolution reuse the same noise instead of regenerating it.
+"""
+
+import random
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image, ImageChops
+
+
+# Offset grain values are stored around so they fit an unsigned L band
+GRAIN_ZERO = 128
+
+
+def _grain_lut(intensity: float) -> list:
+    """Map a uniform noise byte to 128 + grain, grain in +/-(255 * intensity)."""
+    lut = []
+    for value in range(256):
+        u = (value + 0.5) / 256.0
+        grain = int((u - 0.5) * 255 * intensity * 2)
+        lut.append(max(0, min(255, GRAIN_ZERO + grain)))
+    return lut
+
+
+def grain_texture(size: tuple, intensity: float, seed: Optional[int] = None) -> Image.Image:
+    """
+    Build an L-mode grain texture (128 = no change) for the given size.
+    The same seed always produces the same texture.
+    """
+    width, height = size
+    count = width * height
+    rng = random.Random(seed)
+    noise = rng.getrandbits(8 * count).to_bytes(count, 'little') if count else b''
+    return Image.frombytes('L', size, noise).point(_grain_lut(intensity))
+
+
+class GrainBank:
+    """LRU cache of grain textures keyed by (size, intensity, seed)."""
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._textures = OrderedDict()
+
+    def get(self, size: tuple, intensity: float, seed: int) -> Image.Image:
+        key = (tuple(size), round(intensity, 6), seed)
+        texture = self._textures.get(key)
+        if texture is None:
+            texture = grain_texture(size, intensity, seed)
+            self._textures[key] = texture
+            while len(self._textures) > self.max_entries:
+                self._textures.popitem(last=False)
+        else:
+            self._textures.move_to_end(key)
+        return texture
+
+    def clear(self):
+        self._textures.clear()
+
+    def __len__(self):
+        return len(self._textures)
+
+
+# Shared bank used whenever a seed is given
+GRAIN_BANK = GrainBank()
+
+
+def add_film_grain(img: Image.Image, intensity: float = 0.02, seed: Optional[int] = None,
+                   bank: Optional[GrainBank] = None) -> Image.Image:
+    """
+    Add film grain texture for vintage look.
+
+    Works on a single channel: L images stay L, anything else is treated
+    as B&W (the red band carries the tone, as before) and returned as
+    gray RGB.
+
+    Args:
+        intensity: Grain amplitude as a fraction of full scale
+        seed: Fixed seed for reproducible grain; None draws fresh noise
+        bank: Texture cache for seeded grain (defaults to GRAIN_BANK)
+    """
+    if img.mode == 'L':
+        base = img
+    else:
+        base = img.convert('RGB').getchannel('R')
+
+    if seed is None:
+        texture = grain_texture(base.size, intensity)
+    else:
+        texture = (bank if bank is not None else GRAIN_BANK).get(base.size, intensity, seed)
+
+    # (base + texture) - 128, clipped to 0-255
+    grained = ImageChops.add(base, texture, scale=1.0, offset=-GRAIN_ZERO)
+
+    if img.mode == 'L':
+        return grained
+    return Image.merge('RGB', (grained, grained, grained))
@@ -0,0 +1,222 @@
+"""
+Hedged requests.
+
+Image generation latency is heavy-tailed: one slow call holds up a whole
+four-photo session. With hedging on, a request that is still in flight once
+it passes a percentile of the latencies observed so far gets a duplicate;
+the first valid image wins and the other request is abandoned. Duplicates
+are capped per session.
+
+Both the percentile and the trigger use in-flight time only (CallInfo's
+request timing, pipeline.client): a call still queued for a rate-limit
+token or a request slot, or sleeping before a retry, is not slow at the
+model, and a duplicate would only queue behind it for the same token.
+
+Each leg fills in its own CallInfo; only the winner's (model served,
+retries, fallbacks) is merged into the caller's, so a late loser cannot
+overwrite it. The legs share a HedgeRace (pipeline.client): the first leg
+whose response is usable settles it, inside the request budget before its
+slot is given back, and from then on the other leg is abandoned. Blocking
+HTTP calls cannot be interrupted, so what a loser costs depends on how far
+it got:
+
+- not yet at the rate limiter: it stops there (CallAbandoned) without
+  taking a token
+- waiting for a request-budget slot: its token is spent, but it hands the
+  slot straight back without sending
+- between retries: it stops without retrying
+- in flight: it keeps its slot until the response comes back and its
+  token is spent; the response is dropped
+
+If no leg settles (errors, or answers without an image), the primary's
+outcome is preferred, then the duplicate's.
+
+Each lost leg is reported as a "hedge_loser" span (requests it sent, time
+it ran on after the winner returned), which the run metrics count.
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from pipeline.client import CallInfo, HedgeRace, ModelsMiddleware, last_call, settle_call, track_call
+from pipeline.trace import current_attributes, record_span
+
+
+# Hedge once a call is slower than this share of observed calls
+HEDGE_PERCENTILE = 0.9
+
+# Before MIN_SAMPLES calls have finished, hedge after this many seconds
+INITIAL_HEDGE_DELAY = 60.0
+MIN_SAMPLES = 5
+
+# Latencies remembered per model
+LATENCY_WINDOW = 50
+
+# Duplicate requests allowed per session
+MAX_HEDGES = 4
+
+
+def _spawn(fn, *args, **kwargs) -> Future:
+    """Run fn on a daemon thread in a copy of the caller's context."""
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(fn, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+class Hedged(ModelsMiddleware):
+    """
+    Duplicate slow generate_content calls.
+
+    Args:
+        percentile: Hedge once a call passes this share of observed latencies
+        max_hedges: Duplicates allowed for the session
+    """
+
+    def __init__(self, inner, percentile: float = HEDGE_PERCENTILE, max_hedges: int = MAX_HEDGES):
+        super().__init__(inner)
+        self.percentile = percentile
+        self.max_hedges = max_hedges
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def threshold(self, model: str) -> float:
+        """Seconds in flight after which a call to `model` gets a duplicate."""
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < MIN_SAMPLES:
+            return INITIAL_HEDGE_DELAY
+        index = min(len(samples) - 1, int(self.percentile * len(samples)))
+        return samples[index]
+
+    def _observe(self, model: str, latency: float):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges >= self.max_hedges:
+                return False
+            self.hedges += 1
+            return True
+
+    def _call(self, leg: CallInfo, model, contents, config):
+        """One leg of a call, filling in its own CallInfo; returns (response, in-flight seconds)."""
+        track_call(leg)
+        start = time.monotonic()
+        response = self.inner.generate_content(model=model, contents=contents, config=config)
+        # Stacks without a RequestBudget settle here
+        settle_call(response, config)
+        latency = leg.request_seconds
+        return response, time.monotonic() - start if latency is None else latency
+
+    def _send(self, legs: dict, race: HedgeRace, model, contents, config) -> Future:
+        leg = CallInfo(model)
+        leg.race = race
+        future = _spawn(self._call, leg, model, contents, config)
+        legs[future] = leg
+
+        def notify(_):
+            with leg.changed:
+                leg.changed.notify_all()
+
+        future.add_done_callback(notify)
+        return future
+
+    @staticmethod
+    def _in_flight_past(future: Future, leg: CallInfo, delay: float) -> bool:
+        """
+        Wait until one of leg's requests has been in flight for `delay`
+        seconds (True), or the leg returns (False). Time before a request is
+        sent and between retries does not count.
+        """
+        with leg.changed:
+            while not future.done():
+                if leg.sent_at is None:
+                    leg.changed.wait()
+                    continue
+                remaining = leg.sent_at + delay - time.perf_counter()
+                if remaining <= 0:
+                    return True
+                leg.changed.wait(remaining)
+        return False
+
+    def _abandon(self, future: Future, leg: CallInfo, model: str):
+        """Cancel a losing leg if it has not started, and report what it cost once it ends."""
+        future.cancel()
+        attributes = dict(current_attributes(), model=model)
+        start = time.perf_counter()
+
+        def done(_):
+            record_span("hedge_loser", start, time.perf_counter(), dict(attributes, requests=leg.requests))
+
+        future.add_done_callback(done)
+
+    def generate_content(self, model, contents, config=None):
+        info = last_call()
+        delay = self.threshold(model)
+        race = HedgeRace()
+        legs = {}  # future -> its CallInfo
+        primary = self._send(legs, race, model, contents, config)
+        if not self._in_flight_past(primary, legs[primary], delay) or not self._take_hedge():
+            try:
+                response, latency = primary.result()
+            finally:
+                if info:
+                    info.absorb(legs[primary])
+            self._observe(model, latency)
+            return response
+
+        print(f"    Hedge: {model} request in flight past {delay:.1f}s, sending a duplicate "
+              f"({self.hedges}/{self.max_hedges} this session)")
+        if info:
+            info.hedged = True
+        duplicate = self._send(legs, race, model, contents, config)
+        futures = (primary, duplicate)
+
+        # Wait for the leg that settles the race, or for both to finish
+        pending = set(futures)
+        winner = None
+        while winner is None and pending:
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if race.settled.is_set():
+                winner = next(f for f in futures if legs[f] is race.winner)
+                winner.exception()  # it settled on the way out; wait for it to return
+
+        if winner is not None and winner.exception() is None:
+            for loser in futures:
+                if loser is not winner:
+                    self._abandon(loser, legs[loser], model)
+            response, latency = winner.result()
+            if info:
+                info.absorb(legs[winner])
+            if winner is duplicate:
+                with self._lock:
+                    self.hedge_wins += 1
+            # A winning duplicate's latency counts from the primary's send
+            self._observe(model, latency + (delay if winner is duplicate else 0.0))
+            return response
+
+        # Nothing usable: an answer beats an error, the primary beats the duplicate
+        wait(futures)
+        outcome = min(futures, key=lambda f: (f.exception() is not None, f is not primary))
+        if info:
+            info.absorb(legs[outcome])
+        return outcome.result()[0]
+
+    def describe(self) -> str:
+        return f"{self.hedges}/{self.max_hedges} duplicates sent, {self.hedge_wins} won"
@@ -0,0 +1,235 @@
+"""
+Session memory accounting and ceiling.
+
+The Cloud Function these scripts mirror has 2GB. A session holds every
+input, the master and the generated outputs, and the post-processing
+intermediates of the photos in flight, and nothing said how close that came
+to the limit. MemoryBudget samples the resident set size of the process
+(and its post-processing workers) on a thread and, as a span listener
+(pipeline.trace), records the peak seen during every span: per stage
+(model_call, decode, upscale, save...) and per photo.
+
+It also enforces a session ceiling by degrading instead of failing:
+
+- reference(img): a reference image that would not fit under the ceiling
+  (decoded frame plus encoded request copies) is downscaled to
+  REFERENCE_LONG_EDGE before it is sent
+- upscale_memory(img, size, max_memory): an upscale whose in-memory path
+  would not fit gets a smaller max_memory, so pipeline.upscale streams it
+  in bands sized to the headroom that is left
+
+    budget = MemoryBudget(ceiling=2048 * MB)
+    budget.start()
+    reference = budget.reference(master_output)
+    enhanced_upscale(img, target_size=size, max_memory=budget.upscale_memory(img, size, LIMIT))
+    print(budget.describe())
+
+Resident set sizes of the parent and workers are added up, so shared
+memory blocks handed to the pool count twice; the numbers err high.
+"""
+
+import argparse
+import glob
+import os
+import resource
+import sys
+import threading
+import time
+from collections import deque
+
+from PIL import Image
+
+from pipeline.trace import add_span_listener, remove_span_listener
+from pipeline.upscale import frame_bytes, upscale_footprint
+
+
+MB = 1024 * 1024
+
+# Session ceiling; the Cloud Function's memory: "2GB"
+SESSION_MEMORY_LIMIT = 2048 * MB
+
+# How often the sampler reads the resident set size (seconds)
+SAMPLE_INTERVAL = 0.02
+
+# Samples kept for span peaks (at SAMPLE_INTERVAL, ~6 minutes)
+MAX_SAMPLES = 18000
+
+# A reference costs its decoded frame plus the encoded bytes, their base64
+# copy in the request body and the SDK's own buffers; frames are counted
+# this many times
+REFERENCE_COPIES = 3
+
+# Long edge references are downscaled to under memory pressure
+REFERENCE_LONG_EDGE = 1024
+
+# Smallest max_memory handed to a streamed upscale
+MIN_UPSCALE_MEMORY = 16 * MB
+
+# Photos listed in describe(), largest peak first
+TOP_PHOTOS = 5
+
+
+def rss_bytes() -> int:
+    """Current resident set size; the lifetime peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def children_rss_bytes() -> int:
+    """Resident set size of this process's children (0 where /proc can't list them)."""
+    total = 0
+    for path in glob.glob("/proc/self/task/*/children"):
+        try:
+            with open(path) as f:
+                pids = f.read().split()
+        except OSError:
+            continue
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            except OSError:
+                pass
+    return total
+
+
+def session_rss_bytes() -> int:
+    return rss_bytes() + children_rss_bytes()
+
+
+def add_memory_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        default=SESSION_MEMORY_LIMIT // MB,
+        metavar="MB",
+        help="Session memory ceiling; references are downscaled and upscales streamed "
+             f"to stay under it (default: {SESSION_MEMORY_LIMIT // MB})"
+    )
+
+
+def memory_option(argv: list = None) -> int:
+    """The --memory-limit option (in bytes) of a script that takes no other arguments."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_memory_argument(parser)
+    args, _ = parser.parse_known_args(argv)
+    return args.memory_limit * MB
+
+
+class MemoryBudget:
+    """
+    Peak memory per stage and per photo, and a session ceiling.
+
+    Args:
+        ceiling: Bytes the session should stay under
+        interval: Seconds between resident set samples
+    """
+
+    def __init__(self, ceiling: int = SESSION_MEMORY_LIMIT, interval: float = SAMPLE_INTERVAL):
+        self.ceiling = ceiling
+        self.interval = interval
+        self.baseline = session_rss_bytes()
+        self.peak = self.baseline
+        self.stages = {}       # span name -> peak bytes
+        self.photos = {}       # (style, photo) -> peak bytes
+        self.downscaled = 0    # references downscaled
+        self.streamed = 0      # upscales given a smaller max_memory
+        self._samples = deque(maxlen=MAX_SAMPLES)  # (perf_counter, bytes)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start sampling and recording span peaks."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sample_loop, name="memory", daemon=True)
+            self._thread.start()
+            add_span_listener(self.on_span)
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            remove_span_listener(self.on_span)
+
+    def sample(self) -> int:
+        """Read the resident set size now and record it."""
+        current = session_rss_bytes()
+        with self._lock:
+            self._samples.append((time.perf_counter(), current))
+            self.peak = max(self.peak, current)
+        return current
+
+    def _sample_loop(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def on_span(self, name: str, seconds: float, attributes: dict):
+        """Span listener: the peak sampled while the span was open."""
+        end_value = self.sample()
+        start = time.perf_counter() - seconds - self.interval
+        with self._lock:
+            peak = max([value for t, value in self._samples if t >= start] + [end_value])
+            self.stages[name] = max(self.stages.get(name, 0), peak)
+            if attributes.get("photo") is not None:
+                key = (attributes.get("style"), attributes["photo"])
+                self.photos[key] = max(self.photos.get(key, 0), peak)
+
+    def headroom(self) -> int:
+        """Bytes left under the ceiling right now."""
+        return self.ceiling - self.sample()
+
+    def reference(self, img: Image.Image) -> Image.Image:
+        """img, or a copy downscaled to REFERENCE_LONG_EDGE if it would not fit under the ceiling."""
+        if img is None or max(img.size) <= REFERENCE_LONG_EDGE:
+            return img
+        if frame_bytes(img.size, img.mode) * REFERENCE_COPIES <= self.headroom():
+            return img
+        scale = REFERENCE_LONG_EDGE / max(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        with self._lock:
+            self.downscaled += 1
+        print(f"    Memory: reference downscaled {img.width}x{img.height} -> {size[0]}x{size[1]} "
+              f"({self.headroom() / MB:.0f}MB headroom)")
+        return img.resize(size, Image.Resampling.LANCZOS)
+
+    def upscale_memory(self, img: Image.Image, size: tuple, max_memory: int = None) -> int:
+        """
+        max_memory for an upscale of img to size: unchanged while the
+        in-memory path fits under the ceiling, else half the headroom so it
+        streams.
+        """
+        headroom = self.headroom()
+        if upscale_footprint(img, size) <= headroom and (max_memory is None or max_memory <= headroom):
+            return max_memory
+        limit = max(MIN_UPSCALE_MEMORY, headroom // 2)
+        if max_memory is not None and max_memory <= limit:
+            return max_memory
+        with self._lock:
+            self.streamed += 1
+        print(f"    Memory: upscale to {size[0]}x{size[1]} streamed within {limit / MB:.0f}MB "
+              f"({headroom / MB:.0f}MB headroom)")
+        return limit
+
+    def describe(self) -> str:
+        """Session peak, peaks per stage and for the largest photos, degradations."""
+        with self._lock:
+            lines = [f"peak {self.peak / MB:.0f}MB of {self.ceiling / MB:.0f}MB "
+                     f"(started at {self.baseline / MB:.0f}MB)"]
+            if self.stages:
+                stages = sorted(self.stages.items(), key=lambda item: -item[1])
+                lines.append("stages: " + ", ".join(f"{name} {peak / MB:.0f}MB" for name, peak in stages))
+            if self.photos:
+                photos = sorted(self.photos.items(), key=lambda item: -item[1])[:TOP_PHOTOS]
+                lines.append("photos: " + ", ".join(f"{style or ''} {photo} {peak / MB:.0f}MB".lstrip()
+                                                    for (style, photo), peak in photos))
+            if self.downscaled or self.streamed:
+                lines.append(f"degraded: {self.downscaled} references downscaled, "
+                             f"{self.streamed} upscales streamed")
+            return "\n".join(lines)
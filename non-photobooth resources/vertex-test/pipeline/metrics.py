@@ -0,0 +1,281 @@
+"""
+Run metrics per style and model.
+
+The summary at the end of a run used to be photo counts and wall time,
+which could not tell a slow model from a retry storm or a slow upscale.
+Metrics listens to the pipeline's spans (pipeline.trace) and keeps, per
+style and model:
+
+- model call latency as a histogram (p50/p90/p99 in the summary)
+- retries, fallbacks and failures by error category
+- request and response bytes
+- hedged duplicates that lost: requests they sent (each held a request
+  slot and a rate-limit token) and how long they ran on after the winner
+- post-processing time per stage
+
+summary() is the text the scripts print; write() saves the same numbers
+in the Prometheus text exposition format, for a node_exporter textfile
+collector or anything else that reads it.
+
+    enable_metrics()
+    ... run the session ...
+    print(METRICS.summary())
+    METRICS.write("metrics.prom")
+
+Scripts take --metrics PATH to write the file.
+"""
+
+import argparse
+import bisect
+import math
+import os
+import threading
+from collections import defaultdict
+
+from pipeline.trace import add_span_listener
+
+
+# Histogram buckets (seconds). Model calls take 10-60s when healthy
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Latency samples kept per histogram for the percentiles
+MAX_SAMPLES = 10000
+
+PREFIX = "photobooth_"
+
+# name -> (type, help)
+FAMILIES = {
+    "call_latency_seconds": ("histogram", "Model call latency, retries and fallbacks included"),
+    "call_latency_quantile_seconds": ("gauge", "Model call latency percentiles over the run"),
+    "retries_total": ("counter", "Retried model calls by error category"),
+    "fallbacks_total": ("counter", "Calls moved to a fallback model, by error category"),
+    "failures_total": ("counter", "Model calls that failed, by error category"),
+    "request_bytes_total": ("counter", "Image and text bytes sent to the model"),
+    "response_bytes_total": ("counter", "Image and text bytes received from the model"),
+    "hedge_losers_total": ("counter", "Hedged requests abandoned after the other one won"),
+    "hedge_loser_requests_total": ("counter", "Requests sent by abandoned hedges (slot and rate-limit token each)"),
+    "hedge_loser_seconds_total": ("counter", "Time abandoned hedges ran on after the winner returned"),
+    "post_process_seconds": ("histogram", "Post-processing time per stage"),
+}
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Spans that count as post-processing; nested ones are part of their parent
+POST_PROCESS_SPANS = ("post_process", "upscale")
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Histogram:
+    """Cumulative-bucket histogram that also keeps samples for percentiles."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.samples = []
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+
+    def percentile(self, fraction: float) -> float:
+        return percentile(self.samples, fraction) if self.samples else 0.0
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _format_labels(labels: tuple, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _megabytes(n: float) -> str:
+    return f"{n / (1024 * 1024):.1f}MB"
+
+
+class Metrics:
+    """Counters and histograms keyed by metric name and labels."""
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.histograms = {}                # (name, labels) -> Histogram
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: dict, value: float = 1):
+        with self._lock:
+            self.counters[(name, _labels(labels))] += value
+
+    def observe(self, name: str, labels: dict, value: float, buckets: tuple):
+        key = (name, _labels(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def on_span(self, name: str, seconds: float, attributes: dict):
+        """Span listener (pipeline.trace.add_span_listener)."""
+        style = attributes.get("style")
+        if name == "model_call":
+            labels = dict(style=style, model=attributes.get("model_served") or attributes.get("model"))
+            self.observe("call_latency_seconds", labels, seconds, LATENCY_BUCKETS)
+            for category in attributes.get("retry_categories", ()):
+                self.inc("retries_total", dict(labels, category=category))
+            for category in attributes.get("fallbacks", ()):
+                self.inc("fallbacks_total", dict(labels, category=category))
+            if attributes.get("failure"):
+                self.inc("failures_total", dict(labels, category=attributes["failure"]))
+            if attributes.get("bytes_up"):
+                self.inc("request_bytes_total", labels, attributes["bytes_up"])
+            if attributes.get("bytes_down"):
+                self.inc("response_bytes_total", labels, attributes["bytes_down"])
+        elif name == "hedge_loser":
+            labels = dict(style=style, model=attributes.get("model"))
+            self.inc("hedge_losers_total", labels)
+            self.inc("hedge_loser_requests_total", labels, attributes.get("requests", 0))
+            self.inc("hedge_loser_seconds_total", labels, seconds)
+        elif name in POST_PROCESS_SPANS and attributes.get("parent") not in POST_PROCESS_SPANS:
+            self.observe("post_process_seconds", dict(style=style, stage=attributes.get("stage", name)),
+                         seconds, STAGE_BUCKETS)
+
+    def total(self, name: str) -> float:
+        """A counter summed over all labels, or a histogram's observation count."""
+        with self._lock:
+            if any(metric == name for metric, _ in self.histograms):
+                return sum(h.count for (metric, _), h in self.histograms.items() if metric == name)
+            return sum(value for (metric, _), value in self.counters.items() if metric == name)
+
+    def _by(self, name: str, style: str, model: str = None) -> dict:
+        """{remaining label values: value} of a counter for one style (and model)."""
+        values = defaultdict(float)
+        for (metric, labels), value in self.counters.items():
+            labels = dict(labels)
+            if metric == name and labels.get("style") == style and labels.get("model") == model:
+                rest = [v for k, v in labels.items() if k not in ("style", "model")]
+                values[" ".join(rest)] += value
+        return values
+
+    def summary(self) -> str:
+        """Per style: each model's latency, retries, fallbacks, failures and bytes; post-processing time."""
+        with self._lock:
+            styles = sorted({dict(labels).get("style") or "" for _, labels in
+                             list(self.counters) + list(self.histograms)})
+            lines = []
+            for style in styles:
+                lines.append(f"{style or '(no style)'}:")
+                models = sorted({dict(labels).get("model") for name, labels in
+                                 list(self.counters) + list(self.histograms)
+                                 if (dict(labels).get("style") or "") == style and dict(labels).get("model")})
+                for model in models:
+                    lines.append("  " + self._model_line(style or None, model))
+                stages = [(dict(labels)["stage"], h) for (name, labels), h in sorted(self.histograms.items())
+                          if name == "post_process_seconds" and (dict(labels).get("style") or "") == style]
+                if stages:
+                    total = sum(h.sum for _, h in stages)
+                    detail = ", ".join(f"{stage} {h.sum:.1f}s/{h.count}" for stage, h in stages)
+                    lines.append(f"  post-processing {total:.1f}s ({detail})")
+            return "\n".join(lines) or "no calls"
+
+    def _model_line(self, style: str, model: str) -> str:
+        latency = self.histograms.get(("call_latency_seconds", _labels(dict(style=style, model=model))))
+        if latency:
+            line = (f"{model}: {latency.count} calls, p50 {latency.percentile(0.5):.1f}s "
+                    f"p90 {latency.percentile(0.9):.1f}s p99 {latency.percentile(0.99):.1f}s")
+        else:
+            line = f"{model}: no calls"
+        for name, label in (("retries_total", "retries"), ("fallbacks_total", "fallbacks"),
+                            ("failures_total", "failures")):
+            counts = self._by(name, style, model)
+            if counts:
+                line += f"; {label} " + ", ".join(f"{c} {n:.0f}" for c, n in sorted(counts.items()))
+        losers = sum(self._by("hedge_losers_total", style, model).values())
+        if losers:
+            line += (f"; {losers:.0f} lost hedges sent "
+                     f"{sum(self._by('hedge_loser_requests_total', style, model).values()):.0f} requests, "
+                     f"ran {sum(self._by('hedge_loser_seconds_total', style, model).values()):.1f}s after the winner")
+        sent = sum(self._by("request_bytes_total", style, model).values())
+        received = sum(self._by("response_bytes_total", style, model).values())
+        return line + f"; {_megabytes(sent)} up, {_megabytes(received)} down"
+
+    def exposition(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        with self._lock:
+            samples = defaultdict(list)  # name -> lines
+            for (name, labels), value in sorted(self.counters.items()):
+                samples[name].append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    samples[name].append(f"{PREFIX}{name}_bucket{_format_labels(labels, le=f'{bound:g}')} "
+                                         f"{cumulative}")
+                samples[name].append(f"{PREFIX}{name}_bucket{_format_labels(labels, le='+Inf')} "
+                                     f"{histogram.count}")
+                samples[name].append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                samples[name].append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+                if name == "call_latency_seconds":
+                    for q in QUANTILES:
+                        samples["call_latency_quantile_seconds"].append(
+                            f"{PREFIX}call_latency_quantile_seconds{_format_labels(labels, quantile=f'{q:g}')} "
+                            f"{histogram.percentile(q):g}")
+
+        lines = []
+        for name, (kind, help_text) in FAMILIES.items():
+            if samples[name]:
+                lines += [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} {kind}"]
+                lines += samples[name]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write exposition() to path, atomically so a collector never reads half a file."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.exposition())
+        os.replace(tmp, path)
+        print(f"Metrics: {path}")
+
+
+METRICS = Metrics()
+
+
+def enable_metrics():
+    """Start collecting METRICS from the pipeline's spans."""
+    if not METRICS.enabled:
+        METRICS.enabled = True
+        add_span_listener(METRICS.on_span)
+
+
+def add_metrics_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="Write call latency, retries, fallbacks, failures, bytes and post-processing time "
+             "per style and model to PATH (Prometheus text format)"
+    )
+
+
+def metrics_option(argv: list = None):
+    """The --metrics option of a script that takes no other arguments."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_metrics_argument(parser)
+    args, _ = parser.parse_known_args(argv)
+    return args.metrics
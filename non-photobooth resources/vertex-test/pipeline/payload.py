@@ -0,0 +1,226 @@
+"""
+Image I/O around the model call.
+
+google-genai serializes PIL images inside generate_content (PNG, or the
+original JPEG data for JPEG files), which hid the cost of encoding in the
+model call. EncodeImages does that same conversion one layer up, once per
+call rather than per retry or hedge, so it shows up as its own "serialize"
+span ahead of the "model_call" span. load_image, decode_image and
+save_image are the traced counterparts of Image.open/.save in the scripts.
+
+The same images go out many times in a run: the master with every match
+call, each chained reference with every later call, each input once per
+style. PAYLOADS keeps the encoded part of every image by content hash
+(pixels plus the encoding chosen), so each distinct image is encoded once
+per run and every later request reuses the same bytes; concurrent requests
+for an image being encoded wait for it instead of encoding it again.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
+
+from PIL import Image
+
+from pipeline.client import ModelsMiddleware, last_call
+from pipeline.errors import classify
+from pipeline.trace import span
+
+try:
+    from google.genai import types
+except ImportError:
+    types = None
+
+
+# Modes the SDK sends as JPEG when the image came from a JPEG file
+JPEG_MODES = ("1", "L", "RGB", "RGBX", "CMYK")
+
+# Encoded bytes PAYLOADS keeps for the run; least recently used go first
+PAYLOAD_CACHE_BYTES = 128 * 1024 * 1024
+
+
+def load_image(path) -> Image.Image:
+    """Open and decode an image file."""
+    with span("load", file=getattr(path, "name", str(path))):
+        img = Image.open(path)
+        img.load()
+    return img
+
+
+def _keeps_jpeg(img: Image.Image) -> bool:
+    return img.format == "JPEG" and bool(getattr(img, "filename", "")) and img.mode in JPEG_MODES
+
+
+def encode_image(img: Image.Image) -> tuple:
+    """(bytes, mime type) as google-genai would send the image."""
+    buffer = BytesIO()
+    if _keeps_jpeg(img):
+        img.save(buffer, "JPEG", quality="keep")
+        return buffer.getvalue(), "image/jpeg"
+    img.save(buffer, "PNG")
+    return buffer.getvalue(), "image/png"
+
+
+def image_key(img: Image.Image) -> str:
+    """Content hash of an image and the encoding encode_image() picks for it."""
+    digest = hashlib.sha256(f"{img.mode}:{img.size}:{_keeps_jpeg(img)}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+class PayloadCache:
+    """
+    Encoded image parts by content hash, kept for the run.
+
+    Args:
+        max_bytes: Encoded bytes kept; least recently used parts are dropped
+    """
+
+    def __init__(self, max_bytes: int = PAYLOAD_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_reused = 0
+        self._parts = OrderedDict()  # key -> Part
+        self._in_flight = {}         # key -> Future of the Part
+        self._lock = threading.Lock()
+
+    def part(self, img: Image.Image):
+        """The encoded Part for img, encoding it only if no equal image was encoded before."""
+        key = image_key(img)
+        with self._lock:
+            part = self._parts.get(key)
+            if part is not None:
+                self._parts.move_to_end(key)
+                self.hits += 1
+                self.bytes_reused += len(part.inline_data.data)
+                return part
+            leader = key not in self._in_flight
+            if leader:
+                self._in_flight[key] = Future()
+                self.misses += 1
+            future = self._in_flight[key]
+
+        if not leader:
+            part = future.result()
+            with self._lock:
+                self.hits += 1
+                self.bytes_reused += len(part.inline_data.data)
+            return part
+
+        try:
+            data, mime_type = encode_image(img)
+            part = types.Part(inline_data=types.Blob(data=data, mime_type=mime_type))
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._parts[key] = part
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes and len(self._parts) > 1:
+                _, dropped = self._parts.popitem(last=False)
+                self.bytes -= len(dropped.inline_data.data)
+            del self._in_flight[key]
+        future.set_result(part)
+        return part
+
+    def describe(self) -> str:
+        return (f"{self.misses} images encoded, {self.hits} reused "
+                f"({self.bytes_reused / (1024 * 1024):.1f}MB not re-encoded)")
+
+
+PAYLOADS = PayloadCache()
+
+
+def image_part(img: Image.Image):
+    """A types.Part carrying the encoded image, from PAYLOADS when it was encoded before."""
+    return PAYLOADS.part(img)
+
+
+def payload_bytes(parts) -> int:
+    """Bytes of image data and text in contents or response parts."""
+    total = 0
+    for part in parts:
+        if isinstance(part, str):
+            total += len(part.encode())
+            continue
+        inline = getattr(part, "inline_data", None)
+        if inline is not None and inline.data:
+            total += len(inline.data)
+        elif getattr(part, "text", None):
+            total += len(part.text.encode())
+    return total
+
+
+def response_parts(response) -> list:
+    try:
+        return response.candidates[0].content.parts or []
+    except (AttributeError, IndexError, TypeError):
+        return []
+
+
+def decode_images(response, limit: int = None) -> list:
+    """The images in a response, decoded, in order (at most limit)."""
+    images = []
+    for part in response_parts(response):
+        inline = getattr(part, "inline_data", None)
+        if inline is not None and inline.data:
+            with span("decode", bytes=len(inline.data)):
+                img = Image.open(BytesIO(inline.data))
+                img.load()
+            images.append(img)
+            if limit is not None and len(images) >= limit:
+                break
+    return images
+
+
+def decode_image(response):
+    """The first image in a response, decoded; None if there is none."""
+    images = decode_images(response, limit=1)
+    return images[0] if images else None
+
+
+def save_image(img: Image.Image, path, format: str = "PNG", **params):
+    """img.save() as one span."""
+    with span("save", file=getattr(path, "name", str(path))):
+        img.save(path, format, **params)
+
+
+class EncodeImages(ModelsMiddleware):
+    """
+    Encode PIL images in contents to Parts before the rest of the stack.
+
+    The "model_call" span carries what the run metrics need: the model
+    served, retry and fallback categories, the failure category and the
+    bytes sent and received, so both are labelled with the model served.
+    """
+
+    def generate_content(self, model, contents, config=None):
+        bytes_up = None
+        if types is not None and isinstance(contents, (list, tuple)):
+            with span("serialize", model=model) as attributes:
+                contents = [image_part(c) if isinstance(c, Image.Image) else c for c in contents]
+                attributes["bytes"] = bytes_up = payload_bytes(contents)
+
+        with span("model_call", model=model) as attributes:
+            if bytes_up is not None:
+                attributes["bytes_up"] = bytes_up
+            try:
+                response = self.inner.generate_content(model=model, contents=contents, config=config)
+            except Exception as e:
+                attributes["failure"] = classify(e)
+                raise
+            finally:
+                info = last_call()
+                if info:
+                    attributes.update(model_served=info.model_served or model, retries=info.retries,
+                                      retry_categories=list(info.retry_categories),
+                                      fallbacks=list(info.fallbacks), hedged=info.hedged)
+            attributes["bytes_down"] = payload_bytes(response_parts(response))
+        return response
@@ -0,0 +1,115 @@
+"""
+Process-pool post-processing.
+
+PostProcessPool takes decoded Gemini outputs and runs the style's
+post-processing, upscale and PNG save on worker processes, so several
+photos (and styles) are finished in parallel without the GIL serializing
+the Python-level parts of the pipeline.
+
+Pixels are handed over through multiprocessing.shared_memory: the parent
+copies the decoded frame into a shared block once and sends only its name,
+mode and size; the worker maps the block and rebuilds the image from it.
+Ops are plain namedtuples and pickle as-is. The worker saves the result
+itself, so only the path, size and stage timings come back. With tracing
+on, each photo appears as one "post_process" span in the parent, from
+submit to saved, carrying the worker's stage timings.
+"""
+
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from pipeline.postprocess import format_timings, run_post_process
+from pipeline.trace import current_attributes, record_span
+
+
+# Modes whose raw buffer round-trips without side data (palette etc.)
+SHARED_MODES = ('L', 'RGB', 'RGBA')
+
+SavedPhoto = namedtuple("SavedPhoto", ["path", "size", "timings"])
+
+# What a worker receives: shared block name plus everything to rebuild and finish the photo
+_Job = namedtuple("_Job", ["shm_name", "nbytes", "mode", "size", "ops", "target_size", "output_path",
+                           "threads", "max_memory"])
+
+
+def _finish_photo(job: _Job) -> SavedPhoto:
+    """Worker entry point: attach, post-process, save."""
+    shm = shared_memory.SharedMemory(name=job.shm_name)
+    try:
+        view = shm.buf[:job.nbytes]
+        img = Image.frombytes(job.mode, job.size, view)
+        view.release()
+    finally:
+        shm.close()
+
+    result = run_post_process(job.ops, img, job.target_size, workers=job.threads,
+                              max_memory=job.max_memory)
+    result.image.save(job.output_path, "PNG")
+    return SavedPhoto(job.output_path, result.image.size, result.timings)
+
+
+class PostProcessPool:
+    """
+    Post-process, upscale and save photos on worker processes.
+
+    Args:
+        processes: Worker processes (default: one per core)
+        threads: Band threads inside each worker (1 avoids oversubscribing
+            the cores the processes already use)
+        max_memory: Per-photo upscale memory ceiling (see pipeline.upscale)
+    """
+
+    def __init__(self, processes: int = None, threads: int = 1, max_memory: int = None):
+        self.threads = threads
+        self.max_memory = max_memory
+        self._executor = ProcessPoolExecutor(max_workers=processes)
+
+    def submit(self, ops: list, img: Image.Image, target_size: tuple, output_path, max_memory: int = None):
+        """
+        Queue one photo. Returns a Future resolving to a SavedPhoto.
+
+        max_memory overrides the pool's upscale ceiling for this photo.
+        """
+        if img.mode not in SHARED_MODES:
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        data = img.tobytes()
+
+        nbytes = len(data)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        shm.buf[:nbytes] = data
+        del data
+
+        attributes = current_attributes()
+        start = time.perf_counter()
+        job = _Job(shm.name, nbytes, img.mode, img.size, list(ops), target_size, output_path,
+                   self.threads, self.max_memory if max_memory is None else max_memory)
+        try:
+            future = self._executor.submit(_finish_photo, job)
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+
+        def release(done):
+            shm.close()
+            shm.unlink()
+            if not done.cancelled() and done.exception() is None:
+                attributes["timings"] = format_timings(done.result().timings)
+            record_span("post_process", start, time.perf_counter(), {**attributes, "pool": True})
+
+        future.add_done_callback(release)
+        return future
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
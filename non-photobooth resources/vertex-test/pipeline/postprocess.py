@@ -0,0 +1,420 @@
+"""
+Declarative post-processing.
+
+Each style declares its post-processing as an ordered list of ops:
+
+    "post_process": [faded_bw(), film_grain(0.015, seed=7), upscale()]
+
+compile_plan() turns that list into stages:
+- redundant ops are dropped (no-op enhancers, repeated background
+  enforcement, background enforcement before an upscale that is enforced
+  again afterwards)
+- adjacent pixel-wise ops are fused: enhancers compose into one color
+  matrix, a faded B&W conversion and the enhancers after it compose into one
+  LUT, and enhancers right after an upscale ride along in its tonal pass
+
+Applied one at a time, every enhancer clamps its output to 0..255; a fused
+matrix only clamps at the end. So a tonal stage is planned as a series of
+programs, and a program only takes in the next op while the values it
+produces so far provably stay in range over the input's per-band extrema
+(the full 0..255 range after an upscale, whose sharpening can overshoot the
+source). LUTs clamp at every step and always fuse. The result matches
+applying the ops one by one up to rounding (FUSED_TOLERANCE).
+
+run_post_process() executes the plan and reports the cost of every stage.
+Tonal, upscale and sharpness stages run in bands on a thread pool
+(pipeline.tiling); planning happens once per stage so every band applies the
+same LUT/matrix.
+Ops are plain namedtuples so plans can be pickled to worker processes.
+"""
+
+import time
+from collections import namedtuple
+
+from PIL import Image, ImageEnhance, ImageStat
+
+from pipeline.background import ensure_background_color
+from pipeline.grain import add_film_grain
+from pipeline.tone import (
+    FADED_BLACK, FADED_WHITE, IDENTITY_MATRIX, LUMA,
+    apply_color_matrix, brightness_matrix, color_matrix, compose_matrices,
+    contrast_matrix, faded_bw_lut, luma_mean,
+)
+from pipeline.tiling import map_tiled
+from pipeline.trace import span
+from pipeline.upscale import (
+    DEFAULT_COLOR, DEFAULT_CONTRAST, ENHANCE_TRUNCATION, SHARPEN_HALO,
+    resize_tiled, sharpen_filter, stream_resize, upscale_footprint, upscale_size,
+)
+
+
+Op = namedtuple("Op", ["name", "params"])
+
+# A compiled stage: kind is one of "tonal", "upscale", "grain", "background",
+# "sharpness"; ops are the declared ops it covers
+Stage = namedtuple("Stage", ["kind", "ops"])
+
+# Fused tonal stage: optional gray conversion (gray_row folds a pending
+# matrix into it), then either a LUT (gray images) or a color matrix
+TonalProgram = namedtuple("TonalProgram", ["to_gray", "gray_row", "lut", "matrix"])
+
+PostProcessResult = namedtuple("PostProcessResult", ["image", "reference", "timings"])
+
+# Enhancers that are affine per pixel and fuse into a color matrix
+MATRIX_OPS = ("saturation", "brightness", "contrast")
+
+# Out-of-range margin (levels) that still rounds to the clamped value
+CLIP_SLACK = 1.0
+
+# Max level difference between a fused tonal stage and the same ops applied
+# one by one with ImageEnhance (rounding only: fusion never skips a clamp)
+FUSED_TOLERANCE = 2
+
+FULL_RANGE = ((0, 255),) * 3
+
+
+# ============================================================================
+# OPS
+# ============================================================================
+
+def faded_bw(black: int = FADED_BLACK, white: int = FADED_WHITE) -> Op:
+    """Faded black & white (processed single-channel, returned in the input's mode)."""
+    return Op("faded_bw", {"black": black, "white": white})
+
+
+def film_grain(intensity: float = 0.02, seed: int = None) -> Op:
+    """Film grain; pass a seed for reproducible output."""
+    return Op("film_grain", {"intensity": intensity, "seed": seed})
+
+
+def background(color: tuple, threshold: int = 230, edge_aware: bool = False) -> Op:
+    """Replace near-background pixels with a solid color."""
+    return Op("background", {"color": tuple(color), "threshold": threshold, "edge_aware": edge_aware})
+
+
+def upscale(contrast: float = DEFAULT_CONTRAST, color: float = DEFAULT_COLOR) -> Op:
+    """Enhanced upscale to the run's target size."""
+    return Op("upscale", {"contrast": contrast, "color": color})
+
+
+def saturation(factor: float) -> Op:
+    """ImageEnhance.Color."""
+    return Op("saturation", {"factor": factor})
+
+
+def brightness(factor: float) -> Op:
+    """ImageEnhance.Brightness."""
+    return Op("brightness", {"factor": factor})
+
+
+def contrast(factor: float) -> Op:
+    """ImageEnhance.Contrast."""
+    return Op("contrast", {"factor": factor})
+
+
+def sharpness(factor: float) -> Op:
+    """ImageEnhance.Sharpness."""
+    return Op("sharpness", {"factor": factor})
+
+
+# ============================================================================
+# PLANNING
+# ============================================================================
+
+def _drop_redundant(ops: list) -> list:
+    """Remove ops that cannot change the final image."""
+    ops = [op for op in ops if not (op.name in MATRIX_OPS + ("sharpness",) and op.params["factor"] == 1.0)]
+
+    kept = []
+    for i, op in enumerate(ops):
+        if op.name == "background":
+            # Enforcement is idempotent: back-to-back duplicates collapse
+            if kept and kept[-1] == op:
+                continue
+            # Enforce once on the upscaled image instead of before and after
+            later = ops[i + 1:]
+            upscale_at = next((j for j, o in enumerate(later) if o.name == "upscale"), None)
+            if upscale_at is not None and op in later[upscale_at + 1:]:
+                continue
+        kept.append(op)
+    return kept
+
+
+def compile_plan(ops: list) -> list:
+    """Turn a declared op list into fused stages."""
+    stages = []
+    for op in _drop_redundant(list(ops)):
+        last = stages[-1] if stages else None
+
+        if op.name in MATRIX_OPS and last and last.kind in ("tonal", "upscale"):
+            last.ops.append(op)
+        elif op.name == "faded_bw" and last and last.kind == "tonal" and \
+                not any(o.name == "faded_bw" for o in last.ops):
+            last.ops.append(op)
+        elif op.name in MATRIX_OPS or op.name == "faded_bw":
+            stages.append(Stage("tonal", [op]))
+        elif op.name == "upscale":
+            stages.append(Stage("upscale", [op]))
+        elif op.name in ("film_grain", "background", "sharpness"):
+            kind = "grain" if op.name == "film_grain" else op.name
+            stages.append(Stage(kind, [op]))
+        else:
+            raise ValueError(f"Unknown post-processing op: {op.name}")
+    return stages
+
+
+def describe_plan(stages: list) -> str:
+    """One-line summary, e.g. 'faded_bw | film_grain | upscale+saturation'."""
+    return " | ".join(_stage_label(s) for s in stages)
+
+
+def _stage_label(stage: Stage) -> str:
+    return "+".join(op.name for op in stage.ops)
+
+
+# ============================================================================
+# EXECUTION
+# ============================================================================
+
+def _enhancer_matrix(op: Op, mean: float) -> tuple:
+    """Matrix for one enhancer, shifted to match ImageEnhance's truncation."""
+    factor = op.params["factor"]
+    if op.name == "saturation":
+        m = color_matrix(factor)
+    elif op.name == "brightness":
+        m = brightness_matrix(factor)
+    else:
+        m = contrast_matrix(factor, mean)
+    bias = ENHANCE_TRUNCATION
+    return compose_matrices(m, (1.0, 0.0, 0.0, bias, 0.0, 1.0, 0.0, bias, 0.0, 0.0, 1.0, bias))
+
+
+def _band_means(img: Image.Image) -> tuple:
+    """Per-band means as (r, g, b)."""
+    means = ImageStat.Stat(img).mean
+    if len(means) == 1:
+        return means[0], means[0], means[0]
+    return tuple(means[:3])
+
+
+def _transform_mean(matrix: tuple, means: tuple) -> tuple:
+    return tuple(
+        sum(matrix[row * 4 + k] * means[k] for k in range(3)) + matrix[row * 4 + 3]
+        for row in range(3)
+    )
+
+
+def _gray_lut(matrix: tuple, lut: list) -> list:
+    """Compose a gray-input affine matrix after an existing LUT."""
+    gain = matrix[0] + matrix[1] + matrix[2]
+    offset = matrix[3]
+    return [max(0, min(255, int(v * gain + offset + 0.5))) for v in lut]
+
+
+def _band_extrema(img: Image.Image) -> tuple:
+    """Per-band (min, max) as ((r), (g), (b))."""
+    extrema = ImageStat.Stat(img).extrema
+    if len(extrema) == 1:
+        return (tuple(extrema[0]),) * 3
+    return tuple(tuple(e) for e in extrema[:3])
+
+
+def _clips(matrix: tuple, extrema: tuple) -> bool:
+    """True if matrix maps some color within the per-band extrema outside 0..255."""
+    for row in range(3):
+        low = high = matrix[row * 4 + 3]
+        for k in range(3):
+            a, b = matrix[row * 4 + k] * extrema[k][0], matrix[row * 4 + k] * extrema[k][1]
+            low += min(a, b)
+            high += max(a, b)
+        if low < -CLIP_SLACK or high > 255 + CLIP_SLACK:
+            return True
+    return False
+
+
+def _plan_tonal(mode: str, ops: list, stats_source: Image.Image, extrema: tuple = None) -> tuple:
+    """
+    Fuse the leading tonal ops into at most a gray conversion plus one LUT
+    or matrix. Returns (program, the ops it could not take in).
+
+    stats_source supplies the contrast mean; an upscale stage passes its small
+    source image since resizing preserves the mean. extrema bounds the input
+    values (default: stats_source's own).
+    """
+    extrema = extrema or _band_extrema(stats_source)
+    matrix = IDENTITY_MATRIX
+    to_gray = False
+    gray_row = None       # luma row of a matrix folded into the gray conversion
+    lut = None            # set once the image has gone gray
+    band_means = None
+
+    for i, op in enumerate(ops):
+        if lut is None and matrix != IDENTITY_MATRIX and _clips(matrix, extrema):
+            # The next op has to see the clamped values: end the program here
+            return TonalProgram(to_gray, gray_row, lut, matrix), ops[i:]
+
+        if op.name == "faded_bw":
+            fade = list(faded_bw_lut(op.params["black"], op.params["white"]))
+            if mode == 'L' or to_gray:
+                lut = [fade[v] for v in _gray_lut(matrix, lut or list(range(256)))]
+            else:
+                to_gray = True
+                if matrix != IDENTITY_MATRIX:
+                    # Luma of the pending RGB matrix, in the same convert pass
+                    gray_row = tuple(
+                        sum(LUMA[r] * matrix[r * 4 + c] for r in range(3)) for c in range(4)
+                    )
+                lut = fade
+            matrix = IDENTITY_MATRIX
+            continue
+
+        mean = 0.0
+        if op.name == "contrast":
+            if lut is not None:
+                # Mean of the gray image after the pending LUT
+                if mode == 'L':
+                    gray = stats_source
+                else:
+                    gray = stats_source.convert('L', gray_row) if gray_row else stats_source.convert('L')
+                histogram = gray.histogram()
+                total = sum(histogram) or 1
+                mean = int(sum(lut[v] * n for v, n in enumerate(histogram)) / total + 0.5)
+            elif matrix == IDENTITY_MATRIX:
+                mean = luma_mean(stats_source)
+            else:
+                band_means = band_means or _band_means(stats_source)
+                r, g, b = _transform_mean(matrix, band_means)
+                mean = int(LUMA[0] * r + LUMA[1] * g + LUMA[2] * b + 0.5)
+
+        step = _enhancer_matrix(op, mean)
+        if lut is not None:
+            lut = _gray_lut(step, lut)
+        else:
+            matrix = compose_matrices(matrix, step)
+
+    return TonalProgram(to_gray, gray_row, lut, matrix), []
+
+
+def _plan_tonal_all(mode: str, ops: list, stats_source: Image.Image, extrema: tuple = None) -> list:
+    """
+    Plan every tonal op as a series of programs, stepping stats_source
+    through each one so later contrast means see the clamped values.
+    """
+    programs = []
+    while ops:
+        program, ops = _plan_tonal(mode, ops, stats_source, extrema)
+        programs.append(program)
+        if ops:
+            stats_source = _apply_tonal(stats_source, [program])
+            mode = stats_source.mode
+    return programs
+
+
+def _apply_tonal(img: Image.Image, programs: list) -> Image.Image:
+    """Run planned tonal programs (one or two bulk passes each)."""
+    for program in programs:
+        if program.to_gray:
+            img = img.convert('L', program.gray_row) if program.gray_row else img.convert('L')
+        if program.lut is not None:
+            img = img.point(program.lut)
+        else:
+            img = apply_color_matrix(img, program.matrix)
+    return img
+
+
+def _run_tonal(img: Image.Image, ops: list, workers: int = None) -> Image.Image:
+    # Each program runs over the whole image before the next is planned, so
+    # its means and extrema come from the real intermediate image
+    while ops:
+        program, ops = _plan_tonal(img.mode, ops, img)
+        img = map_tiled(img, lambda band, program=program: _apply_tonal(band, [program]), workers=workers)
+    return img
+
+
+def _run_upscale(img: Image.Image, ops: list, target_size: tuple, workers: int = None,
+                 max_memory: int = None) -> Image.Image:
+    """Resize + folded sharpen, then the upscale's own tonal pass plus any fused enhancers."""
+    up = ops[0].params
+    tonal = [contrast(up["contrast"]), saturation(up["color"])] + ops[1:]
+    tonal = [op for op in tonal if op.params["factor"] != 1.0]
+    # Sharpening can push the resized values anywhere in 0..255
+    programs = _plan_tonal_all(img.mode, tonal, img, FULL_RANGE)
+    sharpen = sharpen_filter()
+
+    size = upscale_size(img, target_size)
+
+    def finish(band):
+        return _apply_tonal(band.filter(sharpen), programs)
+
+    if max_memory is not None and upscale_footprint(img, size) > max_memory:
+        return stream_resize(img, size, finish, halo=SHARPEN_HALO, max_memory=max_memory, workers=workers)
+
+    resized = resize_tiled(img, size, workers)
+    return map_tiled(resized, finish, halo=SHARPEN_HALO, workers=workers)
+
+
+def _run_sharpness(img: Image.Image, factor: float, workers: int = None) -> Image.Image:
+    # ImageEnhance.Sharpness blends with a 3x3 SMOOTH, so one row of halo
+    return map_tiled(img, lambda band: ImageEnhance.Sharpness(band).enhance(factor), halo=1, workers=workers)
+
+
+def _run_stage(img: Image.Image, stage: Stage, target_size: tuple, workers: int = None,
+               max_memory: int = None) -> Image.Image:
+    op = stage.ops[0]
+    if stage.kind == "tonal":
+        return _run_tonal(img, stage.ops, workers)
+    if stage.kind == "upscale":
+        return _run_upscale(img, stage.ops, target_size, workers, max_memory)
+    if stage.kind == "grain":
+        return add_film_grain(img, op.params["intensity"], seed=op.params["seed"])
+    if stage.kind == "background":
+        return ensure_background_color(img, op.params["color"], threshold=op.params["threshold"],
+                                       edge_aware=op.params["edge_aware"])
+    if stage.kind == "sharpness":
+        return _run_sharpness(img, op.params["factor"], workers)
+    raise ValueError(f"Unknown stage kind: {stage.kind}")
+
+
+def run_post_process(ops: list, img: Image.Image, target_size: tuple = None, workers: int = None,
+                     max_memory: int = None) -> PostProcessResult:
+    """
+    Run a style's declared post-processing.
+
+    Returns the final image, the reference image (the state right before
+    the upscale, which is what gets sent back to Gemini as the master style
+    reference) and a list of (stage label, seconds) timings. Heavy stages
+    run in bands on `workers` threads (default: tiling.DEFAULT_WORKERS);
+    with max_memory set, an upscale that would not fit streams in bands
+    (see pipeline.upscale).
+
+    Stages after a faded_bw work on a single-channel image; the final and
+    reference images are converted back to the input's mode, so saved
+    files and master references keep the mode the model returned.
+    """
+    mode = img.mode
+    stages = compile_plan(ops)
+    reference = None
+    timings = []
+
+    for stage in stages:
+        if stage.kind == "upscale" and reference is None:
+            reference = img
+        start = time.perf_counter()
+        with span("upscale" if stage.kind == "upscale" else "post_process", stage=_stage_label(stage)):
+            img = _run_stage(img, stage, target_size, workers, max_memory)
+        timings.append((_stage_label(stage), time.perf_counter() - start))
+
+    if reference is None:
+        reference = img
+    if img.mode != mode:
+        img = img.convert(mode)
+    if reference.mode != mode:
+        reference = reference.convert(mode)
+    return PostProcessResult(img, reference, timings)
+
+
+def format_timings(timings: list) -> str:
+    """e.g. 'faded_bw 12ms | film_grain 4ms | upscale 310ms (total 326ms)'."""
+    parts = [f"{label} {seconds * 1000:.0f}ms" for label, seconds in timings]
+    total = sum(seconds for _, seconds in timings)
+    return f"{' | '.join(parts)} (total {total * 1000:.0f}ms)"
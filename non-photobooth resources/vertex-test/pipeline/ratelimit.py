@@ -0,0 +1,156 @@
+"""
+Quota-aware rate limiting.
+
+One token bucket per model, refilled at that model's requests-per-minute
+budget. Calls are admitted as soon as a token is available instead of after
+fixed sleeps. The bucket learns from 429s (AIMD): a quota error halves the
+model's rate and empties its bucket, and every success nudges the rate back
+up towards the configured budget, so throughput follows the real quota.
+"""
+
+import threading
+import time
+
+from pipeline.client import ModelsMiddleware, check_abandoned, last_call
+from pipeline.errors import is_quota_error
+
+
+# Requests per minute per model (Vertex image-generation defaults)
+MODEL_RPM = {
+    "gemini-3-pro-image-preview": 10,
+    "gemini-2.5-flash-image": 30,
+}
+DEFAULT_RPM = 10
+
+# Calls a full bucket admits back to back (master + three matches)
+DEFAULT_BURST = 4
+
+# Learned rates never drop below this
+MIN_RPM = 1.0
+
+# After a 429 the rate is multiplied by this; each success adds RECOVERY_RPM
+BACKOFF_FACTOR = 0.5
+RECOVERY_RPM = 0.5
+
+# Waits shorter than this are not worth a log line
+LOG_WAIT = 1.0
+
+
+class TokenBucket:
+    """
+    Token bucket for one model.
+
+    Args:
+        rpm: Requests per minute budget (also the ceiling learned rates recover to)
+        burst: Bucket capacity
+    """
+
+    def __init__(self, rpm: float, burst: int = DEFAULT_BURST):
+        self.ceiling = float(rpm)
+        self.rpm = float(rpm)
+        self.burst = max(1, min(burst, int(rpm) or 1))
+        self.tokens = float(self.burst)
+        self.rate_limited = 0
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rpm / 60.0)
+        self._stamp = now
+
+    def reserve(self) -> float:
+        """Take a token; returns seconds to wait before using it."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens * 60.0 / self.rpm
+
+    def acquire(self) -> float:
+        """Block until a token is available; returns seconds waited."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttle(self):
+        """A 429 came back: slow down and drop any saved-up burst."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rpm = max(MIN_RPM, self.rpm * BACKOFF_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            self.rate_limited += 1
+
+    def recover(self):
+        """A call went through: creep back towards the budget."""
+        with self._lock:
+            self.rpm = min(self.ceiling, self.rpm + RECOVERY_RPM)
+
+
+class RateLimiter:
+    """
+    Per-model token buckets, created on first use.
+
+    Args:
+        rpm: Overrides for MODEL_RPM ({model: requests per minute})
+        default_rpm: Budget for models not listed
+        burst: Bucket capacity
+    """
+
+    def __init__(self, rpm: dict = None, default_rpm: float = DEFAULT_RPM, burst: int = DEFAULT_BURST):
+        self.rpm = dict(MODEL_RPM, **(rpm or {}))
+        self.default_rpm = default_rpm
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, model: str) -> TokenBucket:
+        with self._lock:
+            if model not in self._buckets:
+                self._buckets[model] = TokenBucket(self.rpm.get(model, self.default_rpm), self.burst)
+            return self._buckets[model]
+
+    def acquire(self, model: str) -> float:
+        return self.bucket(model).acquire()
+
+    def record_success(self, model: str):
+        self.bucket(model).recover()
+
+    def record_rate_limited(self, model: str):
+        self.bucket(model).throttle()
+
+    def describe(self) -> str:
+        """One line per model: budget, learned rate and 429 count."""
+        lines = []
+        for model, bucket in sorted(self._buckets.items()):
+            line = f"{model}: {bucket.ceiling:g} rpm budget"
+            if bucket.rate_limited:
+                line += f", {bucket.rpm:.1f} rpm now after {bucket.rate_limited}x 429"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class RateLimited(ModelsMiddleware):
+    """Admit every generate_content call through a RateLimiter."""
+
+    def __init__(self, inner, limiter: RateLimiter):
+        super().__init__(inner)
+        self.limiter = limiter
+
+    def generate_content(self, model, contents, config=None):
+        check_abandoned()
+        waited = self.limiter.acquire(model)
+        if waited >= LOG_WAIT:
+            print(f"    Rate limiter: waited {waited:.1f}s for {model}")
+        info = last_call()
+        if info:
+            info.requests += 1
+        try:
+            response = self.inner.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            if is_quota_error(e):
+                self.limiter.record_rate_limited(model)
+            raise
+        self.limiter.record_success(model)
+        return response
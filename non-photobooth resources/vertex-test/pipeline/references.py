@@ -0,0 +1,190 @@
+"""
+Reference compaction for chained sessions.
+
+Chained sessions send every earlier output as a reference, at full
+resolution, so photo N's request carries N-1 large images and request size
+and latency grow with every photo. ReferenceCompaction trims what is sent:
+
+    window=k       only the last k outputs
+    long_edge=px   references downscaled to this long edge
+    sheet          the references packed into one contact-sheet image
+
+and image_order() writes the "- Image n: ..." lines of the prompt for
+exactly what is sent, so the text never describes images that are not in
+the request. describe_references() words the count the same way: a
+contact sheet is one image showing several photos.
+
+Scripts take --references with the options comma-separated, e.g.
+--references window=2,long_edge=1024 or --references sheet,long_edge=2048;
+GEMINI_REFERENCES sets the default. Without it every reference is sent as
+generated, as before.
+"""
+
+import argparse
+import math
+import os
+from collections import namedtuple
+
+from PIL import Image
+
+
+# Long edge of a contact sheet when long_edge is not set
+SHEET_LONG_EDGE = 2048
+
+# Pixels between contact-sheet cells
+SHEET_GUTTER = 16
+SHEET_BACKGROUND = (255, 255, 255)
+
+# One image sent as a reference and the photos it shows
+Reference = namedtuple("Reference", ["image", "photos"])
+
+
+def _downscale(img: Image.Image, long_edge: int) -> Image.Image:
+    if long_edge is None or max(img.size) <= long_edge:
+        return img
+    scale = long_edge / max(img.size)
+    return img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                      Image.Resampling.LANCZOS)
+
+
+def contact_sheet(images: list, long_edge: int = SHEET_LONG_EDGE) -> Image.Image:
+    """images in a grid, left to right then top to bottom, within long_edge."""
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    cell_w = max(img.width for img in images)
+    cell_h = max(img.height for img in images)
+    width = columns * cell_w + (columns - 1) * SHEET_GUTTER
+    height = rows * cell_h + (rows - 1) * SHEET_GUTTER
+    scale = min(1.0, long_edge / max(width, height))
+    cell = (max(1, int(cell_w * scale)), max(1, int(cell_h * scale)))
+    gutter = round(SHEET_GUTTER * scale)
+
+    sheet = Image.new("RGB", (columns * cell[0] + (columns - 1) * gutter,
+                              rows * cell[1] + (rows - 1) * gutter), SHEET_BACKGROUND)
+    for i, img in enumerate(images):
+        thumb = img.convert("RGB")
+        thumb.thumbnail(cell, Image.Resampling.LANCZOS)
+        row, column = divmod(i, columns)
+        x = column * (cell[0] + gutter) + (cell[0] - thumb.width) // 2
+        y = row * (cell[1] + gutter) + (cell[1] - thumb.height) // 2
+        sheet.paste(thumb, (x, y))
+    return sheet
+
+
+class ReferenceCompaction:
+    """
+    Which earlier outputs a chained request sends, and how.
+
+    Args:
+        window: Send only the last k outputs (None = all)
+        long_edge: Downscale references (or the contact sheet) to this long edge
+        sheet: Pack the references into one contact-sheet image
+    """
+
+    def __init__(self, window: int = None, long_edge: int = None, sheet: bool = False):
+        if window is not None and window < 1:
+            raise ValueError(f"window must be at least 1, got {window}")
+        self.window = window
+        self.long_edge = long_edge
+        self.sheet = sheet
+
+    @classmethod
+    def parse(cls, options: str) -> "ReferenceCompaction":
+        """'window=2,long_edge=1024,sheet' -> ReferenceCompaction."""
+        kwargs = {}
+        for option in filter(None, (options or "").split(",")):
+            name, _, value = option.partition("=")
+            if name in ("window", "long_edge"):
+                kwargs[name] = int(value)
+            elif name == "sheet":
+                kwargs[name] = True
+            else:
+                raise argparse.ArgumentTypeError(f"unknown references option {name!r}")
+        return cls(**kwargs)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window is not None or self.long_edge is not None or self.sheet
+
+    def compact(self, outputs: list) -> list:
+        """
+        [(photo number, image)] of earlier outputs -> the References to
+        send, in order.
+        """
+        if self.window is not None:
+            outputs = outputs[-self.window:]
+        if not outputs:
+            return []
+        if self.sheet and len(outputs) > 1:
+            sheet = contact_sheet([img for _, img in outputs], self.long_edge or SHEET_LONG_EDGE)
+            return [Reference(sheet, tuple(n for n, _ in outputs))]
+        return [Reference(_downscale(img, self.long_edge), (n,)) for n, img in outputs]
+
+    @staticmethod
+    def photo_count(references: list) -> int:
+        """Earlier photos shown by compact()'s References (a contact sheet shows several)."""
+        return sum(len(r.photos) for r in references)
+
+    def describe(self) -> str:
+        if not self.enabled:
+            return "every reference, as generated"
+        parts = []
+        if self.window is not None:
+            parts.append(f"last {self.window}")
+        if self.long_edge is not None:
+            parts.append(f"{self.long_edge}px long edge")
+        if self.sheet:
+            parts.append("one contact sheet")
+        return ", ".join(parts)
+
+
+def reference_labels(references: list, label: str = "REFERENCE (processed Photo {photo})") -> list:
+    """One label per reference image; a contact sheet lists its photos."""
+    labels = []
+    for reference in references:
+        if len(reference.photos) == 1:
+            labels.append(label.format(photo=reference.photos[0]))
+        else:
+            photos = ", ".join(str(n) for n in reference.photos)
+            labels.append(f"REFERENCE contact sheet of processed Photos {photos} "
+                          f"(left to right, top to bottom)")
+    return labels
+
+
+def describe_references(references: list, noun: str = "reference images") -> str:
+    """
+    How many photos the references show, e.g. "3 reference images", or
+    "3 reference images tiled in ONE contact sheet image (...)" for a sheet.
+    """
+    count = ReferenceCompaction.photo_count(references)
+    if len(references) == 1 and count > 1:
+        return f"{count} {noun} tiled in ONE contact sheet image (left to right, top to bottom)"
+    return f"{count} {noun}"
+
+
+def image_order(references: list, target: str, label: str = "REFERENCE (processed Photo {photo})") -> str:
+    """
+    The prompt's image order: "- Image n: ..." for each reference, then
+    the target, numbered as they are sent.
+    """
+    labels = reference_labels(references, label) + [target]
+    return "\n".join(f"- Image {n}: {text}" for n, text in enumerate(labels, 1))
+
+
+def add_references_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--references",
+        type=ReferenceCompaction.parse,
+        default=ReferenceCompaction.parse(os.environ.get("GEMINI_REFERENCES", "")),
+        metavar="OPTIONS",
+        help="Compact chained references: window=K (last K), long_edge=PX (downscale), "
+             "sheet (one contact sheet), comma-separated (default: GEMINI_REFERENCES or all, as generated)"
+    )
+
+
+def references_option(argv: list = None) -> ReferenceCompaction:
+    """The --references option of a script that takes no other arguments."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_references_argument(parser)
+    args, _ = parser.parse_known_args(argv)
+    return args.references
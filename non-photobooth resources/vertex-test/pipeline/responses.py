@@ -0,0 +1,97 @@
+"""
+Plain-data form of generate_content responses.
+
+The scripts only read response.candidates[0].content.parts, and from each
+part .text or .inline_data (.data, .mime_type). response_to_dict() keeps
+exactly that as JSON-safe data (image bytes base64-encoded) so responses can
+be stored on disk; response_from_dict() rebuilds a google.genai.types
+response, or a look-alike object when the SDK is not installed.
+has_image(), wants_image() and is_refusal() are the checks the middleware
+layers share.
+"""
+
+import base64
+from types import SimpleNamespace
+
+try:
+    from google.genai import types
+except ImportError:
+    types = None
+
+
+def has_image(response) -> bool:
+    """True if a generate_content response carries inline image data."""
+    try:
+        parts = response.candidates[0].content.parts
+    except (AttributeError, IndexError, TypeError):
+        return False
+    return any(getattr(part, "inline_data", None) for part in parts or [])
+
+
+# finish_reason values of an answer the model refused to give
+REFUSAL_REASONS = ("SAFETY", "PROHIBITED_CONTENT", "BLOCKLIST", "SPII",
+                   "IMAGE_SAFETY", "IMAGE_PROHIBITED_CONTENT")
+
+
+def _enum_name(value) -> str:
+    return str(getattr(value, "value", value)).upper()
+
+
+def is_refusal(response) -> bool:
+    """True if the prompt was blocked or the answer stopped for safety / prohibited content."""
+    block_reason = getattr(getattr(response, "prompt_feedback", None), "block_reason", None)
+    if block_reason and not _enum_name(block_reason).endswith("UNSPECIFIED"):
+        return True
+    try:
+        finish_reason = response.candidates[0].finish_reason
+    except (AttributeError, IndexError, TypeError):
+        return False
+    return finish_reason is not None and _enum_name(finish_reason) in REFUSAL_REASONS
+
+
+def wants_image(config) -> bool:
+    """True if a GenerateContentConfig asks for image output."""
+    modalities = getattr(config, "response_modalities", None) or []
+    return any(_enum_name(m) == "IMAGE" for m in modalities)
+
+
+def response_to_dict(response) -> dict:
+    """The text and inline-data parts of a response's first candidate."""
+    try:
+        parts = response.candidates[0].content.parts or []
+    except (AttributeError, IndexError, TypeError):
+        parts = []
+    data = []
+    for part in parts:
+        inline = getattr(part, "inline_data", None)
+        if inline is not None and inline.data:
+            data.append({
+                "mime_type": getattr(inline, "mime_type", None) or "image/png",
+                "data": base64.b64encode(inline.data).decode("ascii"),
+            })
+        elif getattr(part, "text", None) is not None:
+            data.append({"text": part.text})
+    return {"parts": data}
+
+
+def response_from_dict(data: dict):
+    """Rebuild a response from response_to_dict() output."""
+    parts = []
+    for part in data["parts"]:
+        if "data" in part:
+            blob = base64.b64decode(part["data"])
+            if types:
+                parts.append(types.Part(inline_data=types.Blob(data=blob, mime_type=part["mime_type"])))
+            else:
+                parts.append(SimpleNamespace(
+                    text=None, inline_data=SimpleNamespace(data=blob, mime_type=part["mime_type"])))
+        elif types:
+            parts.append(types.Part(text=part["text"]))
+        else:
+            parts.append(SimpleNamespace(text=part["text"], inline_data=None))
+
+    if types:
+        content = types.Content(role="model", parts=parts)
+        return types.GenerateContentResponse(candidates=[types.Candidate(content=content)])
+    content = SimpleNamespace(role="model", parts=parts)
+    return SimpleNamespace(candidates=[SimpleNamespace(content=content)])
@@ -0,0 +1,146 @@
+"""
+Retry policy for model calls.
+
+Replaces the per-script "look for 429 in str(e), sleep 30s" loops:
+- errors are classified by type/status (pipeline.errors); only transient
+  categories are retried
+- delays grow exponentially from BASE_DELAY with jitter, capped at MAX_DELAY
+- a server retry hint (RetryInfo / Retry-After) wins over the backoff
+- a RetryBudget caps retries for the whole session, so an outage does not
+  turn every photo into MAX_ATTEMPTS slow failures
+- an answer without an image, when the config asks for one, is retried
+  at most NO_IMAGE_RETRIES times and outside the RetryBudget (NoImageError):
+  the same prompt and images tend to get the same answer, so it should not
+  spend the attempts and budget that 429s and 503s need. A refusal (safety
+  or prohibited-content block) is not retried at all. Either way the last
+  answer is returned for the caller to report
+
+A transient 503 now costs one to two seconds instead of 30.
+"""
+
+import random
+import threading
+import time
+from collections import Counter
+
+from pipeline.client import ModelsMiddleware, last_call
+from pipeline.errors import classify, retry_after, NoImageError, NO_IMAGE, RETRYABLE, status_code
+from pipeline.responses import has_image, is_refusal, wants_image
+
+
+MAX_ATTEMPTS = 4
+BASE_DELAY = 1.0   # seconds
+MAX_DELAY = 30.0   # seconds
+# Server hints above this are treated as "give up on this call"
+MAX_HINT_DELAY = 120.0
+
+# Retries allowed per session (all photos, styles and models together)
+SESSION_RETRY_BUDGET = 20
+
+# Retries of an answer without an image, per call (not taken from the budget)
+NO_IMAGE_RETRIES = 1
+
+
+class RetryBudget:
+    """
+    Retries left for a session, shared by every call on a client.
+
+    Args:
+        max_retries: Retries allowed in total
+    """
+
+    def __init__(self, max_retries: int = SESSION_RETRY_BUDGET):
+        self.max_retries = max_retries
+        self.used = 0
+        self.by_category = Counter()
+        self._lock = threading.Lock()
+
+    def spend(self, category: str) -> bool:
+        """Take one retry; False once the budget is gone."""
+        with self._lock:
+            if self.used >= self.max_retries:
+                return False
+            self.used += 1
+            self.by_category[category] += 1
+            return True
+
+    def describe(self) -> str:
+        if not self.used:
+            return f"0/{self.max_retries} retries used"
+        categories = ", ".join(f"{c} {n}" for c, n in self.by_category.most_common())
+        return f"{self.used}/{self.max_retries} retries used ({categories})"
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before retrying.
+
+    Args:
+        max_attempts: Attempts per call, including the first
+        base_delay: First backoff step in seconds
+        max_delay: Backoff cap in seconds
+        retryable: Error categories worth retrying
+    """
+
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY,
+                 max_delay: float = MAX_DELAY, retryable: tuple = RETRYABLE):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable = retryable
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry number `attempt` (1-based): half fixed, half jitter."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def delay(self, exc: BaseException, attempt: int):
+        """Seconds to wait before the next attempt, or None to give up."""
+        if attempt >= self.max_attempts or classify(exc) not in self.retryable:
+            return None
+        hint = retry_after(exc)
+        if hint is not None:
+            return hint if hint <= MAX_HINT_DELAY else None
+        return self.backoff(attempt)
+
+
+class Retrying(ModelsMiddleware):
+    """Retry generate_content calls under a RetryPolicy and a shared RetryBudget."""
+
+    def __init__(self, inner, policy: RetryPolicy = None, budget: RetryBudget = None):
+        super().__init__(inner)
+        self.policy = policy or RetryPolicy()
+        self.budget = budget or RetryBudget()
+
+    def generate_content(self, model, contents, config=None):
+        attempt = 1
+        no_image_retries = 0
+        while True:
+            try:
+                response = self.inner.generate_content(model=model, contents=contents, config=config)
+                if wants_image(config) and not has_image(response):
+                    raise NoImageError(model, response, refused=is_refusal(response))
+                return response
+            except Exception as e:
+                delay = self.policy.delay(e, attempt)
+                category = classify(e)
+                info = last_call()
+                if category == NO_IMAGE and no_image_retries >= NO_IMAGE_RETRIES:
+                    delay = None
+                # A hedged leg that already lost is not worth a retry
+                if (delay is None or (info and info.abandoned)
+                        or (category != NO_IMAGE and not self.budget.spend(category))):
+                    if isinstance(e, NoImageError):
+                        return e.response
+                    raise
+                if category == NO_IMAGE:
+                    no_image_retries += 1
+                code = status_code(e)
+                label = f"{category} ({code})" if code else category
+                print(f"    Retry {attempt}/{self.policy.max_attempts - 1} after {label} on {model}, "
+                      f"waiting {delay:.1f}s...")
+                if info:
+                    info.retries += 1
+                    info.retry_categories.append(category)
+                time.sleep(delay)
+                attempt += 1
@@ -0,0 +1,128 @@
+"""
+Model fallback routing.
+
+When gemini-3-pro-image-preview is saturated a photo used to fail after its
+retries. ModelRouter walks an ordered chain instead: if the requested model
+fails with a quota, unavailability or timeout error (after its own retries),
+the call moves on to the next model in the chain, straight away if the
+model's circuit breaker is open (pipeline.breaker). A model that fails that
+way, or whose answering request was in flight longer than the latency SLO
+(queueing for a rate-limit token and retry backoff do not count), is
+demoted for a cooldown so
+the following photos go straight to the next model instead of paying for the
+same failure again. The model that actually served each call is recorded on
+its CallInfo (pipeline.client.last_call()).
+
+Fallback models can return smaller images (gemini-2.5-flash-image tops out
+at 1024px); see pipeline.upscale.fit_target_size for the post-processing side.
+"""
+
+import threading
+import time
+from collections import Counter
+
+from pipeline.client import ModelsMiddleware, last_call
+from pipeline.errors import classify, CIRCUIT_OPEN, QUOTA, TIMEOUT, UNAVAILABLE
+
+
+# Requested model -> models to fall back to, in order
+FALLBACK_CHAINS = {
+    "gemini-3-pro-image-preview": ["gemini-2.5-flash-image"],
+}
+
+# Error categories that move a call to the next model
+FALLBACK_ON = (QUOTA, UNAVAILABLE, TIMEOUT, CIRCUIT_OPEN)
+
+# Requests in flight longer than this demote the model (seconds)
+LATENCY_SLO = 90.0
+
+# How long a demoted model is skipped (seconds)
+DEMOTION_COOLDOWN = 120.0
+
+
+class ModelRouter(ModelsMiddleware):
+    """
+    Route generate_content calls through a fallback chain.
+
+    Args:
+        chains: {requested model: [fallback models]} (default FALLBACK_CHAINS)
+        latency_slo: Seconds in flight; slower answers demote the model
+        cooldown: Seconds a demoted model is skipped
+    """
+
+    def __init__(self, inner, chains: dict = None, latency_slo: float = LATENCY_SLO,
+                 cooldown: float = DEMOTION_COOLDOWN):
+        super().__init__(inner)
+        self.chains = FALLBACK_CHAINS if chains is None else chains
+        self.latency_slo = latency_slo
+        self.cooldown = cooldown
+        self.served = Counter()
+        self.fallbacks = Counter()  # error category -> calls moved to the next model
+        self.demotions = Counter()  # error category or "slo" -> models demoted
+        self._demoted = {}          # model -> monotonic time it may be used again
+        self._lock = threading.Lock()
+
+    def chain(self, model: str) -> list:
+        """The requested model followed by its fallbacks."""
+        return [model] + [m for m in self.chains.get(model, []) if m != model]
+
+    def _route(self, model: str) -> list:
+        """Chain order with currently demoted models moved to the back."""
+        now = time.monotonic()
+        with self._lock:
+            chain = self.chain(model)
+            healthy = [m for m in chain if self._demoted.get(m, 0) <= now]
+            return healthy + [m for m in chain if m not in healthy]
+
+    def _demote(self, model: str, reason: str, detail: str = None):
+        with self._lock:
+            self._demoted[model] = time.monotonic() + self.cooldown
+            self.demotions[reason] += 1
+        print(f"    Router: {model} demoted for {self.cooldown:.0f}s ({detail or reason})")
+
+    def generate_content(self, model, contents, config=None):
+        candidates = self._route(model)
+        if candidates[0] != model:
+            print(f"    Router: {model} is demoted, using {candidates[0]}")
+
+        info = last_call()
+        for i, candidate in enumerate(candidates):
+            start = time.monotonic()
+            if info:
+                info.request_seconds = None
+            try:
+                response = self.inner.generate_content(model=candidate, contents=contents, config=config)
+            except Exception as e:
+                category = classify(e)
+                if category not in FALLBACK_ON or i == len(candidates) - 1:
+                    raise
+                self._demote(candidate, category)
+                with self._lock:
+                    self.fallbacks[category] += 1
+                if info:
+                    info.fallbacks.append(category)
+                print(f"    Router: falling back from {candidate} to {candidates[i + 1]}")
+                continue
+
+            # In-flight time of the request that answered (pipeline.client.RequestTiming);
+            # wall time only for stacks built without with_middleware
+            elapsed = info.request_seconds if info and info.request_seconds is not None else time.monotonic() - start
+            if elapsed > self.latency_slo and len(candidates) > 1:
+                # The answer is kept: this only steers the following calls
+                self._demote(candidate, "slo", f"{elapsed:.0f}s > {self.latency_slo:.0f}s SLO")
+
+            with self._lock:
+                self.served[candidate] += 1
+            if info:
+                info.model_served = candidate
+            return response
+
+    def describe(self) -> str:
+        """Photos served per model, fallbacks and demotions by reason."""
+        served = ", ".join(f"{m} {n}" for m, n in self.served.most_common()) or "none"
+        line = f"served by {served}"
+        if self.fallbacks:
+            line += "; fallbacks: " + ", ".join(f"{r} {n}" for r, n in self.fallbacks.most_common())
+        if self.demotions:
+            line += "; demotions: " + ", ".join(f"{r} {n}" for r, n in self.demotions.most_common())
+        return line
@@ -0,0 +1,74 @@
+"""
+The standard client stack the scripts use.
+
+build_client() wraps a genai client in the shared middleware (see
+pipeline.client), innermost first:
+
+    RequestTiming   in-flight time of every request sent (always; pipeline.client)
+    RequestBudget   requests in flight across the whole process (optional)
+    RateLimited     per-model token buckets that learn from 429s
+    CircuitBreaker  fail fast for a (model, location) that keeps failing
+    Retrying        classified retries with backoff and a session budget
+    ModelRouter     fallback chain once a model's retries are spent
+    Hedged          duplicate of a request in flight past a latency percentile (optional)
+    EncodeImages    PIL images -> encoded parts, once per call ("serialize"/"model_call" spans)
+    ResponseCache   on-disk answers for repeated requests (GEMINI_CACHE=on to use)
+
+Retrying sits outside the limiter so every retry is paced too, and inside
+the router so a transient blip is retried on the requested model before the
+call falls back to a smaller one. The breaker sits between the two: each
+attempt counts towards a model's health, and once the breaker opens the
+remaining attempts fail fast (CircuitOpenError is not retried) and the
+router moves on. The cache is outermost so a hit skips pacing, retries
+and routing altogether.
+"""
+
+from functools import partial
+
+from pipeline.breaker import CircuitBreaker, client_location
+from pipeline.cache import cache_enabled, ResponseCache
+from pipeline.client import RequestBudget, with_middleware
+from pipeline.hedge import Hedged, MAX_HEDGES
+from pipeline.payload import EncodeImages
+from pipeline.ratelimit import RateLimited, RateLimiter
+from pipeline.retry import RetryBudget, RetryPolicy, Retrying
+from pipeline.routing import ModelRouter
+
+
+def build_client(client, limiter: RateLimiter = None, request_budget: int = None,
+                 retry_policy: RetryPolicy = None, retry_budget: RetryBudget = None,
+                 chains: dict = None, hedge_percentile: float = None, max_hedges: int = MAX_HEDGES,
+                 breaker: dict = None, cache: bool = None):
+    """
+    Wrap a genai client in the standard middleware stack.
+
+    Args:
+        limiter: Shared RateLimiter (default: a new one with MODEL_RPM budgets)
+        request_budget: Max requests in flight at once (None = unbounded)
+        retry_policy: RetryPolicy (default: MAX_ATTEMPTS with capped backoff)
+        retry_budget: Session RetryBudget (default: SESSION_RETRY_BUDGET)
+        chains: Model fallback chains (default: routing.FALLBACK_CHAINS)
+        hedge_percentile: Send a duplicate once a call passes this share of
+            observed latencies (e.g. 0.9; None = no hedging)
+        max_hedges: Duplicates allowed for the session
+        breaker: CircuitBreaker settings (failure_rate, window, min_calls,
+            open_seconds; default: the pipeline.breaker constants)
+        cache: Serve repeated requests from the on-disk ResponseCache
+            (default: off unless GEMINI_CACHE=on)
+
+    Layers are reachable afterwards with client.layer(), e.g.
+    client.layer(ModelRouter).describe() for the run summary.
+    """
+    layers = []
+    if request_budget:
+        layers.append(partial(RequestBudget, max_in_flight=request_budget))
+    layers.append(partial(RateLimited, limiter=limiter or RateLimiter()))
+    layers.append(partial(CircuitBreaker, location=client_location(client), **(breaker or {})))
+    layers.append(partial(Retrying, policy=retry_policy, budget=retry_budget))
+    layers.append(partial(ModelRouter, chains=chains))
+    if hedge_percentile:
+        layers.append(partial(Hedged, percentile=hedge_percentile, max_hedges=max_hedges))
+    layers.append(EncodeImages)
+    if cache if cache is not None else cache_enabled():
+        layers.append(ResponseCache)
+    return with_middleware(client, *layers)
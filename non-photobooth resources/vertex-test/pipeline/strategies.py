@@ -0,0 +1,280 @@
+"""
+Session consistency strategies.
+
+Every script used to hard-code one way of keeping the photos of a session
+consistent, and re-implemented loading, the model call, decoding and saving
+around it. Here the shared part is PhotoSession (inputs, client, config,
+post-processing, saving) and each strategy is a small plugin that only
+decides which requests go out:
+
+    master      photo 1 sets the style; photos 2-N each send [master, target]
+                (test_all_styles_v4, test_purikura_v3/v4, test_newyork,
+                test_gemini_flash)
+    chained     photo N sends the earlier outputs as references, compacted
+                as configured (pipeline.references)
+                (test_purikura_chained, test_all_styles_v2,
+                test_purikura_improved)
+    batch       one request with every input, one output image per input
+                (test_purikura_batch)
+    individual  every photo on its own (test_purikura_individual,
+                test_gemini_image)
+
+A strategy is a Strategy subclass registered with @register_strategy; a
+plugin module only has to be imported (run_strategy.py --plugin module).
+
+    session = PhotoSession(client, "japanese", STYLES["japanese"], inputs, output_dir, timestamp)
+    paths = STRATEGIES["master"]().run(session)
+"""
+
+import re
+from pathlib import Path
+
+from PIL import Image
+
+from pipeline.errors import classify
+from pipeline.fanout import MATCH_CONCURRENCY, fan_out
+from pipeline.memory import MemoryBudget
+from pipeline.payload import decode_images, save_image
+from pipeline.postpool import PostProcessPool
+from pipeline.postprocess import format_timings, run_post_process
+from pipeline.references import ReferenceCompaction, reference_labels
+from pipeline.trace import set_trace_attributes
+from pipeline.upscale import fit_target_size
+
+try:
+    from google.genai.types import GenerateContentConfig, Modality
+except ImportError:
+    GenerateContentConfig = Modality = None
+
+
+MODEL_NAME = "gemini-3-pro-image-preview"
+
+# Output width of the finished photos
+TARGET_WIDTH = 2400
+
+# Per-photo upscale memory ceiling; 4096px model outputs stream in bands above it
+UPSCALE_MEMORY_LIMIT = 128 * 1024 * 1024  # bytes
+
+# name -> Strategy subclass
+STRATEGIES = {}
+
+
+def register_strategy(cls):
+    """Class decorator: make a Strategy available by its name."""
+    STRATEGIES[cls.name] = cls
+    return cls
+
+
+def with_image_order(prompt: str, labels: list) -> str:
+    """prompt with its "Images: [...]" line (added if missing) listing labels in order."""
+    line = f"Images: [{', '.join(labels)}]"
+    if re.search(r"^Images: \[.*\]$", prompt, flags=re.MULTILINE):
+        return re.sub(r"^Images: \[.*\]$", lambda _: line, prompt, count=1, flags=re.MULTILINE)
+    return f"{prompt}\n\n{line}"
+
+
+class PhotoSession:
+    """
+    One style applied to one set of input photos.
+
+    Args:
+        client: Client from pipeline.session.build_client
+        style_key: Style name used in file names and traces
+        style: {"name", "system_instruction", "prompt_master", "prompt_match",
+            "post_process"} as in test_all_styles_v4.STYLES
+        inputs: Decoded input photos
+        output_dir: Where finished photos are saved
+        timestamp: Run timestamp for file names
+        model: Gemini model name
+        pool: Finish photos after the first on worker processes
+        memory: Session memory budget (pipeline.memory)
+        match_concurrency: Independent requests in flight at once
+        prefix: Output file name prefix (default: style_key)
+        compaction: How chained references are sent (default: all, as generated)
+    """
+
+    def __init__(self, client, style_key: str, style: dict, inputs: list, output_dir: Path, timestamp: str,
+                 model: str = MODEL_NAME, pool: PostProcessPool = None, memory: MemoryBudget = None,
+                 match_concurrency: int = MATCH_CONCURRENCY, prefix: str = None,
+                 compaction: ReferenceCompaction = None):
+        self.client = client
+        self.style_key = style_key
+        self.style = style
+        self.inputs = inputs
+        self.output_dir = Path(output_dir)
+        self.timestamp = timestamp
+        self.model = model
+        self.pool = pool
+        self.memory = memory or MemoryBudget()
+        self.match_concurrency = match_concurrency
+        self.target_size = (TARGET_WIDTH, int(TARGET_WIDTH * inputs[0].height / inputs[0].width))
+        self.config = GenerateContentConfig(
+            system_instruction=style["system_instruction"],
+            response_modalities=[Modality.TEXT, Modality.IMAGE],
+        )
+        self.prefix = prefix or style_key
+        self.compaction = compaction or ReferenceCompaction()
+        self._pending = []
+
+    def tag(self, photo_num: int) -> str:
+        return f"    [{self.style_key} {photo_num}/{len(self.inputs)}]"
+
+    def generate(self, contents: list, photo_num: int, expect: int = 1) -> list:
+        """One model call; the decoded output images ([] on failure)."""
+        tag = self.tag(photo_num)
+        try:
+            response = self.client.models.generate_content(model=self.model, contents=contents,
+                                                           config=self.config)
+            images = decode_images(response, limit=expect)
+        except Exception as e:
+            print(f"{tag} ERROR ({classify(e)}): {e}")
+            return []
+        if not images:
+            print(f"{tag} FAILED: No image returned")
+        return images
+
+    def finish(self, photo_num: int, output: Image.Image, inline: bool = False):
+        """
+        Post-process and save one output. Returns (saved path, reference
+        image); the path is None while the photo is queued on the pool.
+        """
+        tag = self.tag(photo_num)
+        size = fit_target_size(output, self.target_size)
+        output_path = self.output_dir / f"{self.prefix}_{self.timestamp}_{photo_num}.png"
+        max_memory = self.memory.upscale_memory(output, size, UPSCALE_MEMORY_LIMIT)
+
+        if self.pool and not inline:
+            self._pending.append(self.pool.submit(self.style["post_process"], output, size, output_path,
+                                                  max_memory))
+            print(f"{tag} Queued for post-processing: {output_path.name}")
+            return None, output
+
+        result = run_post_process(self.style["post_process"], output, size, max_memory=max_memory)
+        save_image(result.image, output_path, "PNG")
+        print(f"{tag} SAVED: {output_path.name} ({result.image.width}x{result.image.height}) "
+              f"{format_timings(result.timings)}")
+        return output_path, result.reference
+
+    def collect(self, paths: list) -> list:
+        """paths plus the photos finished on the pool, sorted."""
+        paths = [p for p in paths if p]
+        for future in self._pending:
+            try:
+                saved = future.result()
+                print(f"    SAVED: {saved.path.name} ({saved.size[0]}x{saved.size[1]}) "
+                      f"{format_timings(saved.timings)}")
+                paths.append(saved.path)
+            except Exception as e:
+                print(f"    ERROR: post-processing failed: {e}")
+        self._pending = []
+        return sorted(paths)
+
+
+class Strategy:
+    """
+    A way of keeping a session's photos consistent.
+
+    Subclasses set name and description and implement run(), which makes
+    the model calls through session.generate(), hands every output to
+    session.finish() and returns session.collect(paths).
+    """
+
+    name = ""
+    description = ""
+
+    def run(self, session: PhotoSession) -> list:
+        raise NotImplementedError
+
+    def photo(self, session: PhotoSession, i: int, contents: list, inline: bool = False):
+        """Generate and finish photo i (0-based). Returns (saved path, reference image)."""
+        set_trace_attributes(photo=i + 1)
+        images = session.generate(contents, i + 1)
+        if not images:
+            return None, None
+        print(f"{session.tag(i + 1)} Gemini output: {images[0].width}x{images[0].height}")
+        return session.finish(i + 1, images[0], inline)
+
+
+@register_strategy
+class MasterReference(Strategy):
+    name = "master"
+    description = "photo 1 sets the style, the others match it concurrently"
+
+    def run(self, session: PhotoSession) -> list:
+        style = session.style
+        # The master stays inline: its reference image gates the others
+        master_path, master = self.photo(session, 0, [session.inputs[0], style["prompt_master"]], inline=True)
+        if master is None:
+            print("    No MASTER output, skipping the remaining photos")
+            return session.collect([])
+
+        reference = session.memory.reference(master)
+        matches = fan_out(lambda i: self.photo(session, i, [reference, session.inputs[i],
+                                                            style["prompt_match"]])[0],
+                          range(1, len(session.inputs)), session.match_concurrency)
+        return session.collect([master_path] + matches)
+
+
+@register_strategy
+class Chained(Strategy):
+    name = "chained"
+    description = "each photo references the earlier outputs"
+
+    def references(self, session: PhotoSession, outputs: list) -> tuple:
+        """(reference images, their labels) sent with the next photo."""
+        references = session.compaction.compact(outputs)
+        return [r.image for r in references], reference_labels(references, "REFERENCE photo {photo}")
+
+    def run(self, session: PhotoSession) -> list:
+        style = session.style
+        outputs = []
+        paths = []
+        for i, target in enumerate(session.inputs):
+            if not outputs:
+                contents = [target, style["prompt_master"]]
+            else:
+                references, labels = self.references(session, outputs)
+                prompt = with_image_order(style["prompt_match"], labels + ["TARGET input"])
+                contents = list(references) + [target, prompt]
+            path, reference = self.photo(session, i, contents, inline=True)
+            paths.append(path)
+            if reference is not None:
+                outputs.append((i + 1, session.memory.reference(reference)))
+        return session.collect(paths)
+
+
+@register_strategy
+class Batch(Strategy):
+    name = "batch"
+    description = "one request with every input, one output per input"
+
+    def run(self, session: PhotoSession) -> list:
+        count = len(session.inputs)
+        labels = [f"TARGET photo {n}" for n in range(1, count + 1)]
+        prompt = with_image_order(
+            f"{session.style['prompt_master']}\n\n"
+            f"These {count} photos are one session, taken moments apart with the same preset. "
+            f"Output exactly {count} images, one per input photo in the same order, "
+            f"all with identical style parameters.",
+            labels)
+        set_trace_attributes(photo=0)
+        images = session.generate(list(session.inputs) + [prompt], 0, expect=count)
+        if images and len(images) != count:
+            print(f"    WARNING: expected {count} images, got {len(images)}")
+        paths = []
+        for i, image in enumerate(images):
+            set_trace_attributes(photo=i + 1)
+            paths.append(session.finish(i + 1, image)[0])
+        return session.collect(paths)
+
+
+@register_strategy
+class Individual(Strategy):
+    name = "individual"
+    description = "every photo styled on its own, concurrently"
+
+    def run(self, session: PhotoSession) -> list:
+        prompt = session.style["prompt_master"]
+        paths = fan_out(lambda i: self.photo(session, i, [session.inputs[i], prompt])[0],
+                        range(len(session.inputs)), session.match_concurrency)
+        return session.collect(paths)
@@ -0,0 +1,142 @@
+"""
+Tiled, thread-parallel execution of image kernels.
+
+Frames are split into bands (rows by default, or column strips). Each band
+is rendered with `halo` extra rows/columns on both sides so convolution
+filters see the same neighbourhood they would in the full frame; the halo is
+cropped off before the band is pasted into the output, so tiled output is
+identical to the single-pass result. Pillow releases the GIL inside its C
+kernels (resize, filter, convert, point, blend), so bands run in parallel on
+a thread pool.
+"""
+
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+# Kiosk backends have 8+ cores; stay at or below the machine's count
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Bands thinner than this spend more time on halo than on real pixels
+MIN_BAND_SIZE = 64
+
+ROWS = "rows"
+COLUMNS = "columns"
+
+# Rows (or columns) [start, stop) are kept; [halo_start, halo_stop) are rendered
+Band = namedtuple("Band", ["start", "stop", "halo_start", "halo_stop"])
+
+
+def split_bands(length: int, count: int = None, halo: int = 0, band_size: int = None) -> list:
+    """
+    Split `length` rows into bands, either `count` bands or bands of
+    `band_size` rows, each extended by `halo` rows (clamped to the frame).
+    """
+    if band_size is None:
+        count = max(1, min(count or 1, length // MIN_BAND_SIZE or 1))
+        band_size = -(-length // count)
+    band_size = max(1, band_size)
+
+    bands = []
+    for start in range(0, length, band_size):
+        stop = min(length, start + band_size)
+        bands.append(Band(start, stop, max(0, start - halo), min(length, stop + halo)))
+    return bands
+
+
+def _map_ordered(pool: ThreadPoolExecutor, fn, items: list, window: int):
+    """
+    pool.map with at most `window` items submitted at a time.
+
+    Results are yielded in order; unlike pool.map, finished bands do not
+    pile up behind a slow one, which keeps streaming memory bounded.
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            done_item, future = pending.popleft()
+            yield done_item, future.result()
+        pending.append((item, pool.submit(fn, item)))
+    while pending:
+        done_item, future = pending.popleft()
+        yield done_item, future.result()
+
+
+def band_box(band: Band, size: tuple, axis: str = ROWS, halo: bool = True) -> tuple:
+    """Crop box of a band (with or without its halo) within an image of `size`."""
+    start, stop = (band.halo_start, band.halo_stop) if halo else (band.start, band.stop)
+    if axis == COLUMNS:
+        return (start, 0, stop, size[1])
+    return (0, start, size[0], stop)
+
+
+def _trim(piece: Image.Image, band: Band, axis: str) -> Image.Image:
+    """Drop the halo from a rendered band."""
+    offset = band.start - band.halo_start
+    length = band.stop - band.start
+    if axis == COLUMNS:
+        if offset == 0 and piece.width == length:
+            return piece
+        return piece.crop((offset, 0, offset + length, piece.height))
+    if offset == 0 and piece.height == length:
+        return piece
+    return piece.crop((0, offset, piece.width, offset + length))
+
+
+def render_tiled(size: tuple, render, halo: int = 0, workers: int = None,
+                 band_size: int = None, axis: str = ROWS) -> Image.Image:
+    """
+    Build an image of `size` band by band.
+
+    render(band) must return the output region band_box(band, size, axis)
+    (halo included). With one worker and no band_size the whole frame is
+    rendered in a single call.
+
+    Args:
+        halo: Rows/columns of context each band needs on both sides
+        workers: Thread count (default DEFAULT_WORKERS)
+        band_size: Fixed band size (used by streaming callers to bound memory)
+        axis: ROWS (horizontal bands) or COLUMNS (vertical strips)
+    """
+    workers = DEFAULT_WORKERS if workers is None else max(1, workers)
+    length = size[1] if axis == ROWS else size[0]
+
+    if workers == 1 and band_size is None:
+        return render(Band(0, length, 0, length))
+
+    bands = split_bands(length, count=workers, halo=halo, band_size=band_size)
+    if len(bands) == 1:
+        return render(bands[0])
+
+    output = None
+
+    def paste(band, piece):
+        nonlocal output
+        if output is None:
+            output = Image.new(piece.mode, size)
+        output.paste(_trim(piece, band, axis), band_box(band, size, axis, halo=False)[:2])
+
+    if workers == 1:
+        for band in bands:
+            paste(band, render(band))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for band, piece in _map_ordered(pool, render, bands, workers):
+                paste(band, piece)
+    return output
+
+
+def map_tiled(img: Image.Image, fn, halo: int = 0, workers: int = None,
+              band_size: int = None, axis: str = ROWS) -> Image.Image:
+    """Apply a same-size kernel fn(image) -> image band by band."""
+    length = img.height if axis == ROWS else img.width
+
+    def render(band):
+        if band.halo_start == 0 and band.halo_stop == length:
+            return fn(img)
+        return fn(img.crop(band_box(band, img.size, axis)))
+
+    return render_tiled(img.size, render, halo=halo, workers=workers, band_size=band_size, axis=axis)
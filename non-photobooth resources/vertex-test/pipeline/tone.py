@@ -0,0 +1,148 @@
+"""
+Tone mapping helpers.
+
+Per-pixel tone changes are expressed as 256-entry lookup tables and applied
+with Image.point(), a single bulk pass in C.
+"""
+
+from functools import lru_cache
+from typing import Callable, Optional
+
+from PIL import Image
+
+
+# New York faded print range: blacks lifted to #252525, whites dulled to #EBEBEB
+FADED_BLACK = 37
+FADED_WHITE = 235
+
+
+@lru_cache(maxsize=32)
+def gamma_curve(gamma: float) -> Callable[[float], float]:
+    """
+    Tone curve for faded_bw_lut: gamma > 1 darkens mids, < 1 lifts them.
+    Equal gammas return the same curve, so faded_bw_lut's cache hits.
+    """
+    return lambda x: x ** gamma
+
+
+@lru_cache(maxsize=32)
+def faded_bw_lut(black: int = FADED_BLACK, white: int = FADED_WHITE,
+                 curve: Optional[Callable[[float], float]] = None) -> tuple:
+    """
+    Build the 256-entry faded tone LUT.
+
+    Maps 0 -> black and 255 -> white linearly. If a curve is given it is
+    applied to the normalized input (0.0-1.0) before the fade.
+    """
+    lut = []
+    for value in range(256):
+        x = value / 255.0
+        if curve is not None:
+            x = min(1.0, max(0.0, curve(x)))
+        lut.append(int(black + x * (white - black)))
+    return tuple(lut)
+
+
+def convert_to_faded_bw(img: Image.Image, black: int = FADED_BLACK, white: int = FADED_WHITE,
+                        curve: Optional[Callable[[float], float]] = None, mode: str = 'RGB') -> Image.Image:
+    """
+    Convert to faded black & white for New York vintage style.
+    Blacks lifted to #252525, whites dulled to #EBEBEB by default.
+
+    Args:
+        black: Output level for pure black input
+        white: Output level for pure white input
+        curve: Optional tone curve applied before the fade (see gamma_curve)
+        mode: 'RGB' (default) or 'L' to keep the single-channel image
+    """
+    bw = img.convert('L').point(list(faded_bw_lut(black, white, curve)))
+    if mode == 'L':
+        return bw
+    return bw.convert(mode)
+
+
+# ============================================================================
+# COLOR MATRICES
+# ============================================================================
+
+# ITU-R 601-2 luma weights, as used by Image.convert('L') and ImageEnhance
+LUMA = (0.299, 0.587, 0.114)
+
+# 3x4 affine matrix in the layout Image.convert('RGB', matrix) expects
+IDENTITY_MATRIX = (
+    1.0, 0.0, 0.0, 0.0,
+    0.0, 1.0, 0.0, 0.0,
+    0.0, 0.0, 1.0, 0.0,
+)
+
+
+def compose_matrices(*matrices) -> tuple:
+    """Compose 3x4 affine matrices; the first one listed is applied first."""
+    result = IDENTITY_MATRIX
+    for m in matrices:
+        composed = []
+        for row in range(3):
+            a = m[row * 4:row * 4 + 4]
+            for col in range(4):
+                value = sum(a[k] * result[k * 4 + col] for k in range(3))
+                if col == 3:
+                    value += a[3]
+                composed.append(value)
+        result = tuple(composed)
+    return result
+
+
+def brightness_matrix(factor: float) -> tuple:
+    """Matrix form of ImageEnhance.Brightness (blend toward black)."""
+    return (
+        factor, 0.0, 0.0, 0.0,
+        0.0, factor, 0.0, 0.0,
+        0.0, 0.0, factor, 0.0,
+    )
+
+
+def contrast_matrix(factor: float, mean: float) -> tuple:
+    """Matrix form of ImageEnhance.Contrast (blend toward the mean gray)."""
+    offset = (1.0 - factor) * mean
+    return (
+        factor, 0.0, 0.0, offset,
+        0.0, factor, 0.0, offset,
+        0.0, 0.0, factor, offset,
+    )
+
+
+def color_matrix(factor: float) -> tuple:
+    """Matrix form of ImageEnhance.Color (blend toward luma)."""
+    rows = []
+    for row in range(3):
+        for col in range(3):
+            rows.append((1.0 - factor) * LUMA[col] + (factor if row == col else 0.0))
+        rows.append(0.0)
+    return tuple(rows)
+
+
+def luma_mean(img: Image.Image) -> int:
+    """Mean gray level, rounded the way ImageEnhance.Contrast rounds it."""
+    histogram = img.convert('L').histogram()
+    total = sum(histogram)
+    if not total:
+        return 0
+    return int(sum(i * n for i, n in enumerate(histogram)) / total + 0.5)
+
+
+def apply_color_matrix(img: Image.Image, matrix: tuple) -> Image.Image:
+    """
+    Apply a 3x4 affine color matrix in one pass.
+    L images stay L (gray in, gray out); other modes are treated as RGB.
+    """
+    if matrix == IDENTITY_MATRIX:
+        return img
+    if img.mode == 'L':
+        # For gray input every row sees r = g = b, so row 0 describes the map
+        gain = matrix[0] + matrix[1] + matrix[2]
+        offset = matrix[3]
+        lut = [max(0, min(255, int(v * gain + offset + 0.5))) for v in range(256)]
+        return img.point(lut)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img.convert('RGB', matrix)
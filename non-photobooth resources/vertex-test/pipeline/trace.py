@@ -0,0 +1,167 @@
+"""
+Span tracing for photo sessions.
+
+The print timestamps could not say how a photo's wall time splits between
+loading, request serialization, the model call, decoding, post-processing,
+upscaling and saving. The pipeline wraps each of those stages in span();
+with tracing enabled every span is recorded with the session/style/photo/
+model attributes in effect, and save_trace() writes them as a Chrome trace
+(open it in chrome://tracing or https://ui.perfetto.dev). Threads show up as
+separate tracks, so concurrent styles and match calls are easy to tell
+apart. Tracing is off unless a script enables it, and span() is then close
+to free.
+
+    enable_tracing(session=timestamp)
+    set_trace_attributes(style="korean", photo=1)
+    with span("upscale", size="2400x1599"):
+        ...
+    save_trace("trace.json")
+
+Scripts take --trace PATH to turn it on. Span listeners (add_span_listener)
+see every finished span whether or not a trace is being written; the run
+metrics (pipeline.metrics) are built that way.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_attributes = ContextVar("trace_attributes", default={})
+_parent = ContextVar("trace_parent", default=None)
+_listeners = []
+
+
+class Tracer:
+    """Collects finished spans as Chrome trace events."""
+
+    def __init__(self):
+        self.enabled = False
+        self.attributes = {}  # session-wide attributes
+        self.events = []
+        self._threads = {}    # thread ident -> (track id, name)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _track(self) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            if ident not in self._threads:
+                self._threads[ident] = (len(self._threads) + 1, threading.current_thread().name)
+            return self._threads[ident][0]
+
+    def add(self, name: str, start: float, end: float, attributes: dict, track: int = None):
+        """Record a span from perf_counter() start/end times."""
+        event = {
+            "name": name,
+            "cat": attributes.get("style") or "session",
+            "ph": "X",
+            "ts": (start - self._start) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": track or self._track(),
+            "args": {**self.attributes, **attributes},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def save(self, path):
+        """Write the spans recorded so far as Chrome trace JSON."""
+        with self._lock:
+            threads = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": track,
+                        "args": {"name": name}} for track, name in self._threads.values()]
+            events = threads + list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+TRACER = Tracer()
+
+
+def enable_tracing(**attributes):
+    """Start recording spans; attributes (e.g. session=timestamp) go on every span."""
+    TRACER.enabled = True
+    TRACER.attributes.update(attributes)
+
+
+def add_span_listener(listener):
+    """Call listener(name, seconds, attributes) for every finished span."""
+    _listeners.append(listener)
+
+
+def remove_span_listener(listener):
+    """Stop calling a listener added with add_span_listener."""
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def record_span(name: str, start: float, end: float, attributes: dict):
+    """Report a span timed elsewhere (perf_counter() start/end)."""
+    if TRACER.enabled:
+        TRACER.add(name, start, end, attributes)
+    for listener in list(_listeners):
+        listener(name, end - start, attributes)
+
+
+def save_trace(path):
+    TRACER.save(path)
+    print(f"Trace: {path} ({len(TRACER.events)} spans)")
+
+
+def add_trace_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="Write a Chrome trace of every stage (load, serialize, model call, decode, "
+             "post-process, upscale, save) to PATH"
+    )
+
+
+def trace_option(argv: list = None):
+    """The --trace option of a script that takes no other arguments."""
+    parser = argparse.ArgumentParser(add_help=False)
+    add_trace_argument(parser)
+    args, _ = parser.parse_known_args(argv)
+    return args.trace
+
+
+def set_trace_attributes(**attributes):
+    """Attributes for the spans that follow in this thread/context (style, photo...)."""
+    _attributes.set({**_attributes.get(), **attributes})
+
+
+def current_attributes() -> dict:
+    return dict(_attributes.get())
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the enclosed block as one span.
+
+    Yields a dict the block can add attributes to (e.g. the model that
+    served a call). A span opened inside another gets the outer span's name
+    as its "parent" attribute.
+    """
+    if not TRACER.enabled and not _listeners:
+        yield {}
+        return
+    attributes = {**_attributes.get(), **attributes}
+    if _parent.get():
+        attributes["parent"] = _parent.get()
+    token = _parent.set(name)
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        record_span(name, start, time.perf_counter(), attributes)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Strategy runner.
+
+Runs one or more session consistency strategies (pipeline.strategies) on
+the same input photos, with the v4 styles from test_all_styles_v4.py and
+the shared client stack, post-processing and reporting. This is the
+single entry point for what the per-strategy scripts each do by hand.
+
+Usage:
+    python run_strategy.py --strategy master
+    python run_strategy.py --strategy chained batch --style newyork --photos 3
+    python run_strategy.py --strategy all --backend replay
+    python run_strategy.py --plugin my_strategies --strategy my_strategy
+"""
+
+import argparse
+import importlib
+import importlib.util
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+def _installed(module: str) -> bool:
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:  # parent package missing
+        return False
+
+
+if not all(_installed(m) for m in ("google.genai", "PIL")):
+    print("Missing required packages. Install them with:")
+    print("  pip install google-genai Pillow")
+    sys.exit(1)
+
+from pipeline.backend import add_backend_argument, make_client
+from pipeline.fanout import MATCH_CONCURRENCY
+from pipeline.memory import MB, MemoryBudget, add_memory_argument
+from pipeline.metrics import METRICS, add_metrics_argument, enable_metrics
+from pipeline.payload import PAYLOADS, load_image
+from pipeline.postpool import PostProcessPool
+from pipeline.references import add_references_argument
+from pipeline.routing import ModelRouter
+from pipeline.session import build_client
+from pipeline.strategies import MODEL_NAME, STRATEGIES, PhotoSession
+from pipeline.trace import add_trace_argument, enable_tracing, save_trace, set_trace_attributes
+from test_all_styles_v4 import STYLES
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run photo booth session strategies on the same inputs")
+    parser.add_argument("--plugin", nargs="+", default=[], metavar="MODULE",
+                        help="Import these modules first (they register more strategies)")
+    parser.add_argument("--strategy", nargs="+", default=["master"],
+                        help="Strategies to run, or 'all' (default: master)")
+    parser.add_argument("--style", "-s", choices=list(STYLES) + ["all"], default="japanese",
+                        help="Style to run (default: japanese)")
+    parser.add_argument("--model", "-m", default=MODEL_NAME, help=f"Gemini model (default: {MODEL_NAME})")
+    parser.add_argument("--photos", "-p", type=int, default=4, help="Photos per session (default: 4)")
+    parser.add_argument("--post-workers", type=int, default=0,
+                        help="Post-process and save on this many worker processes (default: 0, inline)")
+    parser.add_argument("--match-concurrency", type=int, default=MATCH_CONCURRENCY,
+                        help=f"Independent requests in flight at once (default: {MATCH_CONCURRENCY})")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse on-disk responses for identical requests (default: GEMINI_CACHE, off)")
+    add_backend_argument(parser)
+    add_trace_argument(parser)
+    add_metrics_argument(parser)
+    add_memory_argument(parser)
+    add_references_argument(parser)
+    args = parser.parse_args()
+
+    for module in args.plugin:
+        importlib.import_module(module)
+    strategies = list(STRATEGIES) if "all" in args.strategy else args.strategy
+    unknown = [s for s in strategies if s not in STRATEGIES]
+    if unknown:
+        print(f"Error: unknown strategy {', '.join(unknown)} (have: {', '.join(STRATEGIES)})")
+        return 1
+
+    print("=" * 70)
+    print("STRATEGY RUNNER")
+    for name in strategies:
+        print(f"  {name}: {STRATEGIES[name].description}")
+    print("=" * 70)
+
+    # Environment
+    backend = args.backend
+    project = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    if not project and backend.needs_project:
+        print("\nError: GOOGLE_CLOUD_PROJECT not set")
+        return 1
+    os.environ.setdefault("GOOGLE_GENAI_USE_VERTEXAI", "True")
+
+    # Paths
+    script_dir = Path(__file__).parent
+    input_dir = script_dir / "input"
+    output_dir = script_dir / "output"
+    output_dir.mkdir(exist_ok=True)
+
+    input_images = (sorted(input_dir.glob("*.jpg")) + sorted(input_dir.glob("*.JPG")))[:args.photos]
+    if len(input_images) < args.photos:
+        print(f"\nError: Need {args.photos} images, found {len(input_images)}")
+        return 1
+
+    print("\nInput photos:")
+    inputs = []
+    for i, p in enumerate(input_images, 1):
+        inputs.append(load_image(p))
+        print(f"  {i}. {p.name} ({inputs[-1].width}x{inputs[-1].height})")
+
+    client = build_client(make_client(backend), cache=True if args.cache else None)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    enable_metrics()
+    memory = MemoryBudget(args.memory_limit * MB).start()
+    if args.trace:
+        enable_tracing(session=timestamp, script="run_strategy")
+
+    pool = PostProcessPool(args.post_workers) if args.post_workers > 0 else None
+    styles = list(STYLES) if args.style == "all" else [args.style]
+
+    results = []
+    try:
+        for strategy_name in strategies:
+            strategy = STRATEGIES[strategy_name]()
+            for style_key in styles:
+                print(f"\n{'='*70}")
+                print(f"{strategy_name.upper()}: {STYLES[style_key]['name']}")
+                print("=" * 70)
+                set_trace_attributes(style=style_key, model=args.model, strategy=strategy_name)
+                session = PhotoSession(client, style_key, STYLES[style_key], inputs, output_dir, timestamp,
+                                       model=args.model, pool=pool, memory=memory,
+                                       match_concurrency=args.match_concurrency,
+                                       prefix=f"{style_key}_{strategy_name}", compaction=args.references)
+                start = time.perf_counter()
+                outputs = strategy.run(session)
+                results.append((strategy_name, style_key, outputs, time.perf_counter() - start))
+    finally:
+        if pool:
+            pool.close()
+        memory.close()
+
+    # Summary
+    print(f"\n{'='*70}")
+    print("SUMMARY")
+    print("=" * 70)
+    for strategy_name, style_key, outputs, wall_time in results:
+        print(f"\n{strategy_name} / {style_key}: {len(outputs)}/{len(inputs)} photos in {wall_time:.1f}s")
+        for p in outputs:
+            print(f"  {p.name}")
+
+    print(f"\nModels: {client.layer(ModelRouter).describe()}")
+    print(f"Payloads: {PAYLOADS.describe()}")
+    print("Memory:\n  " + memory.describe().replace("\n", "\n  "))
+    print("Metrics:\n  " + METRICS.summary().replace("\n", "\n  "))
+    if args.trace:
+        save_trace(args.trace)
+    if args.metrics:
+        METRICS.write(args.metrics)
+    print(f"\nOutput directory: {output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
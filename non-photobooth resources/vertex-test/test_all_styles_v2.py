@@ -12,7 +12,6 @@ from io import BytesIO
 from datetime import datetime
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality
     from PIL import Image
 except ImportError as e:
@@ -20,6 +19,10 @@ except ImportError as e:
     print("  pip install google-genai Pillow")
     raise e
 
+from pipeline.backend import backend_option, make_client
+from pipeline.references import ReferenceCompaction, describe_references, image_order, references_option
+from pipeline.session import build_client
+
 
 # ============================================================================
 # ENHANCED PROMPTS v2
@@ -270,8 +273,15 @@ STYLE_PROMPTS = {
 }
 
 
-def process_style_chained(style: str, input_images: list, output_dir: Path, client, timestamp: str):
-    """Process all images for a single style using chained references."""
+def process_style_chained(style: str, input_images: list, output_dir: Path, client, timestamp: str,
+                          compaction: ReferenceCompaction = None):
+    """
+    Process all images for a single style using chained references.
+
+    compaction limits what each request sends of the earlier outputs
+    (pipeline.references); by default every one goes as generated.
+    """
+    compaction = compaction or ReferenceCompaction()
 
     prompts = STYLE_PROMPTS[style]
     style_name = prompts["name"]
@@ -283,7 +293,7 @@ def process_style_chained(style: str, input_images: list, output_dir: Path, clie
     # Load all input images
     pil_inputs = [Image.open(p) for p in input_images]
 
-    generated_outputs = []
+    generated_outputs = []  # (photo number, image)
     output_paths = []
 
     for i in range(len(input_images)):
@@ -296,25 +306,21 @@ def process_style_chained(style: str, input_images: list, output_dir: Path, clie
             contents = [pil_inputs[0], prompt]
             print(f"    Establishing master style...")
         else:
-            # Subsequent photos - use chained references
-            image_order_desc = []
-            for ref_idx in range(len(generated_outputs)):
-                image_order_desc.append(f"- Image {ref_idx + 1}: REFERENCE (processed Photo {ref_idx + 1})")
-            image_order_desc.append(f"- Image {len(generated_outputs) + 1}: TARGET (Photo {photo_num})")
-
-            if len(generated_outputs) == 1:
+            # Subsequent photos - use chained references (compacted if configured)
+            references = compaction.compact(generated_outputs)
+            if ReferenceCompaction.photo_count(references) == 1:
                 ref_note = "Reference image provided shows the EXACT style to apply."
             else:
-                ref_note = f"{len(generated_outputs)} reference images provided. Match their consistent style EXACTLY."
+                ref_note = f"{describe_references(references)} provided. Match their consistent style EXACTLY."
 
             prompt = prompts["chained"].format(
                 photo_num=photo_num,
                 reference_note=ref_note,
-                image_order="\n".join(image_order_desc)
+                image_order=image_order(references, f"TARGET (Photo {photo_num})")
             )
 
-            contents = generated_outputs + [pil_inputs[i], prompt]
-            print(f"    Using {len(generated_outputs)} reference(s)...")
+            contents = [r.image for r in references] + [pil_inputs[i], prompt]
+            print(f"    Using {len(references)} reference(s)...")
 
         try:
             response = client.models.generate_content(
@@ -335,15 +341,15 @@ def process_style_chained(style: str, input_images: list, output_dir: Path, clie
                 output_path = output_dir / f"{style}_v2_{timestamp}_{photo_num}.png"
                 output_image.save(output_path)
                 print(f"    SUCCESS: {output_path.name} ({output_image.size[0]}x{output_image.size[1]})")
-                generated_outputs.append(output_image)
+                generated_outputs.append((photo_num, output_image))
                 output_paths.append(output_path)
             else:
                 print(f"    FAILED: No image returned")
-                generated_outputs.append(pil_inputs[i])  # Fallback
+                generated_outputs.append((photo_num, pil_inputs[i]))  # Fallback
 
         except Exception as e:
             print(f"    ERROR: {e}")
-            generated_outputs.append(pil_inputs[i])  # Fallback
+            generated_outputs.append((photo_num, pil_inputs[i]))  # Fallback
 
     return output_paths
 
@@ -357,8 +363,10 @@ def main():
     print("=" * 70)
 
     # Environment setup
+    backend = backend_option()
+    compaction = references_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         return
 
@@ -382,7 +390,7 @@ def main():
         print(f"  {i}. {p.name}")
 
     # Initialize client
-    client = genai.Client()
+    client = build_client(make_client(backend))
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     # Process each style
@@ -390,7 +398,7 @@ def main():
 
     for style in ["japanese", "korean", "newyork"]:
         style_outputs = process_style_chained(
-            style, input_images, output_dir, client, timestamp
+            style, input_images, output_dir, client, timestamp, compaction
         )
         results[style] = style_outputs
 
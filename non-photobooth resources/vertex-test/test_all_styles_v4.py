@@ -11,144 +11,51 @@ Features:
 
 import os
 from pathlib import Path
-from io import BytesIO
 from datetime import datetime
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality
-    from PIL import Image, ImageEnhance, ImageFilter
+    from PIL import Image
 except ImportError as e:
     print("Missing required packages. Install them with:")
     print("  pip install google-genai Pillow")
     raise e
 
-
-# ============================================================================
-# BACKGROUND PROCESSING
-# ============================================================================
-
-def ensure_background_color(img: Image.Image, target_color: tuple, threshold: int = 235, edge_aware: bool = False) -> Image.Image:
-    """
-    Ensure background matches target color.
-    For light backgrounds (white/gray), brightens near-target pixels.
-
-    Args:
-        edge_aware: If True, only replace edge pixels (safer for preserving clothing/text)
-    """
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-
-    pixels = img.load()
-    width, height = img.size
-
-    if edge_aware:
-        # Only process edge regions (top, sides, bottom)
-        edge_margin = int(height * 0.15)  # Top/bottom 15%
-        side_margin = int(width * 0.15)   # Left/right 15%
-
-        for y in range(height):
-            for x in range(width):
-                # Check if pixel is in edge region
-                is_edge = (y < edge_margin or y > height - edge_margin or
-                          x < side_margin or x > width - side_margin)
-
-                if is_edge:
-                    r, g, b = pixels[x, y]
-                    if r > threshold and g > threshold and b > threshold:
-                        pixels[x, y] = target_color
-    else:
-        # Original behavior - replace all light pixels
-        for y in range(height):
-            for x in range(width):
-                r, g, b = pixels[x, y]
-                if r > threshold and g > threshold and b > threshold:
-                    pixels[x, y] = target_color
-
-    return img
-
-
-def convert_to_faded_bw(img: Image.Image) -> Image.Image:
-    """
-    Convert to faded black & white for New York vintage style.
-    Blacks lifted to #252525, whites dulled to #EBEBEB.
-    """
-    # Convert to grayscale
-    bw = img.convert('L')
-
-    # Fade the tones - lift blacks, dull whites
-    pixels = bw.load()
-    width, height = bw.size
-
-    for y in range(height):
-        for x in range(width):
-            value = pixels[x, y]
-            # Map 0-255 to 37-235 (faded range)
-            # 0 (black) -> 37 (#252525)
-            # 255 (white) -> 235 (#EBEBEB)
-            faded = int(37 + (value / 255.0) * (235 - 37))
-            pixels[x, y] = faded
-
-    # Convert back to RGB
-    return bw.convert('RGB')
-
-
-def add_film_grain(img: Image.Image, intensity: float = 0.02) -> Image.Image:
-    """Add film grain texture for vintage look."""
-    import random
-
-    pixels = img.load()
-    width, height = img.size
-
-    for y in range(height):
-        for x in range(width):
-            # Add random grain
-            grain = int((random.random() - 0.5) * 255 * intensity * 2)
-            r, g, b = pixels[x, y]
-
-            # Apply grain to all channels equally (for B&W)
-            new_val = max(0, min(255, r + grain))
-            pixels[x, y] = (new_val, new_val, new_val)
-
-    return img
+from pipeline.backend import backend_option, make_client
+from pipeline.fanout import MATCH_CONCURRENCY, fan_out
+from pipeline.postpool import PostProcessPool
+from pipeline.postprocess import faded_bw, film_grain, format_timings, run_post_process, upscale
+from pipeline.client import last_call
+from pipeline.payload import PAYLOADS, decode_image, load_image, save_image
+from pipeline.session import build_client
+from pipeline.memory import MemoryBudget, memory_option
+from pipeline.metrics import METRICS, enable_metrics, metrics_option
+from pipeline.trace import enable_tracing, save_trace, set_trace_attributes, trace_option
+from pipeline.upscale import fit_target_size
 
 
 # ============================================================================
-# UPSCALING
+# STYLE-SPECIFIC PROMPTS
 # ============================================================================
 
-def enhanced_upscale(img: Image.Image, target_size: tuple = None, scale: float = 2.0) -> Image.Image:
-    """Multi-pass enhanced upscaling."""
-    if target_size:
-        new_width, new_height = target_size
-    else:
-        new_width = int(img.width * scale)
-        new_height = int(img.height * scale)
-
-    upscaled = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    smoothed = upscaled.filter(ImageFilter.GaussianBlur(radius=0.3))
-    sharpened = smoothed.filter(ImageFilter.UnsharpMask(radius=1.5, percent=80, threshold=2))
-    result = Image.blend(upscaled, sharpened, alpha=0.7)
+# Fixed grain seed so New York outputs are reproducible between runs
+NEWYORK_GRAIN_SEED = 1977
 
-    enhancer = ImageEnhance.Contrast(result)
-    result = enhancer.enhance(1.02)
+# Per-photo upscale memory ceiling; 4096px model outputs stream in bands above it
+UPSCALE_MEMORY_LIMIT = 128 * 1024 * 1024  # bytes
 
-    enhancer = ImageEnhance.Color(result)
-    result = enhancer.enhance(1.03)
+# Duplicate a Gemini call once it is slower than this share of observed
+# calls (e.g. 0.9); None disables hedging
+HEDGE_PERCENTILE = None
 
-    return result
-
-
-# ============================================================================
-# STYLE-SPECIFIC PROMPTS
-# ============================================================================
+# Finish photos 2-4 (post-process, upscale, save) on this many worker
+# processes; 0 keeps everything on the main thread
+POST_PROCESS_PROCESSES = 0
 
 STYLES = {
     "japanese": {
         "name": "Japanese Purikura",
         "background_color": (255, 255, 255),  # White
-        "skip_background_enforcement": True,  # Rely only on Gemini prompt
-        "skip_color_boost": True,  # No post-processing color enhancement
         "system_instruction": """You are a FuRyu-Style Purikura Engine with Selective Feature Warping.
 
 Your objective is to apply Japanese Purikura stylization to the eyes, skin, and head shape, while strictly PRESERVING the mouth and expression geometry via masking. Make sure the photo quality is high enough to seem like a real Purikura photo.
@@ -255,13 +162,15 @@ PRESERVE FROM TARGET (IMMUTABLE):
 Images: [REFERENCE master, TARGET input]
 OUTPUT: High-resolution matching reference Purikura style with white background.""",
 
-        "post_process": lambda img: img  # No extra processing
+        # Background enforcement and color boost are off: rely only on the Gemini prompt.
+        # To re-enable them:
+        #   [upscale(), saturation(1.08), brightness(1.02), background((255, 255, 255))]
+        "post_process": [upscale()],
     },
 
     "korean": {
         "name": "Korean 인생네컷",
         "background_color": (168, 168, 168),  # Neutral gray
-        "skip_background_enforcement": True,  # Disable post-processing, rely on Gemini
         "system_instruction": """You are a Korean Life Four Cuts (인생네컷) photo booth.
 
 PHILOSOPHY: Natural beauty through LIGHTING, not filters.
@@ -306,7 +215,8 @@ PRESERVE FROM TARGET:
 Images: [REFERENCE master, TARGET input]
 OUTPUT: High-res with reference lighting, gray background.""",
 
-        "post_process": lambda img: img  # Natural, no extra processing
+        # Natural, no extra processing; background relies on Gemini
+        "post_process": [upscale()],
     },
 
     "newyork": {
@@ -352,7 +262,7 @@ PRESERVE FROM TARGET:
 Images: [REFERENCE master, TARGET input]
 OUTPUT: High-res matching vintage B&W style.""",
 
-        "post_process": lambda img: add_film_grain(convert_to_faded_bw(img), 0.015)
+        "post_process": [faded_bw(), film_grain(0.015, seed=NEWYORK_GRAIN_SEED), upscale()],
     }
 }
 
@@ -361,15 +271,26 @@ OUTPUT: High-res matching vintage B&W style.""",
 # PROCESSING
 # ============================================================================
 
-def process_style(style_key: str, input_images: list, output_dir: Path, client, timestamp: str):
-    """Process all images for a single style with v4 improvements."""
+def process_style(style_key: str, input_images: list, output_dir: Path, client, timestamp: str,
+                  pool: PostProcessPool = None, memory: MemoryBudget = None):
+    """
+    Process all images for a single style with v4 improvements.
+
+    Once the master is done, the match calls run concurrently (up to
+    MATCH_CONCURRENCY) on the shared client. With a pool, photos after the
+    master are finished on worker processes (the master stays inline since
+    its reference image gates the others). Under memory pressure the master
+    reference is downscaled and upscales stream (see pipeline.memory).
+    """
+    memory = memory or MemoryBudget()
 
     style = STYLES[style_key]
     print(f"\n{'='*70}")
     print(f"STYLE: {style['name']}")
     print("=" * 70)
 
-    pil_inputs = [Image.open(p) for p in input_images]
+    set_trace_attributes(style=style_key, model="gemini-3-pro-image-preview")
+    pil_inputs = [load_image(p) for p in input_images]
 
     target_width = 2400
     target_height = int(target_width * pil_inputs[0].height / pil_inputs[0].width)
@@ -380,21 +301,23 @@ def process_style(style_key: str, input_images: list, output_dir: Path, client,
         response_modalities=[Modality.TEXT, Modality.IMAGE],
     )
 
-    master_output = None
-    output_paths = []
+    pending = []
 
-    for i in range(len(input_images)):
+    def process_photo(i: int, master_output: Image.Image = None):
+        """Generate and finish one photo. Returns (saved path, reference image)."""
         photo_num = i + 1
+        tag = f"    [{photo_num}/{len(input_images)}]"
+        set_trace_attributes(photo=photo_num)
         print(f"\n  Photo {photo_num}/{len(input_images)}: {input_images[i].name}")
 
         if i == 0:
             prompt = style["prompt_master"]
             contents = [pil_inputs[0], prompt]
-            print("    Creating MASTER style...")
+            print(f"{tag} Creating MASTER style...")
         else:
             prompt = style["prompt_match"]
             contents = [master_output, pil_inputs[i], prompt]
-            print("    Matching to MASTER...")
+            print(f"{tag} Matching to MASTER...")
 
         try:
             response = client.models.generate_content(
@@ -403,74 +326,59 @@ def process_style(style_key: str, input_images: list, output_dir: Path, client,
                 config=config,
             )
 
-            output_image = None
-            for part in response.candidates[0].content.parts:
-                if part.inline_data:
-                    output_image = Image.open(BytesIO(part.inline_data.data))
-                    break
+            output_image = decode_image(response)
 
             if not output_image:
-                print("    FAILED: No image returned")
-                continue
-
-            print(f"    Gemini output: {output_image.width}x{output_image.height}")
-
-            # Apply style-specific post-processing
-            output_image = style["post_process"](output_image)
-
-            # Enforce background color (before upscaling)
-            if style_key != "newyork" and not style.get("skip_background_enforcement", False):
-                print(f"    Enforcing background color...")
-                threshold = style.get("background_threshold", 230)
-                edge_aware = style.get("edge_aware", False)
-                output_image = ensure_background_color(
-                    output_image,
-                    style["background_color"],
-                    threshold=threshold,
-                    edge_aware=edge_aware
-                )
-            elif style.get("skip_background_enforcement", False):
-                print(f"    Skipping background enforcement (relying on Gemini prompt)...")
-
-            # Save master
-            if i == 0:
-                master_output = output_image
-
-            # Upscale
-            print(f"    Upscaling to {target_width}x{target_height}...")
-            upscaled = enhanced_upscale(output_image, target_size=(target_width, target_height))
-
-            # Style-specific enhancements
-            if style_key == "japanese" and not style.get("skip_color_boost", False):
-                # Boost colors for Purikura
-                enhancer = ImageEnhance.Color(upscaled)
-                upscaled = enhancer.enhance(1.08)
-                enhancer = ImageEnhance.Brightness(upscaled)
-                upscaled = enhancer.enhance(1.02)
-
-            # Final background check
-            if style_key != "newyork" and not style.get("skip_background_enforcement", False):
-                threshold = style.get("background_threshold", 230)
-                edge_aware = style.get("edge_aware", False)
-                upscaled = ensure_background_color(
-                    upscaled,
-                    style["background_color"],
-                    threshold=threshold,
-                    edge_aware=edge_aware
-                )
+                print(f"{tag} FAILED: No image returned")
+                return None, None
 
-            # Save
+            info = last_call()
+            print(f"{tag} Gemini output: {output_image.width}x{output_image.height} from {info.model_served}")
+            size = fit_target_size(output_image, (target_width, target_height))
             output_path = output_dir / f"{style_key}_v4_{timestamp}_{photo_num}.png"
-            upscaled.save(output_path, "PNG")
-            print(f"    SAVED: {output_path.name} ({upscaled.width}x{upscaled.height})")
-            output_paths.append(output_path)
+
+            max_memory = memory.upscale_memory(output_image, size, UPSCALE_MEMORY_LIMIT)
+            if pool and i > 0:
+                pending.append(pool.submit(style["post_process"], output_image, size, output_path, max_memory))
+                print(f"{tag} Queued for post-processing: {output_path.name}")
+                return None, None
+
+            # Declared post-processing (fused; reference = state before upscale)
+            result = run_post_process(style["post_process"], output_image, size, max_memory=max_memory)
+            print(f"{tag} Post-processed to {size[0]}x{size[1]}: {format_timings(result.timings)}")
+            upscaled = result.image
+
+            # Save
+            save_image(upscaled, output_path, "PNG")
+            print(f"{tag} SAVED: {output_path.name} ({upscaled.width}x{upscaled.height})")
+            return output_path, result.reference
 
         except Exception as e:
-            print(f"    ERROR: {e}")
+            print(f"{tag} ERROR: {e}")
             import traceback
             traceback.print_exc()
+            return None, None
 
-    return output_paths
+    # Master first; the matches only depend on it, so they go out together
+    master_path, master_output = process_photo(0)
+    if master_output is None:
+        print("    No MASTER output, skipping the remaining photos")
+        return []
+
+    reference = memory.reference(master_output)
+    matches = fan_out(lambda i: process_photo(i, reference)[0],
+                      range(1, len(input_images)), MATCH_CONCURRENCY)
+    output_paths = [p for p in [master_path] + matches if p]
+
+    for future in pending:
+        try:
+            saved = future.result()
+            print(f"    SAVED: {saved.path.name} ({saved.size[0]}x{saved.size[1]}) {format_timings(saved.timings)}")
+            output_paths.append(saved.path)
+        except Exception as e:
+            print(f"    ERROR: post-processing failed: {e}")
+
+    return sorted(output_paths)
 
 
 def main():
@@ -480,8 +388,12 @@ def main():
     print("=" * 70)
 
     # Environment
+    backend = backend_option()
+    trace_path = trace_option()
+    metrics_path = metrics_option()
+    memory_limit = memory_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         return
 
@@ -507,13 +419,26 @@ def main():
         print(f"  {i}. {p.name} ({img.width}x{img.height})")
 
     # Process each style
-    client = genai.Client()
+    client = build_client(make_client(backend), hedge_percentile=HEDGE_PERCENTILE)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    enable_metrics()
+    memory = MemoryBudget(memory_limit).start()
+    if trace_path:
+        enable_tracing(session=timestamp, script=Path(__file__).stem)
+
+    pool = None
+    if POST_PROCESS_PROCESSES:
+        pool = PostProcessPool(POST_PROCESS_PROCESSES, max_memory=UPSCALE_MEMORY_LIMIT)
 
     results = {}
-    for style_key in ["japanese"]:  # Testing Japanese only
-        outputs = process_style(style_key, input_images, output_dir, client, timestamp)
-        results[style_key] = outputs
+    try:
+        for style_key in ["japanese"]:  # Testing Japanese only
+            outputs = process_style(style_key, input_images, output_dir, client, timestamp, pool, memory)
+            results[style_key] = outputs
+    finally:
+        if pool:
+            pool.close()
+        memory.close()
 
     # Summary
     print(f"\n{'='*70}")
@@ -526,6 +451,13 @@ def main():
         for p in outputs:
             print(f"  {p.name}")
 
+    print(f"\nPayloads: {PAYLOADS.describe()}")
+    print("Memory:\n  " + memory.describe().replace("\n", "\n  "))
+    print("Metrics:\n  " + METRICS.summary().replace("\n", "\n  "))
+    if trace_path:
+        save_trace(trace_path)
+    if metrics_path:
+        METRICS.write(metrics_path)
     print(f"\nOutput directory: {output_dir}")
 
 
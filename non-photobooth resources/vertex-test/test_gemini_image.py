@@ -15,7 +15,6 @@ from io import BytesIO
 
 # Check for required packages
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality
     from PIL import Image
 except ImportError as e:
@@ -23,6 +22,9 @@ except ImportError as e:
     print("  pip install google-genai Pillow")
     raise e
 
+from pipeline.backend import backend_option, make_client
+from pipeline.session import build_client
+
 # Style prompts for your photobooth app
 STYLE_PROMPTS = {
     "korean": """Edit this photo to have a Korean photobooth style:
@@ -67,7 +69,7 @@ def test_gemini_image_editing(input_image_path: str, style: str, output_path: st
         raise ValueError(f"Style must be one of: {list(STYLE_PROMPTS.keys())}")
 
     # Initialize the client (uses ADC automatically)
-    client = genai.Client()
+    client = build_client(make_client())
 
     # Load the input image
     print(f"Loading image: {input_image_path}")
@@ -120,6 +122,7 @@ def main():
     print("=" * 60)
 
     # Check environment variables
+    backend = backend_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
     location = os.environ.get("GOOGLE_CLOUD_LOCATION", "global")
     use_vertex = os.environ.get("GOOGLE_GENAI_USE_VERTEXAI")
@@ -129,7 +132,7 @@ def main():
     print(f"  GOOGLE_CLOUD_LOCATION: {location}")
     print(f"  GOOGLE_GENAI_USE_VERTEXAI: {use_vertex or 'NOT SET ⚠️'}")
 
-    if not project:
+    if not project and backend.needs_project:
         print("\n❌ Error: GOOGLE_CLOUD_PROJECT environment variable not set")
         print("Run: export GOOGLE_CLOUD_PROJECT=your-project-id")
         return
@@ -13,42 +13,27 @@ Features:
 """
 
 import os
-import time
 from pathlib import Path
-from io import BytesIO
 from datetime import datetime
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality
-    from PIL import Image, ImageEnhance, ImageFilter
+    from PIL import Image
 except ImportError as e:
     print("Missing required packages. Install them with:")
     print("  pip install google-genai Pillow")
     raise e
 
-
-# ============================================================================
-# IMAGE PROCESSING FUNCTIONS
-# ============================================================================
-
-def enhanced_upscale(img: Image.Image, target_size: tuple = None, scale: float = 2.0) -> Image.Image:
-    """Multi-pass enhanced upscaling."""
-    if target_size:
-        new_width, new_height = target_size
-    else:
-        new_width = int(img.width * scale)
-        new_height = int(img.height * scale)
-
-    upscaled = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    smoothed = upscaled.filter(ImageFilter.GaussianBlur(radius=0.3))
-    sharpened = smoothed.filter(ImageFilter.UnsharpMask(radius=1.5, percent=80, threshold=2))
-    result = Image.blend(upscaled, sharpened, alpha=0.7)
-
-    enhancer = ImageEnhance.Contrast(result)
-    result = enhancer.enhance(1.02)
-
-    return result
+from pipeline import enhanced_upscale
+from pipeline.backend import backend_option, make_client
+from pipeline.errors import classify
+from pipeline.fanout import MATCH_CONCURRENCY, fan_out
+from pipeline.breaker import CircuitBreaker
+from pipeline.client import last_call
+from pipeline.payload import decode_image, load_image, save_image
+from pipeline.session import build_client
+from pipeline.trace import enable_tracing, save_trace, set_trace_attributes, trace_option
+from pipeline.upscale import fit_target_size
 
 
 # ============================================================================
@@ -106,7 +91,10 @@ OUTPUT: High-res matching vintage B&W style."""
 # ============================================================================
 
 def process_newyork(input_images: list, output_dir: Path, client, timestamp: str):
-    """Process all images with New York vintage style (prompt only, no post-processing)."""
+    """
+    Process all images with New York vintage style (prompt only, no post-processing).
+    Photos 2-4 are matched to the master concurrently once it is done.
+    """
 
     style = NEWYORK_STYLE
     print(f"\n{'='*70}")
@@ -115,7 +103,8 @@ def process_newyork(input_images: list, output_dir: Path, client, timestamp: str
     print("NO post-processing - Gemini prompt only")
     print("=" * 70)
 
-    pil_inputs = [Image.open(p) for p in input_images]
+    set_trace_attributes(style="newyork", model="gemini-3-pro-image-preview")
+    pil_inputs = [load_image(p) for p in input_images]
 
     target_width = 2400
     target_height = int(target_width * pil_inputs[0].height / pil_inputs[0].width)
@@ -126,80 +115,65 @@ def process_newyork(input_images: list, output_dir: Path, client, timestamp: str
         response_modalities=[Modality.TEXT, Modality.IMAGE],
     )
 
-    master_output = None
-    output_paths = []
-    max_retries = 3
-    retry_delay = 30  # seconds
-
-    for i in range(len(input_images)):
+    def process_photo(i: int, master_output: Image.Image = None):
+        """Generate and upscale one photo. Returns (saved path, Gemini output)."""
         photo_num = i + 1
+        tag = f"    [{photo_num}/{len(input_images)}]"
+        set_trace_attributes(photo=photo_num)
         print(f"\n  Photo {photo_num}/{len(input_images)}: {input_images[i].name}")
 
         if i == 0:
             prompt = style["prompt_master"]
             contents = [pil_inputs[0], prompt]
-            print("    Creating MASTER style...")
+            print(f"{tag} Creating MASTER style...")
         else:
             prompt = style["prompt_match"]
             contents = [master_output, pil_inputs[i], prompt]
-            print("    Matching to MASTER...")
+            print(f"{tag} Matching to MASTER...")
 
-        # Retry loop for rate limiting
+        # Retries (classified, with backoff) happen inside the client stack
         output_image = None
-        for attempt in range(max_retries):
-            try:
-                response = client.models.generate_content(
-                    model="gemini-3-pro-image-preview",
-                    contents=contents,
-                    config=config,
-                )
-
-                for part in response.candidates[0].content.parts:
-                    if part.inline_data:
-                        output_image = Image.open(BytesIO(part.inline_data.data))
-                        break
-
-                if output_image:
-                    break  # Success, exit retry loop
-
-            except Exception as e:
-                error_str = str(e)
-                if "429" in error_str or "503" in error_str or "RESOURCE_EXHAUSTED" in error_str or "UNAVAILABLE" in error_str:
-                    if attempt < max_retries - 1:
-                        print(f"    Rate limited, waiting {retry_delay}s... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(retry_delay)
-                        continue
-                print(f"    ERROR: {e}")
-                break
+        try:
+            response = client.models.generate_content(
+                model="gemini-3-pro-image-preview",
+                contents=contents,
+                config=config,
+            )
+
+            output_image = decode_image(response)
+
+        except Exception as e:
+            print(f"{tag} ERROR ({classify(e)}): {e}")
 
         if not output_image:
-            print("    FAILED: No image returned")
-            continue
+            print(f"{tag} FAILED: No image returned")
+            return None, None
 
-        print(f"    Gemini output: {output_image.width}x{output_image.height}")
+        info = last_call()
+        print(f"{tag} Gemini output: {output_image.width}x{output_image.height} from {info.model_served}")
+        size = fit_target_size(output_image, (target_width, target_height))
 
         # NO post-processing - use Gemini output directly
 
-        # Save master
-        if i == 0:
-            master_output = output_image
-
         # Upscale
-        print(f"    Upscaling to {target_width}x{target_height}...")
-        upscaled = enhanced_upscale(output_image, target_size=(target_width, target_height))
+        print(f"{tag} Upscaling to {size[0]}x{size[1]}...")
+        upscaled = enhanced_upscale(output_image, target_size=size, color=1.0)
 
         # Save
         output_path = output_dir / f"newyork_{timestamp}_{photo_num}.png"
-        upscaled.save(output_path, "PNG")
-        print(f"    SAVED: {output_path.name} ({upscaled.width}x{upscaled.height})")
-        output_paths.append(output_path)
+        save_image(upscaled, output_path, "PNG")
+        print(f"{tag} SAVED: {output_path.name} ({upscaled.width}x{upscaled.height})")
+        return output_path, output_image
 
-        # Small delay between photos to avoid rate limiting
-        if i < len(input_images) - 1:
-            print("    Waiting 5s before next photo...")
-            time.sleep(5)
+    # Master first; the matches only depend on it, so they go out together
+    master_path, master_output = process_photo(0)
+    if master_output is None:
+        print("    No MASTER output, skipping the remaining photos")
+        return []
 
-    return output_paths
+    matches = fan_out(lambda i: process_photo(i, master_output)[0],
+                      range(1, len(input_images)), MATCH_CONCURRENCY)
+    return [p for p in [master_path] + matches if p]
 
 
 def main():
@@ -209,8 +183,10 @@ def main():
     print("=" * 70)
 
     # Environment
+    backend = backend_option()
+    trace_path = trace_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         print("Run: export GOOGLE_CLOUD_PROJECT=your-project-id")
         return
@@ -239,8 +215,10 @@ def main():
         print(f"  {i}. {p.name} ({img.width}x{img.height})")
 
     # Process
-    client = genai.Client()
+    client = build_client(make_client(backend))
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if trace_path:
+        enable_tracing(session=timestamp, script=Path(__file__).stem)
 
     outputs = process_newyork(input_images, output_dir, client, timestamp)
 
@@ -252,6 +230,9 @@ def main():
     for p in outputs:
         print(f"  {p.name}")
 
+    print("\nCircuit breakers:\n  " + client.layer(CircuitBreaker).describe().replace("\n", "\n  "))
+    if trace_path:
+        save_trace(trace_path)
     print(f"\nOutput directory: {output_dir}")
 
 
@@ -10,7 +10,6 @@ from io import BytesIO
 from datetime import datetime
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality
     from PIL import Image
 except ImportError as e:
@@ -18,6 +17,9 @@ except ImportError as e:
     print("  pip install google-genai Pillow")
     raise e
 
+from pipeline.backend import backend_option, make_client
+from pipeline.session import build_client
+
 # The detailed Purikura prompt from description.md
 PURIKURA_PROMPT = """Act as a "FuRyu-Style Purikura Engine" with Selective Feature Warping.
 Your objective is to apply Japanese Purikura stylization to the eyes, skin, and head shape, while strictly PRESERVING the mouth and expression geometry via masking. Make sure the photo quality is high enough to seem like a real Purikura photo.
@@ -195,6 +197,7 @@ def test_purikura_batch():
     print("=" * 70)
 
     # Check environment
+    backend = backend_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
     location = os.environ.get("GOOGLE_CLOUD_LOCATION", "global")
     use_vertex = os.environ.get("GOOGLE_GENAI_USE_VERTEXAI")
@@ -204,7 +207,7 @@ def test_purikura_batch():
     print(f"  GOOGLE_CLOUD_LOCATION: {location}")
     print(f"  GOOGLE_GENAI_USE_VERTEXAI: {use_vertex or 'NOT SET'}")
 
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         return
 
@@ -239,7 +242,7 @@ def test_purikura_batch():
 
     # Initialize client
     print("\nInitializing Gemini client...")
-    client = genai.Client()
+    client = build_client(make_client(backend))
 
     # Build content with all 4 images + prompt
     print("\nSending batch request to Gemini 3 Pro Preview...")
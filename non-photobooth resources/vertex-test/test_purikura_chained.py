@@ -16,7 +16,6 @@ from io import BytesIO
 from datetime import datetime
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality
     from PIL import Image
 except ImportError as e:
@@ -24,6 +23,10 @@ except ImportError as e:
     print("  pip install google-genai Pillow")
     raise e
 
+from pipeline.backend import backend_option, make_client
+from pipeline.references import describe_references, image_order, references_option
+from pipeline.session import build_client
+
 
 # Base style specification - detailed and consistent
 PURIKURA_STYLE_SPEC = """PURIKURA STYLE SPECIFICATION (FuRyu-Style):
@@ -96,8 +99,8 @@ PROMPT_WITH_REFERENCE = """You are a FuRyu-Style Purikura Engine. Apply Purikura
 {style_spec}
 
 CRITICAL CONSISTENCY REQUIREMENT:
-This is Photo {photo_num} of a 4-photo Purikura session.
-I am providing {num_refs} REFERENCE IMAGE(S) - these are the ALREADY PROCESSED photos from this session.
+This is Photo {photo_num} of this Purikura session.
+I am providing {references} - the ALREADY PROCESSED Photo(s) {shown} from this session.
 
 You MUST match the EXACT SAME:
 - Eye enlargement scale and sparkle style
@@ -127,8 +130,10 @@ def process_chained_photos():
     print("=" * 70)
 
     # Environment setup
+    backend = backend_option()
+    compaction = references_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         return
 
@@ -160,10 +165,11 @@ def process_chained_photos():
         print(f"  Loaded: {p.name} ({img.size[0]}x{img.size[1]})")
 
     # Initialize client
-    client = genai.Client()
+    client = build_client(make_client(backend))
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    # Store generated outputs for reference
+    print(f"References: {compaction.describe()}")
+    # Store generated outputs for reference: (photo number, image)
     generated_outputs = []
     output_paths = []
 
@@ -174,7 +180,7 @@ def process_chained_photos():
         print(f"Processing Photo {photo_num}/4: {input_images[i].name}")
 
         if generated_outputs:
-            print(f"Using {len(generated_outputs)} reference image(s) for style consistency")
+            print(f"Using {len(generated_outputs)} earlier output(s) as references ({compaction.describe()})")
         else:
             print("First photo - establishing MASTER STYLE")
         print("=" * 70)
@@ -185,21 +191,23 @@ def process_chained_photos():
             prompt = PROMPT_FIRST_PHOTO.format(style_spec=PURIKURA_STYLE_SPEC)
             contents = [pil_inputs[0], prompt]
         else:
-            # Subsequent photos - include references
-            image_order_desc = []
-            for ref_idx in range(len(generated_outputs)):
-                image_order_desc.append(f"- Image {ref_idx + 1}: REFERENCE (already processed Photo {ref_idx + 1})")
-            image_order_desc.append(f"- Image {len(generated_outputs) + 1}: TARGET (Photo {photo_num} to process)")
-
+            # Subsequent photos - include references (compacted if configured)
+            references = compaction.compact(generated_outputs)
+            shown = [n for r in references for n in r.photos]
+            shown_text = ", ".join(str(n) for n in shown)
+            if len(shown) < len(generated_outputs):
+                shown_text += f" (the latest {len(shown)} of the {len(generated_outputs)} processed so far)"
             prompt = PROMPT_WITH_REFERENCE.format(
                 style_spec=PURIKURA_STYLE_SPEC,
                 photo_num=photo_num,
-                num_refs=len(generated_outputs),
-                image_order="\n".join(image_order_desc)
+                references=describe_references(references, "REFERENCE IMAGE(S)"),
+                shown=shown_text,
+                image_order=image_order(references, f"TARGET (Photo {photo_num} to process)",
+                                        label="REFERENCE (already processed Photo {photo})")
             )
 
             # Contents: [ref1, ref2, ..., target_photo, prompt]
-            contents = generated_outputs + [pil_inputs[i], prompt]
+            contents = [r.image for r in references] + [pil_inputs[i], prompt]
 
         try:
             print(f"  Sending request with {len(contents) - 1} image(s)...")
@@ -228,7 +236,7 @@ def process_chained_photos():
                 print(f"  SUCCESS: {output_path.name} ({output_image.size[0]}x{output_image.size[1]})")
 
                 # Add to references for next iteration
-                generated_outputs.append(output_image)
+                generated_outputs.append((photo_num, output_image))
                 output_paths.append(output_path)
 
                 if text_response:
@@ -241,14 +249,14 @@ def process_chained_photos():
                     print(f"  Response: {text_response[:500]}")
                 # Still try to continue with remaining photos
                 # Use input as placeholder (not ideal but allows continuation)
-                generated_outputs.append(pil_inputs[i])
+                generated_outputs.append((photo_num, pil_inputs[i]))
 
         except Exception as e:
             print(f"  ERROR: {e}")
             import traceback
             traceback.print_exc()
             # Use input as fallback
-            generated_outputs.append(pil_inputs[i])
+            generated_outputs.append((photo_num, pil_inputs[i]))
 
     # Summary
     print(f"\n{'='*70}")
@@ -18,14 +18,18 @@ from datetime import datetime
 import hashlib
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality, ImageConfig
-    from PIL import Image, ImageEnhance, ImageFilter
+    from PIL import Image
 except ImportError as e:
     print("Missing required packages. Install them with:")
     print("  pip install google-genai Pillow")
     raise e
 
+from pipeline import enhance_purikura_effects, upscale_image
+from pipeline.backend import backend_option, make_client
+from pipeline.references import ReferenceCompaction, image_order, references_option
+from pipeline.session import build_client
+
 
 # ============================================================================
 # SYSTEM INSTRUCTION - Persistent Style Guide
@@ -147,35 +151,6 @@ def get_session_seed(input_paths: list) -> int:
     return int(hashlib.md5(combined.encode()).hexdigest()[:7], 16) % 2147483647
 
 
-def upscale_image(img: Image.Image, scale: float = 1.5) -> Image.Image:
-    """Simple upscaling with sharpening."""
-    new_size = (int(img.width * scale), int(img.height * scale))
-    upscaled = img.resize(new_size, Image.Resampling.LANCZOS)
-
-    # Apply subtle sharpening
-    enhancer = ImageEnhance.Sharpness(upscaled)
-    sharpened = enhancer.enhance(1.2)
-
-    return sharpened
-
-
-def enhance_purikura_effects(img: Image.Image) -> Image.Image:
-    """Post-processing to enhance Purikura characteristics."""
-    # Boost saturation slightly
-    sat_enhancer = ImageEnhance.Color(img)
-    img = sat_enhancer.enhance(1.1)
-
-    # Boost contrast slightly
-    contrast_enhancer = ImageEnhance.Contrast(img)
-    img = contrast_enhancer.enhance(1.05)
-
-    # Boost brightness slightly
-    bright_enhancer = ImageEnhance.Brightness(img)
-    img = bright_enhancer.enhance(1.03)
-
-    return img
-
-
 def process_with_improvements(
     input_images: list,
     output_dir: Path,
@@ -185,9 +160,16 @@ def process_with_improvements(
     use_seed: bool = True,
     use_two_pass: bool = False,
     use_post_processing: bool = True,
-    use_image_config: bool = True
+    use_image_config: bool = True,
+    compaction: ReferenceCompaction = None
 ):
-    """Process images with all improvements enabled."""
+    """
+    Process images with all improvements enabled.
+
+    compaction limits what each request sends of the earlier outputs
+    (pipeline.references); by default every one goes as generated.
+    """
+    compaction = compaction or ReferenceCompaction()
 
     print(f"\n{'='*70}")
     print("IMPROVED PURIKURA PROCESSING")
@@ -196,6 +178,7 @@ def process_with_improvements(
     print(f"Two-Pass Enhancement: {'ON' if use_two_pass else 'OFF'}")
     print(f"Post-Processing: {'ON' if use_post_processing else 'OFF'}")
     print(f"ImageConfig (quality): {'ON' if use_image_config else 'OFF'}")
+    print(f"References: {compaction.describe()}")
     print("=" * 70)
 
     # Load input images
@@ -226,7 +209,7 @@ def process_with_improvements(
 
     config = GenerateContentConfig(**config_params)
 
-    generated_outputs = []
+    generated_outputs = []  # (photo number, image)
     output_paths = []
 
     for i in range(len(input_images)):
@@ -239,17 +222,14 @@ def process_with_improvements(
             contents = [pil_inputs[0], prompt]
             print(f"    Pass 1: Establishing master style...")
         else:
-            image_order = []
-            for ref_idx in range(len(generated_outputs)):
-                image_order.append(f"- Image {ref_idx + 1}: REFERENCE (Photo {ref_idx + 1} output)")
-            image_order.append(f"- Image {len(generated_outputs) + 1}: TARGET (Photo {photo_num} input)")
-
+            references = compaction.compact(generated_outputs)
             prompt = PROMPT_SUBSEQUENT.format(
                 photo_num=photo_num,
-                image_order="\n".join(image_order)
+                image_order=image_order(references, f"TARGET (Photo {photo_num} input)",
+                                        label="REFERENCE (Photo {photo} output)")
             )
-            contents = generated_outputs + [pil_inputs[i], prompt]
-            print(f"    Pass 1: Matching style from {len(generated_outputs)} reference(s)...")
+            contents = [r.image for r in references] + [pil_inputs[i], prompt]
+            print(f"    Pass 1: Matching style from {len(references)} reference(s)...")
 
         try:
             response = client.models.generate_content(
@@ -266,7 +246,7 @@ def process_with_improvements(
 
             if not output_image:
                 print(f"    FAILED: No image returned in pass 1")
-                generated_outputs.append(pil_inputs[i])
+                generated_outputs.append((photo_num, pil_inputs[i]))
                 continue
 
             print(f"    Pass 1 output: {output_image.size[0]}x{output_image.size[1]}")
@@ -305,14 +285,14 @@ def process_with_improvements(
             output_image.save(output_path, "PNG", quality=100)
             print(f"    SAVED: {output_path.name} ({output_image.size[0]}x{output_image.size[1]})")
 
-            generated_outputs.append(output_image)
+            generated_outputs.append((photo_num, output_image))
             output_paths.append(output_path)
 
         except Exception as e:
             print(f"    ERROR: {e}")
             import traceback
             traceback.print_exc()
-            generated_outputs.append(pil_inputs[i])
+            generated_outputs.append((photo_num, pil_inputs[i]))
 
     return output_paths
 
@@ -325,8 +305,10 @@ def main():
     print("=" * 70)
 
     # Environment
+    backend = backend_option()
+    compaction = references_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         return
 
@@ -352,7 +334,7 @@ def main():
         print(f"  {i}. {p.name} ({img.size[0]}x{img.size[1]})")
 
     # Initialize client
-    client = genai.Client()
+    client = build_client(make_client(backend))
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     # Run with all improvements
@@ -369,7 +351,8 @@ def main():
         use_seed=True,
         use_two_pass=False,  # Can enable for extra quality (doubles API calls)
         use_post_processing=True,
-        use_image_config=True
+        use_image_config=True,
+        compaction=compaction
     )
 
     # Summary
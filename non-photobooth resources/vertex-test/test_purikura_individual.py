@@ -10,7 +10,6 @@ from io import BytesIO
 from datetime import datetime
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality
     from PIL import Image
 except ImportError as e:
@@ -18,6 +17,9 @@ except ImportError as e:
     print("  pip install google-genai Pillow")
     raise e
 
+from pipeline.backend import backend_option, make_client
+from pipeline.session import build_client
+
 # Simplified but still detailed Purikura prompt for individual processing
 PURIKURA_STYLE_PROMPT = """Apply Japanese FuRyu-Style Purikura transformation to THIS photo (Photo #{photo_num} of 4).
 
@@ -70,8 +72,9 @@ def process_individual_photos():
     print("=" * 70)
 
     # Environment setup
+    backend = backend_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         return
 
@@ -103,7 +106,7 @@ def process_individual_photos():
         print(f"  Loaded: {p.name} ({img.size[0]}x{img.size[1]})")
 
     # Initialize client
-    client = genai.Client()
+    client = build_client(make_client(backend))
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     results = []
@@ -14,68 +14,19 @@ from io import BytesIO
 from datetime import datetime
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality, ImageConfig
-    from PIL import Image, ImageEnhance, ImageFilter
+    from PIL import Image
 except ImportError as e:
     print("Missing required packages. Install them with:")
     print("  pip install google-genai Pillow")
     raise e
 
-
-# ============================================================================
-# ENHANCED UPSCALING (No ML dependencies)
-# ============================================================================
-
-def enhanced_upscale(img: Image.Image, target_size: tuple = None, scale: float = 2.0) -> Image.Image:
-    """
-    Multi-pass enhanced upscaling for better quality than simple resize.
-    Combines multiple techniques for sharper, cleaner results.
-    """
-    if target_size:
-        new_width, new_height = target_size
-    else:
-        new_width = int(img.width * scale)
-        new_height = int(img.height * scale)
-
-    # Step 1: Initial high-quality upscale
-    upscaled = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-    # Step 2: Slight blur to reduce upscaling artifacts
-    smoothed = upscaled.filter(ImageFilter.GaussianBlur(radius=0.3))
-
-    # Step 3: Unsharp mask for edge enhancement
-    # Create sharpened version
-    sharpened = smoothed.filter(ImageFilter.UnsharpMask(radius=1.5, percent=80, threshold=2))
-
-    # Step 4: Blend original upscale with sharpened (keeps detail without over-sharpening)
-    result = Image.blend(upscaled, sharpened, alpha=0.7)
-
-    # Step 5: Subtle contrast and color enhancement
-    enhancer = ImageEnhance.Contrast(result)
-    result = enhancer.enhance(1.02)
-
-    enhancer = ImageEnhance.Color(result)
-    result = enhancer.enhance(1.03)
-
-    return result
-
-
-def purikura_enhance(img: Image.Image) -> Image.Image:
-    """Apply Purikura-specific enhancements after upscaling."""
-    # Boost saturation for vivid colors
-    enhancer = ImageEnhance.Color(img)
-    img = enhancer.enhance(1.08)
-
-    # Slight brightness boost for that "lit" look
-    enhancer = ImageEnhance.Brightness(img)
-    img = enhancer.enhance(1.02)
-
-    # Subtle sharpness for crisp details
-    enhancer = ImageEnhance.Sharpness(img)
-    img = enhancer.enhance(1.1)
-
-    return img
+from pipeline import enhanced_upscale, purikura_enhance
+from pipeline.backend import backend_option, make_client
+from pipeline.fanout import MATCH_CONCURRENCY, fan_out
+from pipeline.client import last_call
+from pipeline.session import build_client
+from pipeline.upscale import fit_target_size
 
 
 # ============================================================================
@@ -144,7 +95,8 @@ OUTPUT: High resolution image matching reference style perfectly."""
 def process_single_reference(input_images: list, output_dir: Path, client, timestamp: str):
     """
     Process with single reference approach.
-    Only Output 1 is used as reference for all subsequent images.
+    Only Output 1 is used as reference for all subsequent images, so once
+    it is done the remaining photos are matched to it concurrently.
     """
     print(f"\n{'='*70}")
     print("PURIKURA v3 - Single Reference + Enhanced Upscaling")
@@ -171,23 +123,22 @@ def process_single_reference(input_images: list, output_dir: Path, client, times
         )
     )
 
-    master_output = None
-    output_paths = []
-
-    for i in range(len(input_images)):
+    def process_photo(i: int, master_output: Image.Image = None):
+        """Generate and finish one photo. Returns (saved path, Gemini output)."""
         photo_num = i + 1
+        tag = f"    [{photo_num}/{len(input_images)}]"
         print(f"\n  Photo {photo_num}/{len(input_images)}: {input_images[i].name}")
 
         if i == 0:
             # First photo - establish master style
             prompt = PROMPT_MASTER
             contents = [pil_inputs[0], prompt]
-            print("    Creating MASTER style...")
+            print(f"{tag} Creating MASTER style...")
         else:
             # All subsequent photos use ONLY the master as reference
             prompt = PROMPT_MATCH_MASTER
             contents = [master_output, pil_inputs[i], prompt]
-            print("    Matching to MASTER style (single reference)...")
+            print(f"{tag} Matching to MASTER style (single reference)...")
 
         try:
             response = client.models.generate_content(
@@ -203,18 +154,16 @@ def process_single_reference(input_images: list, output_dir: Path, client, times
                     break
 
             if not output_image:
-                print("    FAILED: No image returned")
-                continue
+                print(f"{tag} FAILED: No image returned")
+                return None, None
 
-            print(f"    Gemini output: {output_image.width}x{output_image.height}")
-
-            # Save master for reference
-            if i == 0:
-                master_output = output_image
+            info = last_call()
+            print(f"{tag} Gemini output: {output_image.width}x{output_image.height} from {info.model_served}")
+            size = fit_target_size(output_image, (target_width, target_height))
 
             # Enhanced upscaling
-            print(f"    Upscaling to {target_width}x{target_height}...")
-            upscaled = enhanced_upscale(output_image, target_size=(target_width, target_height))
+            print(f"{tag} Upscaling to {size[0]}x{size[1]}...")
+            upscaled = enhanced_upscale(output_image, target_size=size)
 
             # Purikura-specific enhancement
             enhanced = purikura_enhance(upscaled)
@@ -222,15 +171,24 @@ def process_single_reference(input_images: list, output_dir: Path, client, times
             # Save
             output_path = output_dir / f"purikura_v3_{timestamp}_{photo_num}.png"
             enhanced.save(output_path, "PNG")
-            print(f"    SAVED: {output_path.name} ({enhanced.width}x{enhanced.height})")
-            output_paths.append(output_path)
+            print(f"{tag} SAVED: {output_path.name} ({enhanced.width}x{enhanced.height})")
+            return output_path, output_image
 
         except Exception as e:
-            print(f"    ERROR: {e}")
+            print(f"{tag} ERROR: {e}")
             import traceback
             traceback.print_exc()
+            return None, None
+
+    # Master first; the matches only depend on it, so they go out together
+    master_path, master_output = process_photo(0)
+    if master_output is None:
+        print("    No MASTER output, skipping the remaining photos")
+        return []
 
-    return output_paths
+    matches = fan_out(lambda i: process_photo(i, master_output)[0],
+                      range(1, len(input_images)), MATCH_CONCURRENCY)
+    return [p for p in [master_path] + matches if p]
 
 
 def main():
@@ -240,8 +198,9 @@ def main():
     print("=" * 70)
 
     # Environment
+    backend = backend_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         return
 
@@ -267,7 +226,7 @@ def main():
         print(f"  {i}. {p.name} ({img.width}x{img.height})")
 
     # Process
-    client = genai.Client()
+    client = build_client(make_client(backend))
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     outputs = process_single_reference(input_images, output_dir, client, timestamp)
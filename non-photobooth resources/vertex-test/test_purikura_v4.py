@@ -14,92 +14,16 @@ from io import BytesIO
 from datetime import datetime
 
 try:
-    from google import genai
     from google.genai.types import GenerateContentConfig, Modality, ImageConfig
-    from PIL import Image, ImageEnhance, ImageFilter
+    from PIL import Image
 except ImportError as e:
     print("Missing required packages. Install them with:")
     print("  pip install google-genai Pillow")
     raise e
 
-
-# ============================================================================
-# BACKGROUND PROCESSING
-# ============================================================================
-
-def ensure_white_background(img: Image.Image, threshold: int = 240) -> Image.Image:
-    """
-    Ensure background is pure white.
-    Brightens near-white pixels to #FFFFFF.
-    """
-    # Convert to RGB if needed
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-
-    # Load pixel data
-    pixels = img.load()
-    width, height = img.size
-
-    # Process each pixel
-    for y in range(height):
-        for x in range(width):
-            r, g, b = pixels[x, y]
-            # If pixel is light (near white), make it pure white
-            if r > threshold and g > threshold and b > threshold:
-                pixels[x, y] = (255, 255, 255)
-
-    return img
-
-
-# ============================================================================
-# ENHANCED UPSCALING
-# ============================================================================
-
-def enhanced_upscale(img: Image.Image, target_size: tuple = None, scale: float = 2.0) -> Image.Image:
-    """Multi-pass enhanced upscaling."""
-    if target_size:
-        new_width, new_height = target_size
-    else:
-        new_width = int(img.width * scale)
-        new_height = int(img.height * scale)
-
-    # Step 1: High-quality upscale
-    upscaled = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-    # Step 2: Slight blur to reduce artifacts
-    smoothed = upscaled.filter(ImageFilter.GaussianBlur(radius=0.3))
-
-    # Step 3: Unsharp mask for edge enhancement
-    sharpened = smoothed.filter(ImageFilter.UnsharpMask(radius=1.5, percent=80, threshold=2))
-
-    # Step 4: Blend for balance
-    result = Image.blend(upscaled, sharpened, alpha=0.7)
-
-    # Step 5: Enhancements
-    enhancer = ImageEnhance.Contrast(result)
-    result = enhancer.enhance(1.02)
-
-    enhancer = ImageEnhance.Color(result)
-    result = enhancer.enhance(1.03)
-
-    return result
-
-
-def purikura_enhance(img: Image.Image) -> Image.Image:
-    """Apply Purikura-specific enhancements."""
-    # Boost saturation for vivid colors
-    enhancer = ImageEnhance.Color(img)
-    img = enhancer.enhance(1.08)
-
-    # Slight brightness boost
-    enhancer = ImageEnhance.Brightness(img)
-    img = enhancer.enhance(1.02)
-
-    # Subtle sharpness
-    enhancer = ImageEnhance.Sharpness(img)
-    img = enhancer.enhance(1.1)
-
-    return img
+from pipeline import ensure_white_background, enhanced_upscale, purikura_enhance
+from pipeline.backend import backend_option, make_client
+from pipeline.session import build_client
 
 
 # ============================================================================
@@ -283,8 +207,9 @@ def main():
     print("=" * 70)
 
     # Environment
+    backend = backend_option()
     project = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if not project:
+    if not project and backend.needs_project:
         print("\nError: GOOGLE_CLOUD_PROJECT not set")
         return
 
@@ -310,7 +235,7 @@ def main():
         print(f"  {i}. {p.name} ({img.width}x{img.height})")
 
     # Process
-    client = genai.Client()
+    client = build_client(make_client(backend))
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     outputs = process_with_white_background(input_images, output_dir, client, timestamp)
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The pipeline package lives next to the scripts, not installed
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pipeline import trace  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_trace_attributes():
+    """Trace attributes set by one test must not leak into the next."""
+    token = trace._attributes.set({})
+    yield
+    trace._attributes.reset(token)
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from pipeline.backend import Recorder, ReplayMissError, ReplayModels, ReplayProfile, parse_backend
+from pipeline.errors import classify
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        self.code = code
+        self.status = "UNAVAILABLE"
+        self.details = None
+        super().__init__(f"HTTP {code}")
+
+
+class FakeModels:
+    """Raises the queued errors in order, then answers with an image."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+
+    def generate_content(self, model, contents, config=None):
+        if self.errors:
+            raise self.errors.pop(0)
+        part = SimpleNamespace(text=None, inline_data=SimpleNamespace(data=b"png", mime_type="image/png"))
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+def test_replay_serves_recorded_outcomes_in_order(tmp_path):
+    recorder = Recorder(FakeModels(APIError(503)), tmp_path)
+    with pytest.raises(APIError):
+        recorder.generate_content("model", ["prompt"])
+    recorder.generate_content("model", ["prompt"])
+
+    replay = ReplayModels(tmp_path, ReplayProfile(latency=0))
+    with pytest.raises(Exception) as raised:
+        replay.generate_content("model", ["prompt"])
+    assert classify(raised.value) == classify(APIError(503))
+    response = replay.generate_content("model", ["prompt"])
+    assert response.candidates[0].content.parts[0].inline_data.data == b"png"
+    assert replay.served == 1
+
+
+def test_unrecorded_request_gets_a_synthetic_image(tmp_path):
+    replay = ReplayModels(tmp_path, ReplayProfile(latency=0))
+    response = replay.generate_content("model", ["prompt", Image.new("RGB", (200, 100))])
+    assert response.candidates[0].content.parts[0].inline_data.data
+    assert replay.synthesized == 1
+
+    strict = ReplayModels(tmp_path, ReplayProfile(latency=0, missing="error"))
+    with pytest.raises(ReplayMissError):
+        strict.generate_content("model", ["prompt"])
+
+
+def test_replay_profile_injects_seeded_errors(tmp_path):
+    backend = parse_backend("replay:latency=0,error_rate=1,errors=429,seed=3")
+    replay = ReplayModels(tmp_path, backend.profile)
+    with pytest.raises(Exception) as raised:
+        replay.generate_content("model", ["prompt"])
+    assert raised.value.code == 429
+    assert replay.injected == 1
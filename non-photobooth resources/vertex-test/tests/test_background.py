@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from pipeline.background import ensure_background_color, ensure_white_background
+
+
+def baseline_background(img, target_color, threshold=235, edge_aware=False):
+    """The per-pixel loop ensure_background_color replaced."""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    pixels = img.load()
+    width, height = img.size
+    edge_margin = int(height * 0.15)
+    side_margin = int(width * 0.15)
+    for y in range(height):
+        for x in range(width):
+            is_edge = (y < edge_margin or y > height - edge_margin or
+                       x < side_margin or x > width - side_margin)
+            if edge_aware and not is_edge:
+                continue
+            r, g, b = pixels[x, y]
+            if r > threshold and g > threshold and b > threshold:
+                pixels[x, y] = target_color
+    return img
+
+
+@pytest.fixture(scope="module")
+def photo():
+    # Light pixels scattered around the thresholds; odd sizes test the band edges
+    rng = np.random.default_rng(1)
+    return Image.fromarray(rng.integers(200, 256, (47, 61, 3), dtype=np.uint8), "RGB")
+
+
+@pytest.mark.parametrize("edge_aware", [False, True])
+@pytest.mark.parametrize("threshold", [235, 250])
+def test_background_matches_the_per_pixel_loop(photo, edge_aware, threshold):
+    expected = baseline_background(photo.copy(), (242, 242, 242), threshold, edge_aware)
+    result = ensure_background_color(photo.copy(), (242, 242, 242), threshold, edge_aware)
+    assert result.tobytes() == expected.tobytes()
+
+
+def test_white_background_matches_the_per_pixel_loop(photo):
+    rgba = photo.convert('RGBA')
+    expected = baseline_background(rgba, (255, 255, 255), 240)
+    result = ensure_white_background(rgba)
+    assert result.mode == 'RGB'
+    assert result.tobytes() == expected.tobytes()
@@ -0,0 +1,68 @@
+import pytest
+
+from pipeline.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        self.code = code
+        super().__init__(f"HTTP {code}")
+
+
+class FakeModels:
+    """Raises the queued errors in order, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+
+    def generate_content(self, model, contents, config=None):
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def half_open_breaker(*probe_errors):
+    models = FakeModels(*[APIError(503)] * 4, *probe_errors)
+    breaker = CircuitBreaker(models, window=4, min_calls=4, open_seconds=0)
+    for _ in range(4):
+        with pytest.raises(APIError):
+            breaker.generate_content("model", [])
+    assert breaker.breaker("model").state == OPEN
+    return breaker
+
+
+@pytest.mark.parametrize("code", [429, 400])
+def test_probe_failing_for_non_health_reason_does_not_close(code):
+    breaker = half_open_breaker(APIError(code))
+    with pytest.raises(APIError):
+        breaker.generate_content("model", [])
+    state = breaker.breaker("model")
+    assert state.state == HALF_OPEN
+    assert not state.probing
+    # The next call is the probe; it returns, so the breaker closes
+    assert breaker.generate_content("model", []) == "ok"
+    assert state.state == CLOSED
+
+
+def test_probe_failing_for_health_reason_reopens():
+    breaker = half_open_breaker(APIError(503))
+    with pytest.raises(APIError):
+        breaker.generate_content("model", [])
+    assert breaker.breaker("model").state == OPEN
+
+
+def test_probe_that_returns_closes():
+    breaker = half_open_breaker()
+    assert breaker.generate_content("model", []) == "ok"
+    assert breaker.breaker("model").state == CLOSED
+
+
+def test_interrupted_probe_is_released():
+    breaker = half_open_breaker(KeyboardInterrupt())
+    with pytest.raises(KeyboardInterrupt):
+        breaker.generate_content("model", [])
+    state = breaker.breaker("model")
+    assert state.state == HALF_OPEN
+    assert not state.probing
+    assert breaker.generate_content("model", []) == "ok"
+    assert state.state == CLOSED
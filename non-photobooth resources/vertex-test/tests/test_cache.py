@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+from PIL import Image
+
+from pipeline.cache import ResponseCache, cache_enabled, request_key
+from pipeline.client import CallInfo, last_call, track_call
+
+
+def response(image=True):
+    parts = [SimpleNamespace(text=None, inline_data=SimpleNamespace(data=b"png", mime_type="image/png"))]
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts if image else []))])
+
+
+class FakeModels:
+    def __init__(self, image=True):
+        self.image = image
+        self.calls = 0
+
+    def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        return response(self.image)
+
+
+def test_cache_is_opt_in(monkeypatch):
+    monkeypatch.delenv("GEMINI_CACHE", raising=False)
+    assert not cache_enabled()
+    monkeypatch.setenv("GEMINI_CACHE", "on")
+    assert cache_enabled()
+
+
+def test_request_key_follows_the_pixels():
+    photo = Image.new("RGB", (4, 4), "red")
+    assert request_key("model", ["prompt", photo]) == request_key("model", ["prompt", photo.copy()])
+    assert request_key("model", ["prompt", photo]) != request_key("model", ["prompt", Image.new("RGB", (4, 4))])
+    assert request_key("model", ["prompt"]) != request_key("other", ["prompt"])
+
+
+def test_repeated_request_is_served_from_disk(tmp_path, capsys):
+    models = FakeModels()
+    cache = ResponseCache(models, directory=tmp_path)
+    cache.generate_content("model", ["prompt"])
+    track_call(CallInfo("model"))
+    again = ResponseCache(models, directory=tmp_path).generate_content("model", ["prompt"])
+    assert models.calls == 1
+    assert again.candidates[0].content.parts[0].inline_data.data == b"png"
+    assert last_call().cached
+    assert "Cache: reusing" in capsys.readouterr().out
+
+
+def test_answers_without_an_image_are_not_stored(tmp_path):
+    models = FakeModels(image=False)
+    cache = ResponseCache(models, directory=tmp_path)
+    cache.generate_content("model", ["prompt"])
+    cache.generate_content("model", ["prompt"])
+    assert models.calls == 2
+    assert not list(tmp_path.glob("*.json"))
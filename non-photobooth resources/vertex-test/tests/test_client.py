@@ -0,0 +1,47 @@
+import threading
+from functools import partial
+from types import SimpleNamespace
+
+from pipeline.client import RequestBudget, last_call, with_middleware
+from pipeline.fanout import fan_out
+
+
+class FakeModels:
+    """Records the most calls in flight at once; each call waits at a barrier of `parties`."""
+
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties)
+        self.running = self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            self.barrier.wait(5)
+        finally:
+            with self._lock:
+                self.running -= 1
+        return model
+
+
+def test_request_budget_caps_calls_in_flight():
+    models = FakeModels(parties=2)
+    client = with_middleware(SimpleNamespace(models=models), partial(RequestBudget, max_in_flight=2))
+    results = fan_out(lambda i: client.models.generate_content(model=f"m{i}", contents=[]), range(6), 6)
+    assert results == [f"m{i}" for i in range(6)]
+    assert models.peak == 2
+    assert client.layer(RequestBudget).max_in_flight == 2
+
+
+def test_each_thread_reads_back_its_own_call():
+    models = FakeModels(parties=1)
+    client = with_middleware(SimpleNamespace(models=models, name="client"))
+
+    def call(i):
+        client.models.generate_content(model=f"m{i}", contents=[])
+        return last_call().model_served
+
+    assert fan_out(call, range(3), 3) == ["m0", "m1", "m2"]
+    assert client.name == "client"
@@ -0,0 +1,34 @@
+import threading
+
+from pipeline.fanout import fan_out
+from pipeline.trace import current_attributes, set_trace_attributes
+
+
+def test_results_come_back_in_input_order_under_the_cap():
+    lock = threading.Lock()
+    running = [0, 0]  # now, peak
+    barrier = threading.Barrier(3)
+
+    def call(item):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        if item < 3:
+            barrier.wait(5)  # the first three are in flight together
+        with lock:
+            running[0] -= 1
+        return item * 10
+
+    assert fan_out(call, range(6), max_concurrency=3) == [0, 10, 20, 30, 40, 50]
+    assert running[1] == 3
+
+
+def test_serial_fan_out_stays_on_the_calling_thread():
+    threads = fan_out(lambda _: threading.get_ident(), range(3), max_concurrency=1)
+    assert set(threads) == {threading.get_ident()}
+
+
+def test_workers_see_the_callers_trace_attributes():
+    set_trace_attributes(style="korean")
+    styles = fan_out(lambda _: current_attributes().get("style"), range(3))
+    assert styles == ["korean"] * 3
@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pipeline.grain import GrainBank, add_film_grain
+
+
+def baseline_grain(img, intensity=0.02):
+    """The per-pixel loop add_film_grain replaced."""
+    pixels = img.load()
+    width, height = img.size
+    for y in range(height):
+        for x in range(width):
+            grain = int((random.random() - 0.5) * 255 * intensity * 2)
+            r, g, b = pixels[x, y]
+            new_val = max(0, min(255, r + grain))
+            pixels[x, y] = (new_val, new_val, new_val)
+    return img
+
+
+@pytest.fixture(scope="module")
+def gray():
+    # Mid-gray, so no grain is clipped
+    return Image.new("RGB", (128, 96), (128, 128, 128))
+
+
+@pytest.mark.parametrize("intensity", [0.015, 0.05])
+def test_grain_has_the_per_pixel_loops_distribution(gray, intensity):
+    random.seed(0)
+    expected = np.asarray(baseline_grain(gray.copy(), intensity), dtype=int)[..., 0] - 128
+    grained = np.asarray(add_film_grain(gray, intensity, seed=0), dtype=int)
+    offsets = grained[..., 0] - 128
+    assert (grained[..., 0] == grained[..., 1]).all() and (grained[..., 1] == grained[..., 2]).all()
+    assert expected.min() <= offsets.min() and offsets.max() <= expected.max()
+    assert abs(offsets.mean() - expected.mean()) < 0.1 * max(1, expected.std())
+    assert offsets.std() == pytest.approx(expected.std(), rel=0.05)
+
+
+def test_rgb_input_takes_the_tone_from_the_red_band():
+    img = Image.new("RGB", (8, 8), (200, 10, 10))
+    grained = np.asarray(add_film_grain(img, 0.0, seed=1))
+    assert (grained == 200).all()
+
+
+def test_seeded_grain_is_reproducible_and_cached():
+    img = Image.new("L", (32, 32), 100)
+    bank = GrainBank(max_entries=1)
+    first = add_film_grain(img, 0.02, seed=5, bank=bank)
+    assert first.mode == "L"
+    assert add_film_grain(img, 0.02, seed=5, bank=bank).tobytes() == first.tobytes()
+    assert len(bank) == 1
+    assert add_film_grain(img, 0.02, seed=6, bank=bank).tobytes() != first.tobytes()
+    assert len(bank) == 1
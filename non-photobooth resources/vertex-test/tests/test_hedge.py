@@ -0,0 +1,129 @@
+import threading
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import hedge
+from pipeline.client import ModelsMiddleware, RequestBudget, last_call, with_middleware
+from pipeline.hedge import Hedged
+from pipeline.ratelimit import RateLimited, RateLimiter
+from pipeline.trace import add_span_listener
+
+WAIT = 5  # seconds; only reached if a test is broken
+
+
+def image_response(image=True):
+    parts = [SimpleNamespace(inline_data=SimpleNamespace(data=b"png"))] if image else []
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))])
+
+
+class FakeModels:
+    """
+    The first call is served by "slow" and blocks until release is set;
+    later ones are served by "fast" at once.
+    """
+
+    def __init__(self, image=True):
+        self.image = image
+        self.calls = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.calls += 1
+            first = self.calls == 1
+        if first:
+            assert self.release.wait(WAIT)
+        info = last_call()
+        info.model_served = "slow" if first else "fast"
+        info.retries += 1
+        return image_response(self.image)
+
+
+class Arrivals(ModelsMiddleware):
+    """Releases the fake primary once the duplicate gets here."""
+
+    def __init__(self, inner, models: FakeModels):
+        super().__init__(inner)
+        self.models = models
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.count += 1
+            if self.count == 2:
+                self.models.release.set()
+        return self.inner.generate_content(model=model, contents=contents, config=config)
+
+
+@pytest.fixture(autouse=True)
+def quick_hedges(monkeypatch):
+    monkeypatch.setattr(hedge, "INITIAL_HEDGE_DELAY", 0.05)
+
+
+@pytest.fixture
+def losers():
+    reported = []
+    event = threading.Event()
+
+    def listener(name, seconds, attributes):
+        if name == "hedge_loser":
+            reported.append(attributes)
+            event.set()
+
+    add_span_listener(listener)
+    return SimpleNamespace(reported=reported, event=event)
+
+
+def test_late_loser_does_not_overwrite_the_winners_call_info(losers):
+    models = FakeModels()
+    client = with_middleware(SimpleNamespace(models=models), Hedged)
+    client.models.generate_content(model="model", contents=[])
+    info = last_call()
+    assert (info.model_served, info.retries, info.hedged) == ("fast", 1, True)
+
+    models.release.set()
+    assert losers.event.wait(WAIT)
+    assert models.calls == 2
+    assert (info.model_served, info.retries) == ("fast", 1)
+
+
+def test_loser_waiting_for_a_slot_is_never_sent(losers):
+    models = FakeModels()
+    # One slot: the primary holds it until the duplicate arrives, and the
+    # duplicate can only get it after the primary has settled the race
+    client = with_middleware(SimpleNamespace(models=models),
+                             lambda inner: RequestBudget(inner, 1),
+                             lambda inner: Arrivals(inner, models),
+                             Hedged)
+    client.models.generate_content(model="model", contents=[])
+    assert last_call().model_served == "slow"
+
+    assert losers.event.wait(WAIT)
+    assert models.calls == 1
+    assert losers.reported[-1]["requests"] == 0
+
+
+def test_without_an_image_the_primarys_answer_is_returned():
+    models = FakeModels(image=False)
+    client = with_middleware(SimpleNamespace(models=models), lambda inner: Arrivals(inner, models), Hedged)
+    config = SimpleNamespace(response_modalities=["IMAGE"])
+    response = client.models.generate_content(model="model", contents=[], config=config)
+    assert not response.candidates[0].content.parts
+    assert last_call().model_served == "slow"
+
+
+def test_call_queued_for_a_token_is_not_hedged():
+    models = FakeModels()
+    models.release.set()
+    limiter = RateLimiter(default_rpm=200, burst=1)
+    limiter.acquire("model")  # the next token is 0.3s away
+    client = with_middleware(SimpleNamespace(models=models),
+                             partial(RateLimited, limiter=limiter), Hedged)
+    client.models.generate_content(model="model", contents=[])
+    assert models.calls == 1
+    assert not last_call().hedged
+    assert client.layer(Hedged).hedges == 0
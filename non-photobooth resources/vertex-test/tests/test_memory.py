@@ -0,0 +1,56 @@
+import pytest
+from PIL import Image
+
+from pipeline import memory, trace
+from pipeline.memory import MB, MIN_UPSCALE_MEMORY, REFERENCE_LONG_EDGE, MemoryBudget
+from pipeline.upscale import upscale_footprint
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    """A fixed resident set size, settable by the test."""
+    current = [100 * MB]
+    monkeypatch.setattr(memory, "session_rss_bytes", lambda: current[0])
+    return current
+
+
+def test_references_are_downscaled_only_without_headroom(rss):
+    img = Image.new("RGB", (2048, 1536))
+    assert MemoryBudget(ceiling=2048 * MB).reference(img) is img
+
+    budget = MemoryBudget(ceiling=110 * MB)
+    reference = budget.reference(img)
+    assert reference.size == (REFERENCE_LONG_EDGE, 768)
+    assert budget.downscaled == 1
+
+
+def test_upscales_stream_once_they_no_longer_fit(rss):
+    img = Image.new("RGB", (1024, 768))
+    size = (2400, 1800)
+    budget = MemoryBudget(ceiling=100 * MB + 2 * upscale_footprint(img, size))
+    assert budget.upscale_memory(img, size) is None
+
+    rss[0] += upscale_footprint(img, size) + MB
+    limit = budget.upscale_memory(img, size)
+    assert MIN_UPSCALE_MEMORY <= limit < upscale_footprint(img, size)
+    assert budget.streamed == 1
+    # A caller's own smaller limit is kept
+    assert budget.upscale_memory(img, size, MIN_UPSCALE_MEMORY) == MIN_UPSCALE_MEMORY
+
+
+def test_span_peaks_are_kept_per_stage_and_photo(rss):
+    budget = MemoryBudget()
+    rss[0] = 300 * MB
+    budget.on_span("upscale", 0.1, dict(style="korean", photo=2))
+    rss[0] = 200 * MB
+    budget.on_span("upscale", 0.1, dict(style="korean", photo=3))
+    assert budget.stages == {"upscale": 300 * MB}
+    assert budget.photos[("korean", 2)] == 300 * MB
+    assert "peak 300MB" in budget.describe()
+
+
+def test_closed_budget_stops_listening_to_spans(rss):
+    budget = MemoryBudget(interval=60).start()
+    assert budget.on_span in trace._listeners
+    budget.close()
+    assert budget.on_span not in trace._listeners
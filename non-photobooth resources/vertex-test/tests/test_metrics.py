@@ -0,0 +1,48 @@
+from pipeline.metrics import Metrics, PREFIX
+
+
+def model_call(metrics, seconds, **attributes):
+    metrics.on_span("model_call", seconds, dict(style="korean", model="pro", **attributes))
+
+
+def test_model_calls_are_counted_by_style_and_serving_model():
+    metrics = Metrics()
+    model_call(metrics, 10.0, model_served="flash", retry_categories=["quota"], fallbacks=["quota"],
+               bytes_up=1024, bytes_down=2048)
+    model_call(metrics, 20.0, model_served="pro", failure="unavailable")
+    # Counted from model_call, under the model served
+    metrics.on_span("serialize", 0.1, dict(style="korean", model="pro", bytes=1024))
+    assert metrics.total("call_latency_seconds") == 2
+    assert metrics.total("retries_total") == metrics.total("fallbacks_total") == 1
+    assert metrics.total("failures_total") == 1
+    assert metrics.total("request_bytes_total") == 1024
+
+    summary = metrics.summary()
+    assert summary.startswith("korean:")
+    assert "flash: 1 calls" in summary and "fallbacks quota 1" in summary
+    assert "failures unavailable 1" in summary
+    assert metrics._by("request_bytes_total", "korean", "flash") == {"": 1024}
+
+
+def test_hedge_losers_are_reported():
+    metrics = Metrics()
+    model_call(metrics, 5.0)
+    metrics.on_span("hedge_loser", 1.5, dict(style="korean", model="pro", requests=1))
+    assert "1 lost hedges sent 1 requests, ran 1.5s after the winner" in metrics.summary()
+
+
+def test_nested_post_process_spans_are_not_counted_twice():
+    metrics = Metrics()
+    metrics.on_span("post_process", 2.0, dict(style="newyork"))
+    metrics.on_span("upscale", 1.0, dict(style="newyork", parent="post_process"))
+    assert metrics.total("post_process_seconds") == 1
+
+
+def test_exposition_is_prometheus_text():
+    metrics = Metrics()
+    model_call(metrics, 10.0, model_served="pro")
+    text = metrics.exposition()
+    assert f"# TYPE {PREFIX}call_latency_seconds histogram" in text
+    assert f'{PREFIX}call_latency_seconds_count{{model="pro",style="korean"}} 1' in text
+    assert f'{PREFIX}call_latency_seconds_bucket{{model="pro",style="korean",le="+Inf"}} 1' in text
+    assert text.endswith("\n")
@@ -0,0 +1,86 @@
+import threading
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("google.genai")
+
+from pipeline import payload
+from pipeline.payload import EncodeImages, PayloadCache
+
+
+def noise(seed, size=(64, 48)):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8), "RGB")
+
+
+def test_equal_images_are_encoded_once():
+    cache = PayloadCache()
+    first = cache.part(noise(1))
+    assert cache.part(noise(1)) is first
+    assert cache.part(noise(2)) is not first
+    assert (cache.misses, cache.hits) == (2, 1)
+    assert cache.bytes_reused == len(first.inline_data.data)
+    decoded = Image.open(BytesIO(first.inline_data.data))
+    assert decoded.tobytes() == noise(1).tobytes()
+
+
+def test_jpeg_files_keep_their_encoding(tmp_path):
+    path = tmp_path / "photo.jpg"
+    noise(3).save(path, "JPEG")
+    part = PayloadCache().part(Image.open(path))
+    assert part.inline_data.mime_type == "image/jpeg"
+    assert PayloadCache().part(noise(3)).inline_data.mime_type == "image/png"
+
+
+def test_least_recently_used_parts_are_dropped():
+    size = len(PayloadCache().part(noise(1)).inline_data.data)
+    cache = PayloadCache(max_bytes=int(size * 2.5))
+    for seed in (1, 2, 1, 3):
+        cache.part(noise(seed))
+    assert cache.bytes <= cache.max_bytes
+    cache.part(noise(1))
+    cache.part(noise(2))
+    assert cache.misses == 4  # 2 was dropped, 1 was kept by its reuse
+
+
+def test_concurrent_requests_wait_for_the_first_encode(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    encode = payload.encode_image
+    calls = []
+
+    def slow_encode(img):
+        calls.append(img)
+        started.set()
+        assert release.wait(5)
+        return encode(img)
+
+    monkeypatch.setattr(payload, "encode_image", slow_encode)
+    cache = PayloadCache()
+    parts = []
+    leader = threading.Thread(target=lambda: parts.append(cache.part(noise(1))))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: parts.append(cache.part(noise(1))))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(calls) == 1
+    assert parts[0] is parts[1]
+
+
+def test_middleware_sends_encoded_parts(monkeypatch):
+    monkeypatch.setattr(payload, "PAYLOADS", PayloadCache())
+    sent = []
+
+    class FakeModels:
+        def generate_content(self, model, contents, config=None):
+            sent.extend(contents)
+            return None
+
+    EncodeImages(FakeModels()).generate_content("model", ["prompt", noise(1)])
+    assert sent[0] == "prompt"
+    assert sent[1].inline_data.mime_type == "image/png"
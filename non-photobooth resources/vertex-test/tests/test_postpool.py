@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from pipeline.postpool import PostProcessPool
+from pipeline.postprocess import faded_bw, film_grain, run_post_process, saturation, upscale
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with PostProcessPool(processes=2) as pool:
+        yield pool
+
+
+@pytest.fixture(scope="module")
+def photo():
+    rng = np.random.default_rng(8)
+    return Image.fromarray(rng.integers(0, 256, (90, 120, 3), dtype=np.uint8), "RGB")
+
+
+@pytest.mark.parametrize("ops", [
+    [saturation(1.1), upscale()],
+    [faded_bw(), film_grain(0.015, seed=7), upscale()],
+], ids=["color", "newyork"])
+def test_pool_saves_what_inline_post_processing_returns(pool, photo, ops, tmp_path):
+    expected = run_post_process(ops, photo, (240, 180), workers=1).image
+    saved = pool.submit(ops, photo, (240, 180), tmp_path / "out.png").result(timeout=60)
+    assert saved.size == (240, 180)
+    assert Image.open(saved.path).tobytes() == expected.tobytes()
+
+
+def test_palette_images_are_handed_over_as_rgb(pool, photo, tmp_path):
+    palette = photo.convert("P")
+    saved = pool.submit([upscale()], palette, (240, 180), tmp_path / "out.png").result(timeout=60)
+    expected = run_post_process([upscale()], palette.convert("RGB"), (240, 180), workers=1).image
+    assert Image.open(saved.path).tobytes() == expected.tobytes()
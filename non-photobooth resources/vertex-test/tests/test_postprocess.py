@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+from pipeline.postprocess import (
+    FUSED_TOLERANCE, brightness, contrast, faded_bw, film_grain, run_post_process, saturation, upscale,
+)
+from pipeline.tone import convert_to_faded_bw
+
+
+ENHANCERS = {"saturation": ImageEnhance.Color, "contrast": ImageEnhance.Contrast,
+             "brightness": ImageEnhance.Brightness}
+
+
+def sequential(img, ops):
+    """The ops applied one by one, each clamping its output, in the input's mode."""
+    mode = img.mode
+    for op in ops:
+        if op.name == "faded_bw":
+            img = convert_to_faded_bw(img, op.params["black"], op.params["white"], mode="L")
+        else:
+            img = ENHANCERS[op.name](img).enhance(op.params["factor"])
+    return img.convert(mode)
+
+
+@pytest.fixture(scope="module")
+def photo():
+    # Smooth color gradients with noise, reaching both ends of the range
+    rng = np.random.default_rng(5)
+    y, x = np.mgrid[0:192, 0:256]
+    base = np.stack([x, y * 255 / 191, 255 - x], axis=-1)
+    noisy = base + rng.normal(0, 30, base.shape)
+    return Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8), "RGB")
+
+
+@pytest.mark.parametrize("ops", [
+    [saturation(1.2), contrast(1.1), brightness(0.95)],
+    [saturation(1.2), faded_bw(), contrast(1.1), brightness(0.95)],
+    [saturation(1.5), saturation(0.7)],
+    [brightness(1.3), contrast(1.2)],
+    [contrast(0.8), saturation(1.1)],
+], ids=lambda ops: "+".join(op.name for op in ops))
+def test_fused_tonal_matches_sequential(photo, ops):
+    expected = np.asarray(sequential(photo, ops), dtype=int)
+    fused = np.asarray(run_post_process(ops, photo).image, dtype=int)
+    assert fused.shape == expected.shape
+    assert np.abs(fused - expected).max() <= FUSED_TOLERANCE
+
+
+def test_faded_bw_result_keeps_the_input_mode(photo):
+    ops = [faded_bw(), film_grain(0.015, seed=7), upscale()]
+    result = run_post_process(ops, photo, (384, 288))
+    assert result.image.mode == result.reference.mode == "RGB"
+    assert result.image.size == (384, 288)
+    r, g, b = result.image.split()
+    assert r.tobytes() == g.tobytes() == b.tobytes()
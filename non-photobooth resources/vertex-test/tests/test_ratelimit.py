@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import ratelimit
+from pipeline.client import CallInfo, last_call, track_call
+from pipeline.ratelimit import MIN_RPM, RECOVERY_RPM, RateLimited, RateLimiter, TokenBucket
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        self.code = code
+        super().__init__(f"HTTP {code}")
+
+
+class FakeModels:
+    """Raises the queued errors in order, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+
+    def generate_content(self, model, contents, config=None):
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake clock; sleeping advances it."""
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(ratelimit, "time", SimpleNamespace(monotonic=lambda: now[0], sleep=sleep))
+    return now
+
+
+def test_burst_is_admitted_then_calls_are_paced(clock):
+    bucket = TokenBucket(rpm=30, burst=2)
+    assert bucket.reserve() == bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(2.0)  # 60 / 30 rpm
+    clock[0] += 10
+    assert bucket.reserve() == 0.0
+
+
+def test_acquire_waits_for_its_token(clock):
+    bucket = TokenBucket(rpm=60, burst=1)
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(1.0)
+    assert clock[0] == pytest.approx(1.0)
+
+
+def test_429_halves_the_rate_and_successes_recover_it(clock):
+    bucket = TokenBucket(rpm=10, burst=4)
+    bucket.throttle()
+    assert bucket.rpm == 5
+    assert bucket.reserve() == pytest.approx(12.0)  # bucket emptied, 60 / 5 rpm
+    bucket.recover()
+    assert bucket.rpm == 5 + RECOVERY_RPM
+    for _ in range(100):
+        bucket.recover()
+    assert bucket.rpm == 10
+    for _ in range(10):
+        bucket.throttle()
+    assert bucket.rpm == MIN_RPM
+
+
+def test_middleware_counts_requests_and_learns_from_quota_errors(clock):
+    limiter = RateLimiter(default_rpm=10)
+    client = RateLimited(FakeModels(APIError(429)), limiter)
+    track_call(CallInfo("model"))
+    with pytest.raises(APIError):
+        client.generate_content("model", [])
+    assert limiter.bucket("model").rpm == 5
+    assert client.generate_content("model", []) == "ok"
+    assert limiter.bucket("model").rpm == 5 + RECOVERY_RPM
+    assert last_call().requests == 2
+    assert "1x 429" in limiter.describe()
@@ -0,0 +1,24 @@
+from PIL import Image
+
+from pipeline.references import ReferenceCompaction, describe_references, image_order
+
+
+def outputs(count):
+    return [(n, Image.new("RGB", (64, 48), (n * 40, 0, 0))) for n in range(1, count + 1)]
+
+
+def test_sheet_counts_the_photos_it_shows():
+    references = ReferenceCompaction(sheet=True).compact(outputs(3))
+    assert len(references) == 1
+    assert ReferenceCompaction.photo_count(references) == 3
+    assert describe_references(references).startswith("3 reference images tiled in ONE contact sheet")
+    assert image_order(references, "TARGET").splitlines() == [
+        "- Image 1: REFERENCE contact sheet of processed Photos 1, 2, 3 (left to right, top to bottom)",
+        "- Image 2: TARGET",
+    ]
+
+
+def test_separate_references_count_one_each():
+    references = ReferenceCompaction(window=2).compact(outputs(3))
+    assert ReferenceCompaction.photo_count(references) == 2
+    assert describe_references(references, "REFERENCE IMAGE(S)") == "2 REFERENCE IMAGE(S)"
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline.client import last_call, with_middleware
+from pipeline.errors import retry_after
+from pipeline.responses import has_image
+from pipeline.retry import RetryBudget, Retrying, RetryPolicy
+
+IMAGE_CONFIG = SimpleNamespace(response_modalities=["TEXT", "IMAGE"])
+
+
+def response(*parts, finish_reason=None):
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=list(parts)),
+                                                       finish_reason=finish_reason)])
+
+
+TEXT_ONLY = response(SimpleNamespace(text="Here is your photo", inline_data=None))
+IMAGE = response(SimpleNamespace(text=None, inline_data=SimpleNamespace(data=b"png")))
+
+
+class FakeModels:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def generate_content(self, model, contents, config=None):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def client(models, max_attempts=4, budget=None):
+    policy = RetryPolicy(max_attempts=max_attempts, base_delay=0.0)
+    return with_middleware(SimpleNamespace(models=models),
+                           lambda inner: Retrying(inner, policy=policy, budget=budget))
+
+
+def test_answer_without_image_is_retried_once_outside_the_budget():
+    budget = RetryBudget()
+    models = FakeModels(TEXT_ONLY, IMAGE)
+    result = client(models, budget=budget).models.generate_content(model="m", contents=[], config=IMAGE_CONFIG)
+    assert result is IMAGE
+    assert last_call().retry_categories == ["no_image"]
+
+    empty = response()
+    models = FakeModels(TEXT_ONLY, empty, IMAGE)
+    result = client(models, budget=budget).models.generate_content(model="m", contents=[], config=IMAGE_CONFIG)
+    assert result is empty
+    assert models.calls == 2
+    assert budget.used == 0
+
+
+def test_refusal_is_not_retried():
+    refusal = response(SimpleNamespace(text="I can't help with that", inline_data=None), finish_reason="SAFETY")
+    models = FakeModels(refusal, IMAGE)
+    assert client(models).models.generate_content(model="m", contents=[], config=IMAGE_CONFIG) is refusal
+    assert models.calls == 1
+    assert last_call().retries == 0
+
+
+def test_last_answer_is_returned_once_retries_are_spent():
+    models = FakeModels(TEXT_ONLY, TEXT_ONLY)
+    result = client(models, max_attempts=2).models.generate_content(model="m", contents=[], config=IMAGE_CONFIG)
+    assert result is TEXT_ONLY and not has_image(result)
+    assert models.calls == 2
+
+
+def test_text_only_config_is_not_retried():
+    models = FakeModels(TEXT_ONLY)
+    assert client(models).models.generate_content(model="m", contents=[]) is TEXT_ONLY
+    assert models.calls == 1
+
+
+@pytest.mark.parametrize("header", [".", "1.2.3", "soon"])
+def test_malformed_retry_after_header_is_ignored(header):
+    error = SimpleNamespace(details=None, response=SimpleNamespace(headers={"retry-after": header}))
+    assert retry_after(error) is None
+
+
+def test_retry_after_header_is_parsed():
+    error = SimpleNamespace(details=None, response=SimpleNamespace(headers={"retry-after": "1.5s"}))
+    assert retry_after(error) == 1.5
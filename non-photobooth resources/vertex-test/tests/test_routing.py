@@ -0,0 +1,74 @@
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline.client import CallInfo, last_call, track_call, with_middleware
+from pipeline.ratelimit import RateLimited, RateLimiter
+from pipeline.routing import ModelRouter
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        self.code = code
+        super().__init__(f"HTTP {code}")
+
+
+class FakeModels:
+    """Raises the error queued for a model, else returns the model's name."""
+
+    def __init__(self, **errors):
+        self.errors = errors
+        self.calls = []
+
+    def generate_content(self, model, contents, config=None):
+        self.calls.append(model)
+        if model in self.errors:
+            raise self.errors[model]
+        return model
+
+
+CHAINS = {"pro": ["flash"]}
+
+
+def test_quota_error_falls_back_and_demotes():
+    models = FakeModels(pro=APIError(429))
+    router = ModelRouter(models, chains=CHAINS)
+    track_call(CallInfo("pro"))
+    assert router.generate_content("pro", []) == "flash"
+    assert last_call().model_served == "flash"
+    assert last_call().fallbacks == ["quota"]
+    assert router.fallbacks == {"quota": 1}
+
+    # Demoted: the next call goes straight to the fallback
+    assert router.generate_content("pro", []) == "flash"
+    assert models.calls == ["pro", "flash", "flash"]
+
+
+def test_slow_answer_demotes_without_counting_a_fallback():
+    models = FakeModels()
+    router = ModelRouter(models, chains=CHAINS, latency_slo=-1)
+    assert router.generate_content("pro", []) == "pro"
+    assert router.fallbacks == {}
+    assert router.demotions == {"slo": 1}
+    assert "fallbacks" not in router.describe()
+    assert router.generate_content("pro", []) == "flash"
+
+
+def test_last_model_error_is_raised():
+    models = FakeModels(pro=APIError(503), flash=APIError(503))
+    router = ModelRouter(models, chains=CHAINS)
+    with pytest.raises(APIError):
+        router.generate_content("pro", [])
+    assert models.calls == ["pro", "flash"]
+
+
+def test_time_queued_for_a_token_does_not_demote():
+    models = FakeModels()
+    limiter = RateLimiter(default_rpm=200, burst=1)
+    limiter.acquire("pro")  # the next token is 0.3s away
+    client = with_middleware(SimpleNamespace(models=models), partial(RateLimited, limiter=limiter),
+                             partial(ModelRouter, chains=CHAINS, latency_slo=0.2))
+    assert client.models.generate_content(model="pro", contents=[]) == "pro"
+    assert last_call().latency > 0.2
+    assert client.layer(ModelRouter).demotions == {}
@@ -0,0 +1,83 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("google.genai")
+
+from pipeline.backend import synthesize_response
+from pipeline.postprocess import saturation
+from pipeline.responses import response_from_dict, response_to_dict
+from pipeline.strategies import STRATEGIES, PhotoSession, Strategy, register_strategy, with_image_order
+
+STYLE = {
+    "name": "Test",
+    "system_instruction": "style",
+    "prompt_master": "master prompt",
+    "prompt_match": "match prompt\nImages: [MASTER, TARGET]",
+    "post_process": [saturation(1.1)],
+}
+
+
+class FakeModels:
+    """
+    Answers with one synthetic replay image per image sent (batch requests
+    expect one per input; the others take the first) and keeps the contents.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.calls.append(contents)
+        images = [item for item in contents if isinstance(item, Image.Image)]
+        parts = [part for img in images for part in response_to_dict(synthesize_response([img]))["parts"]]
+        return response_from_dict({"parts": parts})
+
+
+@pytest.fixture
+def session(tmp_path):
+    inputs = [Image.new("RGB", (64, 48), (40 * i, 0, 0)) for i in range(4)]
+    client = SimpleNamespace(models=FakeModels())
+    return PhotoSession(client, "test", STYLE, inputs, tmp_path, "ts")
+
+
+def images_sent(contents):
+    return sum(isinstance(item, Image.Image) for item in contents)
+
+
+@pytest.mark.parametrize("name, calls, images", [
+    ("master", 4, [1, 2, 2, 2]),
+    ("chained", 4, [1, 2, 3, 4]),
+    ("batch", 1, [4]),
+    ("individual", 4, [1, 1, 1, 1]),
+])
+def test_strategies_send_their_requests_and_save_every_photo(session, name, calls, images):
+    paths = STRATEGIES[name]().run(session)
+    assert [p.name for p in paths] == [f"test_ts_{n}.png" for n in range(1, 5)]
+    assert all(p.exists() for p in paths)
+    sent = session.client.models.calls
+    assert len(sent) == calls
+    assert sorted(images_sent(c) for c in sent) == images
+
+
+def test_plugins_register_by_name(session):
+    @register_strategy
+    class FirstOnly(Strategy):
+        name = "first_only"
+
+        def run(self, session):
+            return session.collect([self.photo(session, 0, [session.inputs[0], "prompt"])[0]])
+
+    try:
+        assert [p.name for p in STRATEGIES["first_only"]().run(session)] == ["test_ts_1.png"]
+    finally:
+        del STRATEGIES["first_only"]
+
+
+def test_image_order_line_is_replaced_or_added():
+    assert with_image_order("p\nImages: [A]", ["B", "C"]) == "p\nImages: [B, C]"
+    assert with_image_order("p", ["B"]) == "p\n\nImages: [B]"
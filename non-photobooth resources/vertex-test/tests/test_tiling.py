@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+from pipeline.enhance import enhance_purikura_effects, purikura_enhance
+from pipeline.postprocess import brightness, contrast, run_post_process, saturation, sharpness, upscale
+from pipeline.tiling import split_bands
+from pipeline.upscale import enhanced_upscale
+
+
+def baseline_purikura_enhance(img):
+    """The untiled chain purikura_enhance replaced."""
+    img = ImageEnhance.Color(img).enhance(1.08)
+    img = ImageEnhance.Brightness(img).enhance(1.02)
+    return ImageEnhance.Sharpness(img).enhance(1.1)
+
+
+def baseline_purikura_effects(img):
+    """The untiled chain enhance_purikura_effects replaced."""
+    img = ImageEnhance.Color(img).enhance(1.1)
+    img = ImageEnhance.Contrast(img).enhance(1.05)
+    return ImageEnhance.Brightness(img).enhance(1.03)
+
+
+@pytest.fixture(scope="module", params=["RGB", "RGBA", "L"])
+def photo(request):
+    # Tall enough for three bands, with an odd height
+    rng = np.random.default_rng(6)
+    pixels = rng.integers(0, 256, (203, 150, 4), dtype=np.uint8)
+    return Image.fromarray(pixels, "RGBA").convert(request.param)
+
+
+def test_split_bands_covers_the_frame_once():
+    bands = split_bands(203, count=3, halo=8)
+    assert [(b.start, b.stop) for b in bands] == [(0, 68), (68, 136), (136, 203)]
+    assert bands[1].halo_start == 60 and bands[1].halo_stop == 144
+
+
+@pytest.mark.parametrize("workers", [2, 3, 8])
+def test_purikura_enhance_matches_the_untiled_chain(photo, workers):
+    expected = baseline_purikura_enhance(photo)
+    assert purikura_enhance(photo, workers=workers).tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("workers", [2, 3, 8])
+def test_purikura_effects_match_the_untiled_chain(photo, workers):
+    expected = baseline_purikura_effects(photo)
+    assert enhance_purikura_effects(photo, workers=workers).tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("workers", [2, 3, 8])
+def test_tiled_upscale_matches_one_pass(photo, workers):
+    size = (photo.width * 2 + 1, photo.height * 2 + 1)
+    expected = enhanced_upscale(photo, size, workers=1)
+    assert enhanced_upscale(photo, size, workers=workers).tobytes() == expected.tobytes()
+
+
+def test_tiled_post_process_matches_one_pass(photo):
+    ops = [saturation(1.1), contrast(1.05), brightness(1.03), sharpness(1.1), upscale()]
+    size = (photo.width * 2, photo.height * 2)
+    expected = run_post_process(ops, photo, size, workers=1)
+    result = run_post_process(ops, photo, size, workers=3)
+    assert result.image.tobytes() == expected.image.tobytes()
+    assert result.reference.tobytes() == expected.reference.tobytes()
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from pipeline.tone import convert_to_faded_bw, faded_bw_lut, gamma_curve
+
+
+def baseline_faded_bw(img):
+    """The per-pixel loop convert_to_faded_bw replaced."""
+    bw = img.convert('L')
+    pixels = bw.load()
+    width, height = bw.size
+    for y in range(height):
+        for x in range(width):
+            pixels[x, y] = int(37 + (pixels[x, y] / 255.0) * (235 - 37))
+    return bw.convert('RGB')
+
+
+@pytest.fixture(scope="module")
+def photo():
+    rng = np.random.default_rng(2)
+    return Image.fromarray(rng.integers(0, 256, (96, 128, 3), dtype=np.uint8), "RGB")
+
+
+def test_faded_bw_matches_the_per_pixel_loop(photo):
+    assert convert_to_faded_bw(photo).tobytes() == baseline_faded_bw(photo).tobytes()
+
+
+def test_faded_bw_keeps_l_on_request(photo):
+    bw = convert_to_faded_bw(photo, mode='L')
+    assert bw.mode == 'L'
+    low, high = bw.getextrema()
+    assert 37 <= low and high <= 235
+
+
+def test_equal_gammas_share_a_cached_lut():
+    faded_bw_lut.cache_clear()
+    first = faded_bw_lut(curve=gamma_curve(1.2))
+    assert faded_bw_lut(curve=gamma_curve(1.2)) is first
+    assert faded_bw_lut.cache_info().hits == 1
+    assert faded_bw_lut(curve=gamma_curve(0.8)) != first
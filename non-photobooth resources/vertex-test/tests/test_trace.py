@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from pipeline import trace
+from pipeline.trace import Tracer, set_trace_attributes, span
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    tracer = Tracer()
+    tracer.enabled = True
+    tracer.attributes["session"] = "s1"
+    monkeypatch.setattr(trace, "TRACER", tracer)
+    return tracer
+
+
+def test_spans_carry_attributes_and_their_parent(tracer):
+    set_trace_attributes(style="newyork", photo=2)
+    with span("post_process"):
+        with span("upscale", size="10x10") as attributes:
+            attributes["streamed"] = True
+    inner, outer = tracer.events
+    assert outer["name"] == "post_process" and outer["cat"] == "newyork"
+    assert inner["args"] == {"session": "s1", "style": "newyork", "photo": 2, "size": "10x10",
+                             "parent": "post_process", "streamed": True}
+    assert outer["ts"] <= inner["ts"] and inner["dur"] <= outer["dur"]
+
+
+def test_failed_span_records_the_error(tracer):
+    with pytest.raises(ValueError):
+        with span("decode"):
+            raise ValueError("bad image")
+    assert tracer.events[0]["args"]["error"] == "ValueError"
+
+
+def test_saved_trace_is_chrome_trace_json(tracer, tmp_path):
+    with span("load"):
+        pass
+    path = tmp_path / "trace.json"
+    tracer.save(path)
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [e["ph"] for e in events] == ["M", "X"]
+    assert events[0]["tid"] == events[1]["tid"]
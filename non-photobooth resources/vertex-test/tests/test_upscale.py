@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+from pipeline.upscale import (
+    MIN_STREAM_ROWS, STREAM_TOLERANCE, enhanced_upscale, stream_band_rows, stream_resize, upscale_footprint,
+)
+
+SAMPLE = Path(__file__).resolve().parent.parent / "input" / "Photo on 2025-12-30 at 2.19.jpg"
+
+
+def baseline_upscale(img, target_size):
+    """The unfused chain enhanced_upscale replaced."""
+    upscaled = img.resize(target_size, Image.Resampling.LANCZOS)
+    smoothed = upscaled.filter(ImageFilter.GaussianBlur(radius=0.3))
+    sharpened = smoothed.filter(ImageFilter.UnsharpMask(radius=1.5, percent=80, threshold=2))
+    result = Image.blend(upscaled, sharpened, alpha=0.7)
+    result = ImageEnhance.Contrast(result).enhance(1.02)
+    return ImageEnhance.Color(result).enhance(1.03)
+
+
+def synthetic():
+    # Gradients and noise with a few hard edges
+    rng = np.random.default_rng(3)
+    y, x = np.mgrid[0:150, 0:200]
+    base = np.stack([x * 255 / 199, y * 255 / 149, 128 + 60 * np.sin(x / 9)], axis=-1)
+    img = Image.fromarray(np.clip(base + rng.normal(0, 6, base.shape), 0, 255).astype(np.uint8), "RGB")
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((40, 30, 120, 110), fill=(230, 200, 180))
+    draw.rectangle((130, 60, 180, 140), fill=(20, 30, 40))
+    return img
+
+
+@pytest.fixture(scope="module", params=["synthetic", "sample"])
+def photo(request):
+    if request.param == "synthetic":
+        return synthetic()
+    return Image.open(SAMPLE).convert("RGB").resize((300, 200))
+
+
+def test_fused_upscale_matches_the_unfused_chain(photo):
+    size = (photo.width * 3, photo.height * 3)
+    expected = np.asarray(baseline_upscale(photo, size), dtype=int)
+    fused = np.asarray(enhanced_upscale(photo, size), dtype=int)
+    assert fused.shape == expected.shape
+    diff = np.abs(fused - expected)
+    # The documented tolerance: mean <= 0.6 levels, max 12
+    assert diff.mean() <= 0.6
+    assert diff.max() <= 12
+
+
+@pytest.mark.parametrize("size", [(600, 450), (120, 91)], ids=["up", "down"])
+def test_streamed_resize_matches_the_full_frame_resize(photo, size):
+    expected = np.asarray(photo.resize(size, Image.Resampling.LANCZOS), dtype=int)
+    streamed = stream_resize(photo, size, lambda band: band, workers=2, band_rows=MIN_STREAM_ROWS)
+    assert np.abs(np.asarray(streamed, dtype=int) - expected).max() <= STREAM_TOLERANCE
+
+
+def test_streamed_upscale_matches_the_in_memory_path(photo):
+    size = (photo.width * 3, photo.height * 3)
+    max_memory = upscale_footprint(photo, size) // 2
+    assert stream_band_rows(photo, size, max_memory, workers=2) < size[1]
+    expected = np.asarray(enhanced_upscale(photo, size, workers=2), dtype=int)
+    streamed = np.asarray(enhanced_upscale(photo, size, workers=2, max_memory=max_memory), dtype=int)
+    assert np.abs(streamed - expected).max() <= STREAM_TOLERANCE
+
+
+def test_smaller_ceiling_means_thinner_bands(photo):
+    size = (photo.width * 4, photo.height * 4)
+    footprint = upscale_footprint(photo, size)
+    # The source and output buffers take most of the footprint; bands share the rest
+    assert MIN_STREAM_ROWS < stream_band_rows(photo, size, footprint * 3 // 4, 2) \
+        < stream_band_rows(photo, size, footprint * 9 // 10, 2) < size[1]
+    assert stream_band_rows(photo, size, 0, 2) == MIN_STREAM_ROWS